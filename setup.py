@@ -27,8 +27,18 @@ _config = {
     "package_dir": {"": "src"},
     "packages": find_packages("src"),
     "install_requires": requires,
+    "extras_require": {
+        "http2": ["httpx[http2,brotli]>=0.23"],
+        "arrow": ["pyarrow>=7"],
+        "numpy": ["numpy>=1.17"],
+    },
     "setup_requires": requires,
     "include_package_data": True,
+    "entry_points": {
+        "console_scripts": [
+            "swydo = swydo.cli:main",
+        ],
+    },
     "classifiers": {
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -20,4 +20,16 @@ Example usage:
 """
 from .__version__ import __version__
 from .client import SwydoClient, Enumerations
-
+from .cache import SharedResponseCache
+from .circuit import CircuitBreaker, CircuitOpenError
+from .coalescing import WriteCoalescer
+from .credentials import CredentialProvider, FileCredentials, RotatingCredentials, StaticCredentials
+from .pagination import PageIterator, PageSizeTuner, PaginationCursor, StablePageIterator
+from .hydration import LazyItem, prefetch
+from .index import LocalIndex
+from .models import Model
+from .onboarding import ClientOnboarder, OnboardingSpec
+from .reconcile import DataSourceReconciler
+from .recorder import FlightRecorder
+from .refresh import CatalogRefresher, CatalogSnapshot
+from .retry import DeadlineExceeded, RetryPolicy, deadline
@@ -0,0 +1,8 @@
+"""
+Allows running the swydo exporter with: python -m swydo
+"""
+
+from .cli import main
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,370 @@
+"""
+Response cache shared by all processes on a host, e.g. the workers of a web server.
+
+Example usage:
+
+    from swydo.cache import SharedResponseCache
+
+    # In every worker process
+    swydoClient = SwydoClient(apiKey, responseCache=SharedResponseCache('/dev/shm/swydo-responses', ttl=300))
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+# Single entity reads, cached by default
+CACHED_OPERATIONS = frozenset((
+    'getTeam', 'getTeamUser', 'getTeamBrandTemplate', 'getTeamReportTemplate', 'getTeamConnection', 'getTeamClient',
+    'getClientDataSources', 'getTeamReport',
+))
+
+# The cached read each write operation makes stale, and the parameters identifying the entity it changed
+INVALIDATED_BY = dict(
+    updateTeamClient=('getTeamClient', ('teamId', 'clientId')),
+    archiveTeamClient=('getTeamClient', ('teamId', 'clientId')),
+    unarchiveTeamClient=('getTeamClient', ('teamId', 'clientId')),
+    setClientDataSourceFacebookAds=('getClientDataSources', ('teamId', 'clientId')),
+    removeClientDataSourceFacebookAds=('getClientDataSources', ('teamId', 'clientId')),
+    setClientDataSourceFacebookGraph=('getClientDataSources', ('teamId', 'clientId')),
+    removeClientDataSourceFacebookGraph=('getClientDataSources', ('teamId', 'clientId')),
+    setClientDataSourceGoogleAdWords=('getClientDataSources', ('teamId', 'clientId')),
+    removeClientDataSourceGoogleAdWords=('getClientDataSources', ('teamId', 'clientId')),
+    setClientDataSourceGoogleAnalytics=('getClientDataSources', ('teamId', 'clientId')),
+    removeClientDataSourceGoogleAnalytics=('getClientDataSources', ('teamId', 'clientId')),
+    updateTeamReport=('getTeamReport', ('teamId', 'reportId')),
+    deleteTeamReport=('getTeamReport', ('teamId', 'reportId')),
+    shareTeamReport=('getTeamReport', ('teamId', 'reportId')),
+    unshareTeamReport=('getTeamReport', ('teamId', 'reportId')),
+)
+
+
+class SharedResponseCache(object):
+    """
+    Cache of API responses in a memory-mapped file, shared by all processes that open the same path, with per-entry
+    expiry and least recently used eviction.
+
+    The file is a fixed-size hash table: each key maps to a set of `ways` slots of `slotSize` bytes, and a new entry
+    replaces an expired entry of its set, or else the least recently used one. Values are stored as JSON, and
+    compressed when that makes them smaller; values that don't fit in a slot are not cached. Sets are locked with POSIX
+    record locks, striped over the file, so processes only contend when they use the same sets.
+
+    Put the file on a memory-backed file system (e.g. /dev/shm, the default on Linux) to keep it out of disk I/O. It is
+    created readable by the current user only, as it holds API responses. All processes opening a path must use the
+    same geometry (maxEntries, slotSize and ways). Instances of the same path in a process share its file descriptor
+    and locks.
+
+    Pass an instance to SwydoClient(responseCache=...). An instance may be shared by several clients, even of
+    different API keys, whose entries are kept apart.
+    """
+
+    def __init__(
+            self,
+            path: Optional[str] = None,
+            maxEntries: int = 4096,
+            slotSize: int = 4096,
+            ways: int = 8,
+            ttl: float = 60.0,
+            operations: Iterable[str] = CACHED_OPERATIONS,
+            clock: Callable[[], float] = time.time
+    ) -> None:
+        """
+        :param path: Path of the cache file, created if missing. Defaults to a file per user in /dev/shm, or in the
+                     temporary directory where there is no /dev/shm.
+        :param maxEntries: Number of slots, rounded up to a multiple of `ways`.
+        :param slotSize: Bytes per slot, including a header of 40 bytes. Larger responses are not cached.
+        :param ways: Number of slots a key may be stored in. More ways evict closer to LRU, but make lookups slower.
+        :param ttl: Seconds an entry is used for after it was stored.
+        :param operations: Operation ids to cache. Only reads may be cached.
+        :param clock: Wall clock, in seconds - shared by processes, unlike a monotonic clock.
+        """
+        if fcntl is None:  # pragma: no cover
+            raise NotImplementedError("SharedResponseCache requires POSIX file locks.")
+        if ways < 1 or maxEntries < 1:
+            raise ValueError("maxEntries and ways must be at least 1.")
+        if slotSize <= _SLOT_HEADER.size:
+            raise ValueError("slotSize must be larger than %d bytes." % _SLOT_HEADER.size)
+        if ttl <= 0:
+            raise ValueError("ttl must be positive.")
+
+        if path is None:
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(directory, 'swydo-responses-%d' % os.getuid())
+
+        self._path = path
+        self._realPath = os.path.realpath(path)
+        self._sets = -(-maxEntries // ways)
+        self._ways = ways
+        self._slotSize = slotSize
+        self._ttl = ttl
+        self._operations = frozenset(operations)
+        self._clock = clock
+        self._statsLock = threading.Lock()
+        self._stats: Dict[str, int] = dict(hits=0, misses=0, stores=0, evictions=0, tooLarge=0, invalidations=0)
+
+        size = _FILE_HEADER.size + self._sets * ways * slotSize
+        with _openFilesLock:
+            cacheFile = _openFiles.get(self._realPath)
+            if cacheFile is None:
+                cacheFile = _CacheFile(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), min(self._sets, _LOCK_STRIPES))
+            self._fd = cacheFile.fd
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, _FILE_HEADER.size, 0)
+                try:
+                    self._prepareFile(size)
+                finally:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, _FILE_HEADER.size, 0)
+                self._mmap = mmap.mmap(self._fd, size)
+            except BaseException:
+                if not cacheFile.users:
+                    os.close(cacheFile.fd)
+                raise
+            cacheFile.users += 1
+            _openFiles[self._realPath] = cacheFile
+        self._cacheFile: Optional['_CacheFile'] = cacheFile
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def isCached(self, operationId: str) -> bool:
+        return operationId in self._operations
+
+    def makeKey(self, namespace: str, operationId: str, params: Dict[str, Any]) -> bytes:
+        """
+        Returns the key of the response of a call.
+
+        :param namespace: Keeps apart the entries of different API accounts, e.g. a digest of the API key.
+        """
+
+        encoded = json.dumps([namespace, operationId, params], sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.blake2b(encoded.encode(), digest_size=_DIGEST_SIZE).digest()
+
+    def get(self, key: bytes) -> Optional[Any]:
+        """
+        Returns the value of an entry, or None if it is missing or expired.
+        """
+
+        setIndex = self._getSetIndex(key)
+        now = self._clock()
+        with self._lockSet(setIndex):
+            for offset in self._getSlotOffsets(setIndex):
+                digest, expiresAt, _, length, flags = _SLOT_HEADER.unpack_from(self._mmap, offset)
+                if digest == key and now < expiresAt:
+                    _SLOT_HEADER.pack_into(self._mmap, offset, digest, expiresAt, now, length, flags)
+                    start = offset + _SLOT_HEADER.size
+                    payload = self._mmap[start:start + length]
+                    break
+            else:
+                self._countStat('misses')
+                return None
+
+        try:
+            if flags & _COMPRESSED:
+                payload = zlib.decompress(payload)
+            value = json.loads(payload)
+        except (zlib.error, ValueError):
+            # Garbled by a writer outside of this class: a miss, rather than an error of the call
+            self._countStat('misses')
+            return None
+        self._countStat('hits')
+        return value
+
+    def set(self, key: bytes, value: Any, ttl: Optional[float] = None) -> bool:
+        """
+        Stores an entry, replacing the one of the same key, or else an expired or the least recently used entry of its
+        set.
+
+        :param value: A JSON serializable value, e.g. an API response.
+        :param ttl: Seconds the entry is used for, instead of the cache's ttl.
+        :return: Whether the value fit in a slot, and was stored.
+        """
+
+        payload = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        flags = 0
+        if len(payload) > _COMPRESSION_THRESHOLD:
+            compressed = zlib.compress(payload, 1)
+            if len(compressed) < len(payload):
+                payload, flags = compressed, _COMPRESSED
+        if len(payload) > self._slotSize - _SLOT_HEADER.size:
+            self._countStat('tooLarge')
+            return False
+
+        setIndex = self._getSetIndex(key)
+        now = self._clock()
+        with self._lockSet(setIndex):
+            victim = None
+            victimRank: Tuple[bool, float] = (True, 0.0)
+            for offset in self._getSlotOffsets(setIndex):
+                digest, expiresAt, lastUsed, _, _ = _SLOT_HEADER.unpack_from(self._mmap, offset)
+                if digest == key or expiresAt <= now:
+                    # Same key, expired or empty: no live entry is lost
+                    victim, victimRank = offset, (False, 0.0)
+                    break
+                # Least recently used live entry so far
+                if victim is None or (True, lastUsed) < victimRank:
+                    victim, victimRank = offset, (True, lastUsed)
+            start = victim + _SLOT_HEADER.size
+            self._mmap[start:start + len(payload)] = payload
+            _SLOT_HEADER.pack_into(
+                self._mmap, victim, key, now + (self._ttl if ttl is None else ttl), now, len(payload), flags
+            )
+
+        self._countStat('stores')
+        if victimRank[0]:
+            self._countStat('evictions')
+        return True
+
+    def delete(self, key: bytes) -> None:
+        setIndex = self._getSetIndex(key)
+        with self._lockSet(setIndex):
+            for offset in self._getSlotOffsets(setIndex):
+                if self._mmap[offset:offset + _DIGEST_SIZE] == key:
+                    _SLOT_HEADER.pack_into(self._mmap, offset, bytes(_DIGEST_SIZE), 0.0, 0.0, 0, 0)
+        self._countStat('invalidations')
+
+    def clear(self) -> None:
+        """
+        Removes all entries, for all processes.
+        """
+
+        for setIndex in range(self._sets):
+            with self._lockSet(setIndex):
+                for offset in self._getSlotOffsets(setIndex):
+                    _SLOT_HEADER.pack_into(self._mmap, offset, bytes(_DIGEST_SIZE), 0.0, 0.0, 0, 0)
+
+    def getStats(self) -> Dict[str, int]:
+        """
+        Returns the number of hits, misses, stores, evictions of live entries, values too large to cache and
+        invalidations, of this process.
+        """
+
+        with self._statsLock:
+            return dict(self._stats)
+
+    def close(self) -> None:
+        if self._cacheFile is None:
+            return
+        self._mmap.close()
+        with _openFilesLock:
+            self._cacheFile.users -= 1
+            if not self._cacheFile.users:
+                # Closing any descriptor of the file releases all record locks of the process on it, so only the last
+                # instance does
+                del _openFiles[self._realPath]
+                os.close(self._fd)
+        self._cacheFile = None
+
+    # ==================================================================================================================
+    # Private Members
+    # ==================================================================================================================
+
+    def _prepareFile(self, size: int) -> None:
+        geometry = (_MAGIC, _FORMAT_VERSION, self._sets, self._ways, self._slotSize)
+        if os.fstat(self._fd).st_size == 0:
+            # Slots of a new file are zeroed, hence empty
+            os.ftruncate(self._fd, size)
+            os.pwrite(self._fd, _FILE_HEADER.pack(*geometry), 0)
+            return
+        header = os.pread(self._fd, _FILE_HEADER.size, 0)
+        if len(header) < _FILE_HEADER.size or _FILE_HEADER.unpack(header) != geometry or \
+                os.fstat(self._fd).st_size != size:
+            raise ValueError(
+                "Cache file %s was created with a different format or geometry (maxEntries, slotSize or ways)."
+                % self._path
+            )
+
+    def _getSetIndex(self, key: bytes) -> int:
+        return int.from_bytes(key[:8], 'little') % self._sets
+
+    def _getSlotOffsets(self, setIndex: int) -> range:
+        start = _FILE_HEADER.size + setIndex * self._ways * self._slotSize
+        return range(start, start + self._ways * self._slotSize, self._slotSize)
+
+    def _lockSet(self, setIndex: int) -> '_SetLock':
+        threadLocks = self._cacheFile.threadLocks
+        stripe = setIndex % len(threadLocks)
+        return _SetLock(self._fd, threadLocks[stripe], _FILE_HEADER.size + stripe)
+
+    def _countStat(self, name: str) -> None:
+        with self._statsLock:
+            self._stats[name] += 1
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+_MAGIC = b'SWYDOCCH'
+_FORMAT_VERSION = 2
+# Magic, format version, number of sets, ways and slot size, padded to 64 bytes
+_FILE_HEADER = struct.Struct('<8sIIII40x')
+# Key digest, expiry and last use times, payload length and flags, padded to 40 bytes
+_SLOT_HEADER = struct.Struct('<16sddIB3x')
+_DIGEST_SIZE = 16
+_COMPRESSED = 1
+# Smaller values are stored as is, compressing them rarely pays off
+_COMPRESSION_THRESHOLD = 256
+# Number of record locks sets are striped over - each locks a single byte past the file header
+_LOCK_STRIPES = 64
+
+
+class _CacheFile(object):
+    """
+    A cache file opened by this process. Record locks belong to the process, and closing any descriptor of the file
+    releases all of them, so all instances of the file share a descriptor, and take a thread lock per stripe to exclude
+    each other.
+    """
+
+    __slots__ = ('fd', 'threadLocks', 'users')
+
+    def __init__(self, fd: int, stripes: int) -> None:
+        self.fd = fd
+        self.threadLocks = [threading.Lock() for _ in range(stripes)]
+        self.users = 0
+
+
+# Cache files opened by this process, by real path
+_openFiles: Dict[str, _CacheFile] = dict()
+_openFilesLock = threading.Lock()
+
+
+class _SetLock(object):
+
+    __slots__ = ('_fd', '_threadLock', '_position')
+
+    def __init__(self, fd: int, threadLock: threading.Lock, position: int) -> None:
+        self._fd = fd
+        self._threadLock = threadLock
+        self._position = position
+
+    def __enter__(self) -> None:
+        self._threadLock.acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, self._position)
+        except BaseException:
+            self._threadLock.release()
+            raise
+
+    def __exit__(self, *args: Any) -> None:
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self._position)
+        finally:
+            self._threadLock.release()
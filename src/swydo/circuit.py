@@ -0,0 +1,244 @@
+"""
+Circuit breaking of Swydo API calls, to fail fast during outages.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple, Type
+
+from .retry import TRANSIENT_ERRORS, DeadlineExceeded
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a call while its circuit is open.
+    """
+
+    def __init__(self, key: Hashable, retryAfter: float) -> None:
+        super().__init__("Swydo circuit %s is open, retry in %.1f seconds." % (key, retryAfter))
+        self.key = key
+        self.retryAfter = retryAfter
+
+
+class CircuitBreaker(object):
+    """
+    Thread-safe circuit breaker, tracking the calls to a host, or to each of its operations.
+
+    A circuit is closed while calls succeed. Once at least `minimumCalls` of its last `windowSize` calls were made, and
+    `failureRate` of them or more failed with a server, connection or timeout error, it opens: calls fail right away
+    with CircuitOpenError, without waiting for a timeout or retrying. After `openDuration` seconds, it is half-open:
+    up to `halfOpenCalls` trial calls go through. If they all succeed, the circuit closes, and if any fails, it opens
+    again.
+
+    Client errors and throttling (HTTP 4xx) mean the server is up, and count as successes. Calls that ran out of their
+    deadline before being sent (DeadlineExceeded) tell nothing about the server, and don't count at all.
+
+    Pass an instance to SwydoClient(circuitBreaker=...). An instance may be shared by several clients.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'halfOpen'
+
+    def __init__(
+            self,
+            failureRate: float = 0.5,
+            minimumCalls: int = 10,
+            windowSize: int = 20,
+            openDuration: float = 30.0,
+            halfOpenCalls: int = 1,
+            perOperation: bool = False,
+            failureErrors: Tuple[Type[Exception], ...] = TRANSIENT_ERRORS,
+            clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        """
+        :param failureRate: Share of failed calls, between 0 and 1, at which a circuit opens.
+        :param minimumCalls: Least number of calls in the window before a circuit may open.
+        :param windowSize: Number of most recent calls of a circuit the failure rate is computed over.
+        :param openDuration: Seconds a circuit stays open before trial calls are let through.
+        :param halfOpenCalls: Number of trial calls that must succeed to close a circuit.
+        :param perOperation: Track each operation of a host separately, instead of the host as a whole.
+        :param failureErrors: Errors that count as failures.
+        :param clock: Monotonic clock, in seconds.
+        """
+        if not 0 < failureRate <= 1:
+            raise ValueError("failureRate must be between 0 and 1.")
+        if not 1 <= minimumCalls <= windowSize:
+            raise ValueError("minimumCalls must be at least 1, and at most windowSize.")
+        if halfOpenCalls < 1:
+            raise ValueError("halfOpenCalls must be at least 1.")
+
+        self._failureRate = failureRate
+        self._minimumCalls = minimumCalls
+        self._windowSize = windowSize
+        self._openDuration = openDuration
+        self._halfOpenCalls = halfOpenCalls
+        self._perOperation = perOperation
+        self._failureErrors = failureErrors
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._circuits: Dict[Hashable, _Circuit] = dict()
+
+    def getKey(self, host: str, operationId: str) -> Hashable:
+        """
+        Returns the key of the circuit of the calls of an operation to a host.
+        """
+
+        return (host, operationId) if self._perOperation else host
+
+    def getState(self, key: Hashable) -> str:
+        """
+        Returns the state of a circuit: CLOSED, OPEN or HALF_OPEN.
+        """
+
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                return self.CLOSED
+            if circuit.state == self.OPEN and self._clock() - circuit.openedAt >= self._openDuration:
+                return self.HALF_OPEN
+            return circuit.state
+
+    def getStats(self) -> Dict[Hashable, Dict[str, Any]]:
+        """
+        Returns the state of each circuit, the failures and calls in its window, and the number of calls it rejected.
+        """
+
+        with self._lock:
+            keys = list(self._circuits)
+        stats = dict()
+        for key in keys:
+            state = self.getState(key)
+            with self._lock:
+                circuit = self._circuits[key]
+                stats[key] = dict(
+                    state=state,
+                    calls=len(circuit.outcomes),
+                    failures=sum(circuit.outcomes),
+                    rejected=circuit.rejected,
+                    opened=circuit.opened,
+                )
+        return stats
+
+    def isOpen(self, key: Hashable) -> bool:
+        """
+        Returns whether calls of a circuit are rejected right now, without reserving a trial call.
+        """
+
+        return self.getState(key) == self.OPEN
+
+    def acquire(self, key: Hashable) -> None:
+        """
+        Asks to make a call. Every successful acquisition must be followed by `release`.
+
+        :raise CircuitOpenError: The circuit is open, or half-open with all its trial calls in flight.
+        """
+
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                circuit = self._circuits[key] = _Circuit(self._windowSize)
+
+            if circuit.state == self.CLOSED:
+                return
+
+            now = self._clock()
+            if circuit.state == self.OPEN:
+                retryAfter = circuit.openedAt + self._openDuration - now
+                if retryAfter > 0:
+                    circuit.rejected += 1
+                    raise CircuitOpenError(key, retryAfter)
+                circuit.state = self.HALF_OPEN
+                circuit.trials = circuit.trialSuccesses = 0
+                logging.info('Swydo circuit %s is half-open, trying calls.', key)
+
+            if circuit.trials >= self._halfOpenCalls:
+                circuit.rejected += 1
+                raise CircuitOpenError(key, 0.0)
+            circuit.trials += 1
+
+    def release(self, key: Hashable, error: Optional[BaseException] = None) -> None:
+        """
+        Reports the outcome of an acquired call.
+
+        :param error: Error of the call, or None if it succeeded.
+        """
+
+        failed = isinstance(error, self._failureErrors)
+
+        with self._lock:
+            circuit = self._circuits[key]
+            now = self._clock()
+
+            if isinstance(error, DeadlineExceeded):
+                # Never reached the server: give the trial slot to another call
+                if circuit.state == self.HALF_OPEN and circuit.trials > 0:
+                    circuit.trials -= 1
+                return
+
+            if circuit.state == self.HALF_OPEN:
+                if failed:
+                    self._open(key, circuit, now)
+                    return
+                circuit.trialSuccesses += 1
+                if circuit.trialSuccesses >= self._halfOpenCalls:
+                    circuit.state = self.CLOSED
+                    circuit.outcomes.clear()
+                    logging.warning('Swydo circuit %s is closed again.', key)
+                return
+
+            if circuit.state == self.OPEN:
+                # A call made before the circuit opened
+                return
+
+            circuit.outcomes.append(failed)
+            if len(circuit.outcomes) >= self._minimumCalls and \
+                    sum(circuit.outcomes) >= self._failureRate * len(circuit.outcomes):
+                self._open(key, circuit, now)
+
+    def call(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """
+        Makes a call through a circuit.
+
+        :raise CircuitOpenError: The circuit is open.
+        """
+
+        self.acquire(key)
+        try:
+            result = function()
+        except BaseException as e:
+            self.release(key, e)
+            raise
+        self.release(key)
+        return result
+
+    def _open(self, key: Hashable, circuit: '_Circuit', now: float) -> None:
+        circuit.state = self.OPEN
+        circuit.openedAt = now
+        circuit.opened += 1
+        logging.warning('Swydo circuit %s is open for %.1f seconds, failing calls fast.', key, self._openDuration)
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+class _Circuit(object):
+
+    __slots__ = ('state', 'outcomes', 'openedAt', 'trials', 'trialSuccesses', 'rejected', 'opened')
+
+    def __init__(self, windowSize: int) -> None:
+        self.state = CircuitBreaker.CLOSED
+        # Whether each of the last calls failed
+        self.outcomes: Deque[bool] = deque(maxlen=windowSize)
+        self.openedAt = 0.0
+        self.trials = 0
+        self.trialSuccesses = 0
+        self.rejected = 0
+        self.opened = 0
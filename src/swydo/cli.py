@@ -0,0 +1,442 @@
+"""
+Command line interface for bulk exports of Swydo entities.
+
+Usage examples:
+
+    .. code-block:: sh
+
+        # Everything, for all teams, as NDJSON on stdout
+        swydo --api-key ... > export.ndjson
+
+        # Clients and reports of two teams, as CSV files, resuming a previous run
+        swydo --team TEAM1 --team TEAM2 --entities clients,reports --format csv --output-dir export --resume
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from .client import SwydoClient
+from .pagination import PageIterator, PaginationCursor
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+ENTITIES = ('teams', 'clients', 'dataSources', 'reports', 'brandTemplates', 'reportTemplates')
+"""Entities that can be exported."""
+
+STATE_FILE_NAME = '.swydo-export-state.json'
+"""Name of the file, in the output directory, that tracks export progress for resuming."""
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Run the exporter.
+
+    :param argv: Command line arguments, defaults to sys.argv.
+    :return: Process exit code.
+    """
+
+    args = _parseArguments(argv)
+
+    apiKey = args.api_key or os.environ.get('SWYDO_API_KEY')
+    if not apiKey:
+        sys.stderr.write("An API key is required, using --api-key or the SWYDO_API_KEY environment variable.\n")
+        return 2
+
+    entities = _parseEntities(args.entities)
+    if args.format == 'csv' and not args.output_dir and len(entities) > 1:
+        sys.stderr.write("CSV output of more than one entity requires --output-dir.\n")
+        return 2
+    if args.resume and not args.output_dir:
+        sys.stderr.write("--resume requires --output-dir.\n")
+        return 2
+
+    swydoClient = SwydoClient(
+        apiKey=apiKey,
+        maxCallsPerSecond=args.rate,
+        adaptiveRate=args.adaptive_rate,
+        pageSize=args.page_size,
+        apiUrl=args.api_url,
+    )
+
+    state = _ExportState(os.path.join(args.output_dir, STATE_FILE_NAME) if args.output_dir else None, args.resume)
+    sinks = _Sinks(entities=entities, fileFormat=args.format, outputDir=args.output_dir, append=args.resume)
+    progress = _Progress(swydoClient=swydoClient, interval=0 if args.quiet else args.progress_interval)
+
+    exporter = _Exporter(
+        swydoClient=swydoClient,
+        sinks=sinks,
+        state=state,
+        progress=progress,
+        concurrency=args.concurrency,
+    )
+
+    progress.start()
+    try:
+        exporter.run(entities=entities, teamIds=args.team)
+    finally:
+        progress.stop()
+        sinks.close()
+        state.save()
+
+    return 0
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+_CSV_FIELDS: Dict[str, List[str]] = dict(
+    teams=['id', 'name', 'owner', 'timezone', 'createdAt', 'cancelled', 'cancelledAt', 'defaultBrandTemplateId',
+           'clientLimit'],
+    clients=['teamId', 'id', 'name', 'email', 'description', 'archived'],
+    dataSources=['teamId', 'clientId', 'providerId', 'connectionId', 'scope'],
+    reports=['teamId', 'id', 'name', 'clientId', 'authorId', 'brandTemplateId', 'reportTemplateId', 'comparePeriod',
+             'subtitle', 'sharedLink'],
+    brandTemplates=['teamId', 'id', 'name'],
+    reportTemplates=['teamId', 'id', 'name', 'authorId', 'brandTemplateId', 'comparePeriod', 'description',
+                     'subtitle'],
+)
+
+
+def _parseArguments(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='swydo', description="Export Swydo entities as NDJSON or CSV.")
+    parser.add_argument('--api-key', help="Swydo API key (default: $SWYDO_API_KEY).")
+    parser.add_argument('--api-url', help=argparse.SUPPRESS)
+    parser.add_argument('--team', action='append', help="Team to export, can be repeated (default: all teams).")
+    parser.add_argument('--entities', default='all',
+                        help="Comma separated entities to export, out of: %s, templates, all (default: all)."
+                             % ', '.join(ENTITIES))
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson', help="Output format.")
+    parser.add_argument('--output-dir', help="Write one file per entity in this directory (default: stdout).")
+    parser.add_argument('--concurrency', type=int, default=8, help="Number of concurrent API calls.")
+    parser.add_argument('--page-size', type=int, default=100, help="Items per list call, up to 100.")
+    parser.add_argument('--rate', type=int, default=10, help="Maximum API calls per second.")
+    parser.add_argument('--adaptive-rate', action='store_true',
+                        help="Adapt the call rate to throttling and latency, up to --rate.")
+    parser.add_argument('--resume', action='store_true', help="Resume a previous export into --output-dir.")
+    parser.add_argument('--progress-interval', type=float, default=5, help="Seconds between progress reports.")
+    parser.add_argument('--quiet', action='store_true', help="Do not report progress.")
+    return parser.parse_args(argv)
+
+
+def _parseEntities(value: str) -> List[str]:
+    entities: List[str] = []
+    for name in value.split(','):
+        name = name.strip()
+        if name == 'all':
+            expanded = list(ENTITIES)
+        elif name == 'templates':
+            expanded = ['brandTemplates', 'reportTemplates']
+        elif name in ENTITIES:
+            expanded = [name]
+        else:
+            raise SystemExit("Unknown entity: %s" % name)
+        entities.extend(entity for entity in expanded if entity not in entities)
+    return entities
+
+
+def _mapOrdered(executor: Executor, function: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    Like executor.map, but consumes `items` lazily, keeping at most `window` calls in flight.
+    """
+
+    pending: deque = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class _ExportState(object):
+    """
+    Tracks which (entity, team) units were completed, and how far each unit got: the pagination cursor after the last
+    written item for list units, or the number of written items for others.
+    """
+
+    def __init__(self, path: Optional[str], resume: bool) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self.completed: Dict[str, bool] = dict()
+        self.written: Dict[str, int] = dict()
+        self.cursors: Dict[str, PaginationCursor] = dict()
+
+        if resume and path and os.path.exists(path):
+            with open(path, encoding='utf-8') as stateFile:
+                loaded = json.load(stateFile)
+            self.completed = {unit: True for unit in loaded.get('completed', [])}
+            self.written = loaded.get('written', {})
+            self.cursors = {
+                unit: PaginationCursor.fromDict(cursor) for unit, cursor in loaded.get('cursors', {}).items()
+            }
+
+    def countWritten(self, unit: str) -> None:
+        with self._lock:
+            self.written[unit] = self.written.get(unit, 0) + 1
+
+    def setCursor(self, unit: str, cursor: PaginationCursor) -> None:
+        with self._lock:
+            self.cursors[unit] = cursor
+
+    def complete(self, unit: str) -> None:
+        with self._lock:
+            self.completed[unit] = True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                completed=sorted(self.completed),
+                written=dict(self.written),
+                cursors={unit: cursor.toDict() for unit, cursor in self.cursors.items()},
+            )
+
+    def save(self, data: Optional[Dict[str, Any]] = None) -> None:
+        if not self._path:
+            return
+        if data is None:
+            data = self.snapshot()
+        temporaryPath = self._path + '.tmp'
+        with open(temporaryPath, 'w', encoding='utf-8') as stateFile:
+            json.dump(data, stateFile)
+        os.replace(temporaryPath, self._path)
+
+
+class _Sinks(object):
+    """
+    Thread-safe writers of exported records, one per entity.
+    """
+
+    def __init__(self, entities: List[str], fileFormat: str, outputDir: Optional[str], append: bool) -> None:
+        self._lock = threading.Lock()
+        self._files: List[TextIO] = []
+        self._writers: Dict[str, Callable[[Dict[str, Any]], None]] = dict()
+
+        if outputDir:
+            os.makedirs(outputDir, exist_ok=True)
+
+        for entity in entities:
+            if outputDir:
+                path = os.path.join(outputDir, '%s.%s' % (entity, fileFormat))
+                exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+                stream = open(path, 'a' if append else 'w', encoding='utf-8', newline='')
+                self._files.append(stream)
+            else:
+                exists = False
+                stream = sys.stdout
+
+            if fileFormat == 'csv':
+                self._writers[entity] = self._makeCsvWriter(stream, _CSV_FIELDS[entity], writeHeader=not exists)
+            else:
+                self._writers[entity] = self._makeNdjsonWriter(stream, entity, tagged=not outputDir)
+
+    def write(self, entity: str, record: Dict[str, Any], onWritten: Optional[Callable[[], None]] = None) -> None:
+        """
+        Writes a record. `onWritten` is called right after, under the same lock as `flush` - so progress recorded by it
+        is never seen by a flush's `then` callback before the record itself is flushed.
+        """
+
+        with self._lock:
+            self._writers[entity](record)
+            if onWritten:
+                onWritten()
+
+    def flush(self, then: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Flushes all output, then returns the result of `then`, called before any other record can be written.
+        """
+
+        with self._lock:
+            for stream in self._files or [sys.stdout]:
+                stream.flush()
+            return then() if then else None
+
+    def close(self) -> None:
+        self.flush()
+        for stream in self._files:
+            stream.close()
+
+    @staticmethod
+    def _makeNdjsonWriter(stream: TextIO, entity: str, tagged: bool) -> Callable[[Dict[str, Any]], None]:
+
+        def write(record: Dict[str, Any]) -> None:
+            if tagged:
+                record = dict(record, entity=entity)
+            stream.write(json.dumps(record, default=str))
+            stream.write('\n')
+
+        return write
+
+    @staticmethod
+    def _makeCsvWriter(stream: TextIO, fields: List[str], writeHeader: bool) -> Callable[[Dict[str, Any]], None]:
+        writer = csv.DictWriter(stream, fieldnames=fields, extrasaction='ignore')
+        if writeHeader:
+            writer.writeheader()
+
+        def write(record: Dict[str, Any]) -> None:
+            writer.writerow({
+                key: json.dumps(value, default=str) if isinstance(value, (dict, list)) else value
+                for key, value in record.items()
+            })
+
+        return write
+
+
+class _Progress(object):
+    """
+    Periodically reports export progress and throughput to stderr.
+    """
+
+    def __init__(self, swydoClient: SwydoClient, interval: float) -> None:
+        self._swydoClient = swydoClient
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._items = 0
+        self._started = time.monotonic()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.onReport: Optional[Callable[[], None]] = None
+
+    def countItem(self) -> None:
+        with self._lock:
+            self._items += 1
+
+    def start(self) -> None:
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='swydo-progress', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self._report()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval or 1):
+            if self.onReport:
+                self.onReport()
+            if self._interval:
+                self._report()
+
+    def _report(self) -> None:
+        if not self._interval:
+            return
+
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        stats = self._swydoClient.getCallStats()
+        with self._lock:
+            items = self._items
+        sys.stderr.write(
+            "[%.0fs] %d items (%.1f/s), %d calls (%.1f/s, limit %.1f/s), %d rate-limit waits (%.1fs), "
+            "%d throttled\n" % (
+                elapsed, items, items / elapsed, stats['calls'], stats['calls'] / elapsed, stats['rate'],
+                stats['rateLimitWaits'], stats['rateLimitWaitTime'], stats['throttled'],
+            )
+        )
+
+
+class _Exporter(object):
+    """
+    Exports (entity, team) units concurrently.
+    """
+
+    def __init__(
+            self,
+            swydoClient: SwydoClient,
+            sinks: _Sinks,
+            state: _ExportState,
+            progress: _Progress,
+            concurrency: int
+    ) -> None:
+        self._swydoClient = swydoClient
+        self._sinks = sinks
+        self._state = state
+        self._progress = progress
+        self._concurrency = max(1, concurrency)
+        # Per-client calls run on their own executor, so they never wait behind the units that submitted them
+        self._callExecutor = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix='swydo-call')
+        self._progress.onReport = self._checkpoint
+
+    def run(self, entities: List[str], teamIds: Optional[List[str]]) -> None:
+        if not teamIds:
+            teamIds = [team['id'] for team in self._swydoClient.getTeams()]
+
+        units = [(entity, teamId) for entity in entities for teamId in (teamIds if entity != 'teams' else [None])]
+
+        try:
+            with ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix='swydo-unit') as executor:
+                for future in [executor.submit(self._exportUnit, entity, teamId, teamIds)
+                               for entity, teamId in units]:
+                    future.result()
+        finally:
+            self._callExecutor.shutdown()
+
+    def _checkpoint(self) -> None:
+        # The state is snapshot along with the flush, so it never counts items that were not written
+        self._state.save(self._sinks.flush(then=self._state.snapshot))
+
+    def _exportUnit(self, entity: str, teamId: Optional[str], teamIds: List[str]) -> None:
+        unit = '%s/%s' % (entity, teamId) if teamId else entity
+        if self._state.completed.get(unit):
+            return
+
+        if entity in ('teams', 'dataSources'):
+            alreadyWritten = self._state.written.get(unit, 0)
+            for index, record in enumerate(self._iterateUnit(entity, teamId, teamIds)):
+                if index < alreadyWritten:
+                    continue
+                self._sinks.write(entity, record, onWritten=lambda: self._state.countWritten(unit))
+                self._progress.countItem()
+        else:
+            assert teamId is not None
+            cursor = self._state.cursors.get(unit)
+            items = self._swydoClient.resumeItems(cursor) if cursor else self._listUnit(entity, teamId)
+            for item in items:
+                self._sinks.write(
+                    entity, dict(item, teamId=teamId), onWritten=lambda: self._state.setCursor(unit, items.cursor)
+                )
+                self._progress.countItem()
+
+        self._state.complete(unit)
+
+    def _listUnit(self, entity: str, teamId: str) -> PageIterator:
+        listers: Dict[str, Callable[..., PageIterator]] = dict(
+            clients=self._swydoClient.getTeamClients,
+            reports=self._swydoClient.getTeamReports,
+            brandTemplates=self._swydoClient.getTeamBrandTemplates,
+            reportTemplates=self._swydoClient.getTeamReportTemplates,
+        )
+        return listers[entity](teamId=teamId)
+
+    def _iterateUnit(self, entity: str, teamId: Optional[str], teamIds: List[str]) -> Iterator[Dict[str, Any]]:
+        swydoClient = self._swydoClient
+
+        if entity == 'teams':
+            yield from _mapOrdered(
+                self._callExecutor, lambda selectedTeamId: swydoClient.getTeam(teamId=selectedTeamId), teamIds,
+                self._concurrency
+            )
+            return
+
+        assert teamId is not None
+        clientIds = (client['id'] for client in swydoClient.getTeamClients(teamId=teamId))
+        for result in _mapOrdered(
+                self._callExecutor,
+                lambda clientId: swydoClient.getClientDataSources(teamId=teamId, clientId=clientId),
+                clientIds,
+                self._concurrency
+        ):
+            for dataSource in result.get('dataSources', []):
+                yield dict(dataSource, teamId=teamId, clientId=result['id'])
@@ -2,19 +2,43 @@
 Swydo API main client object.
 """
 
+import base64
+import functools
+import hashlib
+import itertools
 import logging
 import os
+import threading
+import time
+from concurrent.futures import Future
 from enum import Enum, unique, auto
 from typing import Any
-from typing import Dict, Optional, Callable
-from typing import Iterator
+from typing import Dict, Iterable, Iterator, List, Optional, Callable, Tuple, Union
+from urllib.parse import urlsplit
 
-import backoff
+import requests
 from bravado.client import CallableOperation
 from bravado.client import SwaggerClient
 from bravado.exception import HTTPNotFound, HTTPTooManyRequests
+from bravado.http_client import HttpClient
 from bravado.requests_client import RequestsClient
-from ratelimit import limits, RateLimitException
+from bravado_core.response import get_response_spec
+from bravado_core.validate import validate_schema_object
+from jsonschema.exceptions import ValidationError
+
+from .cache import INVALIDATED_BY, SharedResponseCache
+from .circuit import CircuitBreaker
+from .coalescing import COALESCED_OPERATIONS, WriteCoalescer
+from .credentials import CredentialProvider, StaticCredentials
+from .hedging import RequestHedger
+from .hydration import Hydrator, LazyItem
+from .merging import mergeStreams
+from . import models
+from .models import Model
+from .recorder import CallRecord, FlightRecorder
+from .pagination import PageIterator, PageSizeTuner, PaginationCursor, StablePageIterator
+from .retry import IDEMPOTENT_METHODS, DeadlineExceeded, RetryPolicy, getRemainingTime
+from .throttling import AdaptiveRateController, RateLimiter
 
 
 # ======================================================================================================================
@@ -55,27 +79,259 @@ class Enumerations:
         previousMonth = auto()
         """Compare to Previous Month"""
 
+    @unique
+    class ValidationMode(Enum):
+        """
+        How much of the Swydo API traffic is validated against the OpenAPI spec.
+        """
+
+        off = auto()
+        """No validation at all."""
+
+        full = auto()
+        """Validate the spec, every request and every response. Invalid responses raise."""
+
+        sampled = auto()
+        """Validate the spec and 1 in N responses. Invalid responses are logged and counted as schema drift."""
+
 
 class SwydoClient(object):
     """
     Main class that allows communications with the Swydo API.
+
+    A single instance is thread-safe and is meant to be shared by all threads of a process: no per-call state is kept
+    on the instance, every thread gets its own HTTP session, and the rate limiter is shared and blocking.
     """
 
     # ==================================================================================================================
     # Public Interface
     # ==================================================================================================================
 
-    def __init__(self, apiKey: str, autoRetry: bool = True) -> None:
-        self._apiKey = apiKey
+    def __init__(
+            self,
+            apiKey: Optional[str] = None,
+            autoRetry: bool = True,
+            maxCallsPerSecond: int = 10,
+            apiUrl: Optional[str] = None,
+            validationMode: Optional[Enumerations.ValidationMode] = None,
+            validationSampleRate: int = 100,
+            httpClient: Optional[HttpClient] = None,
+            pageSize: Optional[int] = None,
+            paginationOverlap: int = 0,
+            adaptiveRate: bool = False,
+            minCallsPerSecond: float = 1,
+            maxConcurrentCalls: Optional[int] = None,
+            typedModels: bool = False,
+            hedger: Optional[RequestHedger] = None,
+            retryPolicy: Optional[RetryPolicy] = None,
+            timeout: Optional[float] = None,
+            circuitBreaker: Optional[CircuitBreaker] = None,
+            responseCache: Optional[SharedResponseCache] = None,
+            credentials: Optional[CredentialProvider] = None,
+            writeCoalescer: Optional[WriteCoalescer] = None,
+            flightRecorder: Optional[FlightRecorder] = None,
+            pageSizeTuner: Optional[PageSizeTuner] = None
+    ) -> None:
+        """
+        :param apiKey: Swydo API key. Pass either apiKey or credentials.
+        :param autoRetry: Whether to rate limit calls locally and retry failed calls, as decided by retryPolicy.
+        :param maxCallsPerSecond: Local rate limit, shared by all threads using this instance.
+        :param apiUrl: Override the API base URL (e.g. 'http://localhost:8080/v1'), for proxies and stand-in servers.
+        :param validationMode: Validation against the OpenAPI spec. Defaults to full validation, unless Python runs
+                               with -O, in which case validation is off.
+        :param validationSampleRate: In sampled validation mode, validate 1 in this many responses.
+        :param httpClient: HTTP transport to use, e.g. swydo.transport.HttpxClient for HTTP/2. Defaults to bravado's
+                           requests-based client, with a session per thread.
+        :param pageSize: Number of items to request per page when listing, up to 100. Defaults to a page size tuned to
+                         the latency and size of pages (see pageSizeTuner), or the server default with
+                         paginationOverlap.
+        :param paginationOverlap: When positive, list methods use stable pagination (see StablePageIterator): pages
+                                  overlap by this many items and items are deduplicated by id, so listings stay
+                                  complete while items are created or deleted.
+        :param adaptiveRate: Adapt the local rate limit to the server (see AdaptiveRateController): starting from
+                             Swydo's documented 10 calls per second, raise it while calls are healthy, up to
+                             maxCallsPerSecond, and cut it when calls are throttled or latency rises, down to
+                             minCallsPerSecond.
+        :param minCallsPerSecond: Lowest local rate limit, when adaptiveRate is set.
+        :param maxConcurrentCalls: When adaptiveRate is set, also limit the number of calls in flight at once, adapting
+                                   that limit the same way, up to this number.
+        :param typedModels: List methods yield compact typed models (see swydo.models) instead of dicts, to hold many
+                            entities in memory. Single entity methods, and list methods with lazyDetails=True,
+                            still return dicts.
+        :param hedger: Hedges slow calls of idempotent operations (see swydo.hedging.RequestHedger) when the rate limit
+                       has calls to spare. Requires autoRetry.
+        :param retryPolicy: Which failed calls to retry, and how long to wait before retrying (see
+                            swydo.retry.RetryPolicy). Defaults to retrying throttled calls, and server and connection
+                            errors of idempotent calls, for up to 10 seconds.
+        :param timeout: HTTP timeout of calls, in seconds. Calls within a deadline (see swydo.retry.deadline) are also
+                        limited to the time left until it.
+        :param circuitBreaker: Fails calls fast, with CircuitOpenError, while Swydo keeps failing (see
+                               swydo.circuit.CircuitBreaker), instead of waiting for timeouts and retries.
+        :param responseCache: Caches the responses of single entity reads, e.g. getTeamClient, in a cache shared by all
+                              processes on the host (see swydo.cache.SharedResponseCache). Writes made through this
+                              client drop the cached responses they make stale, writes made elsewhere show once the
+                              entries expire.
+        :param credentials: Supplies the API key of every call (see swydo.credentials), so keys can be rotated, or
+                            the client switched to another account, without building a new client. See also
+                            setCredentials.
+        :param writeCoalescer: Holds updates of clients and reports for a short window, and merges those of the same
+                               entity into a single call (see swydo.coalescing.WriteCoalescer). updateTeamClient and
+                               updateTeamReport then return a Future of the result. See also flushWrites.
+        :param flightRecorder: Records the timings, retries and outcome of the last calls (see
+                               swydo.recorder.FlightRecorder), to find out which calls were slow after the fact.
+        :param pageSizeTuner: Picks the page size of list operations when pageSize is not set (see
+                              swydo.pagination.PageSizeTuner). Defaults to a PageSizeTuner of its own.
+        """
+        if (apiKey is None) == (credentials is None):
+            raise ValueError("Pass either apiKey or credentials.")
+        if validationMode is None:
+            validationMode = Enumerations.ValidationMode.full if __debug__ else Enumerations.ValidationMode.off
+        if validationSampleRate < 1:
+            raise ValueError("validationSampleRate must be at least 1.")
+        if pageSize is not None and not 1 <= pageSize <= 100:
+            raise ValueError("pageSize must be between 1 and 100.")
+        if not 0 <= paginationOverlap < (pageSize or 50):
+            raise ValueError("paginationOverlap must be smaller than the page size (50 by default).")
+
+        self._credentials = credentials or StaticCredentials(apiKey)
+        # The last API key and account used, with their Authorization header and cache namespace
+        self._authorization: Tuple[str, Optional[str], str, str] = ('', None, '', '')
+        self._apiUrl = apiUrl
+        self._apiHost = urlsplit(apiUrl).hostname if apiUrl else 'api.swydo.com'
+        self._httpClient = httpClient
+        self._validationMode = validationMode
+        self._validationSampleRate = validationSampleRate
+        self._pageSize = pageSize
+        self._pageSizeTuner = pageSizeTuner or PageSizeTuner()
+        self._paginationOverlap = paginationOverlap
+        self._typedModels = typedModels
+        self._hedger = hedger
+        self._retryPolicy = retryPolicy or RetryPolicy()
+        self._timeout = timeout
+        self._circuitBreaker = circuitBreaker
+        self._responseCache = responseCache
+        self._writeCoalescer = writeCoalescer
+        self._flightRecorder = flightRecorder
+        self._responseCounter = itertools.count()
+        self._statsLock = threading.Lock()
+        self._stats: Dict[str, float] = dict(
+            calls=0, throttled=0, retried=0, rateLimitWaits=0, rateLimitWaitTime=0.0, validated=0, drifted=0
+        )
+        self._callObservers: List[Callable[[str, Dict[str, Any], Any], None]] = []
+        self._hydratorsLock = threading.Lock()
+        self._hydrators: Dict[str, Hydrator] = dict()
         self._bravadoClient: Optional[SwaggerClient] = None
         self._prepareBravadoClient()
         self._autoRetry = autoRetry
+        self._rateLimiter: Union[RateLimiter, AdaptiveRateController]
+        if adaptiveRate:
+            self._rateLimiter = AdaptiveRateController(
+                minRate=minCallsPerSecond,
+                maxRate=maxCallsPerSecond,
+                initialRate=min(maxCallsPerSecond, 10),
+                maxConcurrency=maxConcurrentCalls,
+            )
+        else:
+            self._rateLimiter = RateLimiter(calls=maxCallsPerSecond, period=1)
+
+    def getValidationStats(self) -> Dict[str, int]:
+        """
+        Returns the number of responses validated in sampled validation mode, and how many of them drifted from the
+        OpenAPI spec.
+        """
+
+        with self._statsLock:
+            return dict(validated=self._stats['validated'], drifted=self._stats['drifted'])
+
+    def getCallStats(self) -> Dict[str, float]:
+        """
+        Returns the number of HTTP calls made, the number of calls throttled by Swydo (HTTP 429) and retried, the
+        number of calls retried after other errors, the number of times and total seconds calls waited for the local
+        rate limiter, and the current local rate limit in calls per second.
+        """
+
+        with self._statsLock:
+            stats = {
+                key: self._stats[key]
+                for key in ('calls', 'throttled', 'retried', 'rateLimitWaits', 'rateLimitWaitTime')
+            }
+        stats['rate'] = self._rateLimiter.rate
+        return stats
+
+    def setCredentials(self, credentials: CredentialProvider) -> None:
+        """
+        Replaces the credential provider. Calls already sent complete with the previous credentials, and the OpenAPI
+        spec, connections, rate limiter and caches are kept.
+        """
+
+        self._credentials = credentials
+
+    def flushWrites(self) -> None:
+        """
+        With a writeCoalescer, sends all pending updates right away, and waits for them to complete. Call it before the
+        program ends - updates left pending are only sent at a normal interpreter exit, without raising their errors.
+        """
+
+        if self._writeCoalescer is not None:
+            self._writeCoalescer.flush()
+
+    @property
+    def pageSize(self) -> Optional[int]:
+        """Number of items requested per page when listing, or None if tuned (see PageSizeTuner)."""
+        return self._pageSize
+
+    @property
+    def pageSizeTuner(self) -> Optional[PageSizeTuner]:
+        """Picks the page size of list methods, or None if the page size is fixed, by pageSize or paginationOverlap."""
+        return None if self._pageSize or self._paginationOverlap else self._pageSizeTuner
+
+    def addCallObserver(self, observer: Callable[[str, Dict[str, Any], Any], None]) -> None:
+        """
+        Calls `observer` with the operation id, parameters and result of every successful API call - including every
+        page of list methods - e.g. to keep local state (see swydo.index.LocalIndex) in sync. Observers run on the
+        calling thread, and their errors are logged, never raised.
+        """
+
+        self._callObservers = self._callObservers + [observer]
+
+    def resumeItems(self, cursor: PaginationCursor) -> PageIterator:
+        """
+        Continues iterating a list operation, right after the last item consumed when `cursor` was taken.
+
+        Every list method (e.g. getTeamReports) returns a PageIterator, whose `cursor` property can be persisted and
+        later passed here.
+        """
+
+        client = self._getSwaggerClient()
+
+        return self._iterateFromCursor(
+            cursor=cursor,
+            itemsGetter=getattr(client.teams, cursor.operationId),
+            transform=models.MODELS_BY_OPERATION[cursor.operationId].fromDict if self._typedModels else None,
+        )
+
+    def countItems(self, operationId: str, **params: Any) -> int:
+        """
+        Returns the total number of items of a list operation, with a single call of one item, e.g.
+        countItems('getTeamReports', teamId=TEAM_ID).
+
+        :param operationId: Swydo API list operation, e.g. 'getTeamReports'.
+        :param params: Operation parameters, excluding paging parameters.
+        """
+
+        client = self._getSwaggerClient()
+
+        result = self._makeSwydoAPICall(
+            apiFunction=getattr(client.teams, operationId),
+            params=dict(params, limit=1)
+        )
+        return result.get('total') or 0
 
     # ==================================================================================================================
     # Teams
     # ==================================================================================================================
 
-    def getTeams(self) -> Iterator:
+    def getTeams(self) -> PageIterator:
         """
         Returns a list of teams.
         """
@@ -86,8 +342,7 @@ class SwydoClient(object):
 
         params: Dict[str, Any] = dict()
 
-        for item in self._yieldAllItems(params=params, itemsGetter=client.teams.getTeams):
-            yield item
+        return self._yieldAllItems(params=params, itemsGetter=client.teams.getTeams)
 
     def getTeam(self, teamId: str) -> Dict[str, str]:
         """
@@ -109,7 +364,7 @@ class SwydoClient(object):
     # Users
     # ==================================================================================================================
 
-    def getTeamUsers(self, teamId: str) -> Iterator[Dict[str, str]]:
+    def getTeamUsers(self, teamId: str) -> PageIterator:
         """
         Returns a list of users for a team.
         """
@@ -121,8 +376,7 @@ class SwydoClient(object):
             teamId=teamId,
         )
 
-        for item in self._yieldAllItems(params=params, itemsGetter=client.teams.getTeamUsers):
-            yield item
+        return self._yieldAllItems(params=params, itemsGetter=client.teams.getTeamUsers)
 
     def getTeamUser(self, teamId: str, userId: str) -> Dict[str, str]:
         """
@@ -145,7 +399,7 @@ class SwydoClient(object):
     # BrandTemplates
     # ==================================================================================================================
 
-    def getTeamBrandTemplates(self, teamId: str) -> Iterator[Dict[str, str]]:
+    def getTeamBrandTemplates(self, teamId: str) -> PageIterator:
         """
         Returns a list of brand templates.
         """
@@ -156,8 +410,7 @@ class SwydoClient(object):
             teamId=teamId,
         )
 
-        for item in self._yieldAllItems(params=params, itemsGetter=client.teams.getTeamBrandTemplates):
-            yield item
+        return self._yieldAllItems(params=params, itemsGetter=client.teams.getTeamBrandTemplates)
 
     def getTeamBrandTemplate(self, teamId: str, brandTemplateId: str) -> Dict[str, str]:
         """
@@ -180,7 +433,7 @@ class SwydoClient(object):
     # ReportTemplates
     # ==================================================================================================================
 
-    def getTeamReportTemplates(self, teamId: str) -> Iterator[Dict[str, str]]:
+    def getTeamReportTemplates(self, teamId: str) -> PageIterator:
         """
         Returns a list of report templates.
         """
@@ -191,8 +444,7 @@ class SwydoClient(object):
             teamId=teamId,
         )
 
-        for item in self._yieldAllItems(params=params, itemsGetter=client.teams.getTeamReportTemplates):
-            yield item
+        return self._yieldAllItems(params=params, itemsGetter=client.teams.getTeamReportTemplates)
 
     def getTeamReportTemplate(self, teamId: str, reportTemplateId: str) -> Dict[str, str]:
         """
@@ -215,7 +467,7 @@ class SwydoClient(object):
     # Connections
     # ==================================================================================================================
 
-    def getTeamConnections(self, teamId: str, userId: str = None, providerId: str = None) -> Iterator[Dict[str, str]]:
+    def getTeamConnections(self, teamId: str, userId: str = None, providerId: str = None) -> PageIterator:
         """
         Returns a list of connections.
         """
@@ -231,8 +483,7 @@ class SwydoClient(object):
         if providerId:
             params['providerId'] = providerId
 
-        for item in self._yieldAllItems(params=params, itemsGetter=client.teams.getTeamConnections):
-            yield item
+        return self._yieldAllItems(params=params, itemsGetter=client.teams.getTeamConnections)
 
     def getTeamConnection(self, teamId: str, connectionId: str) -> Dict[str, str]:
         """
@@ -255,9 +506,12 @@ class SwydoClient(object):
     # Clients
     # ==================================================================================================================
 
-    def getTeamClients(self, teamId: str) -> Iterator[Dict[str, Any]]:
+    def getTeamClients(self, teamId: str, lazyDetails: bool = False) -> PageIterator:
         """
         Returns a list of clients.
+
+        :param lazyDetails: Yield LazyItems, that fetch the details of a client (see getTeamClient) on the first access
+                            to a field missing from the list.
         """
 
         client = self._getSwaggerClient()
@@ -267,8 +521,15 @@ class SwydoClient(object):
             teamId=teamId,
         )
 
-        for item in self._yieldAllItems(params=params, itemsGetter=client.teams.getTeamClients):
-            yield item
+        return self._yieldAllItems(
+            params=params,
+            itemsGetter=client.teams.getTeamClients,
+            transform=self._makeLazyItemFactory(
+                kind='clients',
+                teamId=teamId,
+                fetchDetails=lambda key: self.getTeamClient(teamId=key[0], clientId=key[1]),
+            ) if lazyDetails else None,
+        )
 
     def getTeamClient(self, teamId: str, clientId: str) -> Dict[str, Any]:
         """
@@ -282,10 +543,10 @@ class SwydoClient(object):
             clientId=clientId,
         )
 
-        return self._makeSwydoAPICall(
+        return self._applyPendingWrites('updateTeamClient', teamId, clientId, self._makeSwydoAPICall(
             apiFunction=client.teams.getTeamClient,
             params=params
-        )
+        ))
 
     def createTeamClient(
             self,
@@ -324,9 +585,11 @@ class SwydoClient(object):
             name: Optional[str] = None,
             description: Optional[str] = None,
             email: Optional[str] = None
-    ) -> Dict[str, Any]:
+    ) -> Union[Dict[str, Any], Future]:
         """
         Update an existing client with new values.
+
+        With a writeCoalescer, returns a Future of the result of the combined update.
         """
 
         client = self._getSwaggerClient()
@@ -344,6 +607,8 @@ class SwydoClient(object):
         if email:
             params['clientUpdate']['email'] = email
 
+        if self._writeCoalescer is not None:
+            return self._coalesceUpdate('updateTeamClient', params)
         return self._makeSwydoAPICall(
             apiFunction=client.teams.updateTeamClient,
             params=params
@@ -409,10 +674,12 @@ class SwydoClient(object):
                 # HACK: We catch the 404 message from Swydo, and just return an object with empty DataSources - this
                 # makes more sense
                 if hnfe.response.json()['error'] == "DATASOURCE_NOT_FOUND":
-                    return {
+                    result = {
                         'id': clientId,
                         'dataSources': [],
                     }
+                    self._notifyCallObservers(operationId='getClientDataSources', params=params, result=result)
+                    return result
             except Exception:
                 pass
             raise
@@ -682,9 +949,12 @@ class SwydoClient(object):
     # Reports
     # ==================================================================================================================
 
-    def getTeamReports(self, teamId: str) -> Iterator[Dict[str, str]]:
+    def getTeamReports(self, teamId: str, lazyDetails: bool = False) -> PageIterator:
         """
         Returns a list of reports.
+
+        :param lazyDetails: Yield LazyItems, that fetch the details of a report (see getTeamReport) on the first access
+                            to a field missing from the list.
         """
 
         client = self._getSwaggerClient()
@@ -694,8 +964,15 @@ class SwydoClient(object):
             teamId=teamId,
         )
 
-        for item in self._yieldAllItems(params=params, itemsGetter=client.teams.getTeamReports):
-            yield item
+        return self._yieldAllItems(
+            params=params,
+            itemsGetter=client.teams.getTeamReports,
+            transform=self._makeLazyItemFactory(
+                kind='reports',
+                teamId=teamId,
+                fetchDetails=lambda key: self.getTeamReport(teamId=key[0], reportId=key[1]),
+            ) if lazyDetails else None,
+        )
 
     def getTeamReport(self, teamId: str, reportId: str) -> Dict[str, str]:
         """
@@ -709,10 +986,10 @@ class SwydoClient(object):
             reportId=reportId,
         )
 
-        return self._makeSwydoAPICall(
+        return self._applyPendingWrites('updateTeamReport', teamId, reportId, self._makeSwydoAPICall(
             apiFunction=client.teams.getTeamReport,
             params=params
-        )
+        ))
 
     def createTeamReport(
             self,
@@ -776,9 +1053,11 @@ class SwydoClient(object):
             reportTemplateId: str = None,
             comparePeriod: Enumerations.ComparePeriod = None,
             authorId: str = None
-    ) -> Dict[str, str]:
+    ) -> Union[Dict[str, str], Future]:
         """
         Update an existing report.
+
+        With a writeCoalescer, returns a Future of the result of the combined update.
         """
 
         client = self._getSwaggerClient()
@@ -802,6 +1081,8 @@ class SwydoClient(object):
         if authorId:
             params['reportUpdate']['authorId'] = authorId
 
+        if self._writeCoalescer is not None:
+            return self._coalesceUpdate('updateTeamReport', params)
         return self._makeSwydoAPICall(
             apiFunction=client.teams.updateTeamReport,
             params=params
@@ -842,57 +1123,461 @@ class SwydoClient(object):
         )
 
     # ==================================================================================================================
-    # Private Members
+    # All Teams
     # ==================================================================================================================
 
-    def _yieldAllItems(self, params: Dict[str, Any], itemsGetter: CallableOperation) -> Iterator[Dict[str, Any]]:
+    def getAllTeamItems(
+            self,
+            operationId: str,
+            teamIds: Optional[Iterable[str]] = None,
+            ordered: bool = False,
+            maxConcurrency: int = 8,
+            bufferSize: int = 100
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Returns the items of a team list method over many teams, e.g. getAllTeamItems('getTeamReports'), each tagged
+        with its `teamId`.
+
+        The teams are listed concurrently (see swydo.merging.mergeStreams), so small teams don't wait behind big ones,
+        and the calls of all teams share the rate limit. Set maxConcurrency to at least the calls per second times the
+        latency of a call to use all of the rate limit.
 
-        currentIndex = 0
-        totalItems = 0
-        firstRun = True
+        :param operationId: Team list method, e.g. 'getTeamClients'.
+        :param teamIds: Teams to list. Defaults to all teams, as returned by getTeams.
+        :param ordered: Return all items of a team before those of the next one, in the order of teamIds, instead of
+                        as soon as they arrive.
+        :param maxConcurrency: Maximum number of teams listed at once.
+        :param bufferSize: Maximum number of items fetched ahead of the consumer (per team, when ordered).
+        """
 
-        while firstRun or totalItems > currentIndex:
+        listItems = getattr(self, operationId)
+        if teamIds is None:
+            teamIds = (team['id'] for team in self.getTeams())
 
-            firstRun = False
+        for teamId, item in mergeStreams(
+                ((teamId, functools.partial(listItems, teamId=teamId)) for teamId in teamIds),
+                maxConcurrency=maxConcurrency,
+                bufferSize=bufferSize,
+                ordered=ordered,
+        ):
+            yield dict(item.toDict() if isinstance(item, Model) else item, teamId=teamId)
 
-            params['skip'] = currentIndex
-            result = self._makeSwydoAPICall(
-                apiFunction=itemsGetter,
-                params=params
+    def getAllClients(self, teamIds: Optional[Iterable[str]] = None, **options: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Returns the clients of many teams, each tagged with its `teamId` (see getAllTeamItems).
+        """
+
+        return self.getAllTeamItems('getTeamClients', teamIds=teamIds, **options)
+
+    def getAllReports(self, teamIds: Optional[Iterable[str]] = None, **options: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Returns the reports of many teams, each tagged with its `teamId` (see getAllTeamItems).
+        """
+
+        return self.getAllTeamItems('getTeamReports', teamIds=teamIds, **options)
+
+    # ==================================================================================================================
+    # Private Members
+    # ==================================================================================================================
+
+    def _yieldAllItems(
+            self,
+            params: Dict[str, Any],
+            itemsGetter: CallableOperation,
+            transform: Optional[Callable[[Dict[str, Any]], Any]] = None
+    ) -> PageIterator:
+
+        cursor = PaginationCursor(
+            operationId=itemsGetter.operation.operation_id,
+            params=params,
+            overlap=self._paginationOverlap,
+        )
+        if transform is None and self._typedModels:
+            transform = models.MODELS_BY_OPERATION[cursor.operationId].fromDict
+        return self._iterateFromCursor(cursor=cursor, itemsGetter=itemsGetter, transform=transform)
+
+    def _iterateFromCursor(
+            self,
+            cursor: PaginationCursor,
+            itemsGetter: CallableOperation,
+            transform: Optional[Callable[[Dict[str, Any]], Any]] = None
+    ) -> PageIterator:
+
+        def fetchPage(pageParams: Dict[str, Any]) -> Dict[str, Any]:
+            if self._pageSize or cursor.overlap:
+                # Stable pagination keeps its page size, which its overlap was chosen for
+                if self._pageSize:
+                    pageParams.setdefault('limit', self._pageSize)
+                return self._makeSwydoAPICall(apiFunction=itemsGetter, params=pageParams)
+
+            pageSize = pageParams.setdefault('limit', self._pageSizeTuner.getPageSize(cursor.operationId))
+            record = CallRecord(cursor.operationId, pageParams, time.monotonic())
+            result = self._makeSwydoAPICall(apiFunction=itemsGetter, params=pageParams, record=record)
+            self._pageSizeTuner.observe(
+                cursor.operationId, pageSize, len(result.get('items') or ()), record.httpTime, record.bytes
             )
-            currentIndex = currentIndex + len(result.get('items', []))
-            totalItems = result.get('total', 0)
+            return result
+
+        if cursor.overlap:
+            return StablePageIterator(fetchPage=fetchPage, cursor=cursor, transform=transform)
+        return PageIterator(fetchPage=fetchPage, cursor=cursor, transform=transform)
+
+    def _makeLazyItemFactory(
+            self,
+            kind: str,
+            teamId: str,
+            fetchDetails: Callable[[Tuple[str, str]], Dict[str, Any]]
+    ) -> Callable[[Dict[str, Any]], LazyItem]:
+        # One hydrator per kind of item, so hydrations of items from different listings are batched together
+        with self._hydratorsLock:
+            hydrator = self._hydrators.get(kind)
+            if hydrator is None:
+                hydrator = self._hydrators[kind] = Hydrator(fetchDetails=fetchDetails)
 
-            for item in result.get('items', []):
-                yield item
+        def makeLazyItem(item: Dict[str, Any]) -> LazyItem:
+            return LazyItem(fields=item, key=(teamId, item['id']), hydrator=hydrator)
 
-    def _makeSwydoAPICall(self, apiFunction: Callable, params: Dict[str, Any]) -> Dict[str, str]:
+        return makeLazyItem
+
+    def _makeSwydoAPICall(
+            self,
+            apiFunction: Callable,
+            params: Dict[str, Any],
+            record: Optional[CallRecord] = None
+    ) -> Dict[str, str]:
         '''
         Centralized point that makes all Swydo API calls.
 
         :param apiFunction: API function to call.
         :param params: Params to send to the function.
+        :param record: Record to fill in with the timings and outcome of the call, e.g. to tune page sizes. Also kept
+                       by the flight recorder, if any.
         :return:
         '''
 
-        if self._autoRetry:
-            return self._makeSwydoAPICallWithRetry(apiFunction=apiFunction, params=params)
-        else:
-            return apiFunction(**params).result()
+        operationId = apiFunction.operation.operation_id
+        if self._writeCoalescer is not None and apiFunction.operation.http_method != 'get':
+            self._flushPendingWrites(operationId, params)
+        cacheKey = None
+        if self._responseCache is not None:
+            if self._responseCache.isCached(operationId):
+                cacheKey = self._responseCache.makeKey(self._getAuthorization()[1], operationId, params)
+                result = self._responseCache.get(cacheKey)
+                if result is not None:
+                    if self._callObservers:
+                        self._notifyCallObservers(operationId=operationId, params=params, result=result)
+                    return result
+            elif operationId in INVALIDATED_BY:
+                # Dropped whether or not the write succeeds, as a failed write may still have been carried out
+                self._dropCachedResponse(operationId, params)
+
+        if self._flightRecorder is not None:
+            record = self._flightRecorder.start(operationId, params, record)
+        try:
+            if self._autoRetry:
+                result = self._makeSwydoAPICallWithRetry(apiFunction=apiFunction, params=params, record=record)
+            else:
+                if record is not None:
+                    record.attempts = 1
+                result = self._callThroughCircuit(operationId, lambda: self._invokeOperation(
+                    apiFunction=apiFunction, params=params, timeout=self._getTimeout(operationId), record=record
+                ))
+        except BaseException as e:
+            if self._flightRecorder is not None:
+                self._flightRecorder.finish(record, e)
+            raise
+        if self._flightRecorder is not None:
+            self._flightRecorder.finish(record)
+
+        if cacheKey is not None:
+            self._responseCache.set(cacheKey, result)
+        elif self._responseCache is not None and operationId in INVALIDATED_BY:
+            # Also after the write, as a concurrent read may have cached the entity while it was being changed
+            self._dropCachedResponse(operationId, params)
+        if self._callObservers:
+            self._notifyCallObservers(operationId=operationId, params=params, result=result)
+        return result
+
+    def _coalesceUpdate(self, operationId: str, params: Dict[str, Any]) -> Future:
+        idName, bodyName = COALESCED_OPERATIONS[operationId]
+        apiFunction = getattr(self._getSwaggerClient().teams, operationId)
+
+        return self._writeCoalescer.submit(
+            key=(operationId, params['teamId'], params[idName]),
+            fields=params[bodyName],
+            send=lambda fields: self._makeSwydoAPICall(
+                apiFunction=apiFunction, params=dict(params, **{bodyName: fields})
+            ),
+        )
+
+    def _flushPendingWrites(self, operationId: str, params: Dict[str, Any]) -> None:
+        # Other writes of an entity are sent after its pending updates, in the order they were made
+        for updateOperationId, (idName, _) in COALESCED_OPERATIONS.items():
+            if updateOperationId != operationId and idName in params:
+                self._writeCoalescer.flush((updateOperationId, params['teamId'], params[idName]))
 
-    @backoff.on_exception(backoff.expo, (RateLimitException, HTTPTooManyRequests), max_time=10, logger=None)
-    @limits(calls=10, period=1)
-    def _makeSwydoAPICallWithRetry(self, apiFunction: Callable, params: Dict[str, Any]) -> Dict[str, str]:
+    def _applyPendingWrites(
+            self,
+            updateOperationId: str,
+            teamId: str,
+            entityId: str,
+            entity: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        # Read-your-writes: updates not applied by Swydo yet show in single entity reads
+        if self._writeCoalescer is not None:
+            fields = self._writeCoalescer.getPendingFields((updateOperationId, teamId, entityId))
+            if fields:
+                return dict(entity, **fields)
+        return entity
+
+    def _dropCachedResponse(self, writeOperationId: str, params: Dict[str, Any]) -> None:
+        readOperationId, keyNames = INVALIDATED_BY[writeOperationId]
+        self._responseCache.delete(self._responseCache.makeKey(
+            self._getAuthorization()[1], readOperationId, {name: params[name] for name in keyNames}
+        ))
+
+    def _notifyCallObservers(self, operationId: str, params: Dict[str, Any], result: Any) -> None:
+        for observer in self._callObservers:
+            try:
+                observer(operationId, params, result)
+            except Exception:
+                logging.exception('Swydo call observer failed on %s.', operationId)
+
+    def _makeSwydoAPICallWithRetry(
+            self,
+            apiFunction: Callable,
+            params: Dict[str, Any],
+            record: Optional[CallRecord] = None
+    ) -> Dict[str, str]:
         '''
         Makes a call with local rate limitation, as well as automatic retries.
-        Swydo has a rate limitation of 10 calls per second. We allow maximum of 10 seconds for retries
+        Swydo has a rate limitation of 10 calls per second. The local limiter blocks until a call is allowed, so
+        server-side throttling is rare. Failed calls are retried as decided by the retry policy, as long as the
+        deadline of the calling context leaves time for it.
+
+        :param apiFunction: API function to call.
+        :param params: Params to send to the function.
+        :param record: Flight recorder record of the call.
+        :return:
+        '''
+
+        operationId = apiFunction.operation.operation_id
+        idempotent = apiFunction.operation.http_method.lower() in IDEMPOTENT_METHODS
+        started = time.monotonic()
+
+        for attempt in itertools.count(1):
+            if record is not None:
+                record.attempts = attempt
+            try:
+                return self._callThroughCircuit(
+                    operationId,
+                    lambda: self._makeRateLimitedCall(apiFunction=apiFunction, params=params, record=record)
+                )
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                delay = self._retryPolicy.getRetryDelay(
+                    e, idempotent=idempotent, attempt=attempt, elapsed=time.monotonic() - started
+                )
+                if delay is None:
+                    raise
+                remaining = getRemainingTime()
+                if remaining is not None and remaining <= delay:
+                    raise DeadlineExceeded("Deadline exceeded calling %s." % operationId) from e
+                self._countStat('throttled' if isinstance(e, HTTPTooManyRequests) else 'retried')
+                if record is not None:
+                    record.backoffTime += delay
+                time.sleep(delay)
+
+        raise AssertionError('unreachable')  # pragma: no cover
+
+    def _callThroughCircuit(self, operationId: str, call: Callable[[], Dict[str, str]]) -> Dict[str, str]:
+        '''
+        Makes a single attempt of a call through the circuit breaker, if any - before waiting for the rate limiter, so
+        calls fail fast while the circuit is open.
+
+        :param operationId: Operation of the call.
+        :param call: Makes the attempt.
+        :return:
+        '''
+
+        if self._circuitBreaker is None:
+            return call()
+        return self._circuitBreaker.call(self._circuitBreaker.getKey(self._apiHost, operationId), call)
+
+    def _makeRateLimitedCall(
+            self,
+            apiFunction: Callable,
+            params: Dict[str, Any],
+            record: Optional[CallRecord] = None
+    ) -> Dict[str, str]:
+        '''
+        Makes a single attempt of a call, once the local rate limiter allows it, reporting its outcome back to the
+        limiter, for the adaptive one to follow the server.
+
+        :param apiFunction: API function to call.
+        :param params: Params to send to the function.
+        :param record: Flight recorder record of the call.
+        :return:
+        '''
+
+        operationId = apiFunction.operation.operation_id
+        self._getTimeout(operationId)
+        waited = self._rateLimiter.acquire()
+        if waited:
+            with self._statsLock:
+                self._stats['rateLimitWaits'] += 1
+                self._stats['rateLimitWaitTime'] += waited
+            if record is not None:
+                record.rateLimitWait += waited
+
+        started = time.monotonic()
+        throttled = False
+        try:
+            # Taken after waiting for the limiter, which may use up some of the time left
+            timeout = self._getTimeout(operationId)
+            if self._hedger is not None and self._hedger.isHedged(operationId):
+                return self._hedger.call(
+                    operationId=operationId,
+                    invoke=lambda: self._invokeOperation(
+                        apiFunction=apiFunction, params=params, timeout=timeout, record=record
+                    ),
+                    tryAcquire=self._rateLimiter.tryAcquire,
+                    release=lambda latency, wasThrottled: self._rateLimiter.release(
+                        latency=latency, throttled=wasThrottled),
+                    invokeHedge=lambda: self._invokeHedge(apiFunction=apiFunction, params=params, timeout=timeout),
+                )
+            return self._invokeOperation(apiFunction=apiFunction, params=params, timeout=timeout, record=record)
+        except HTTPTooManyRequests:
+            throttled = True
+            raise
+        finally:
+            self._rateLimiter.release(latency=time.monotonic() - started, throttled=throttled)
+
+    def _invokeHedge(self, apiFunction: Callable, params: Dict[str, Any], timeout: Optional[float]) -> Dict[str, str]:
+        '''
+        Performs the hedge of a call, recorded by the flight recorder as a call of its own.
+        '''
+
+        if self._flightRecorder is None:
+            return self._invokeOperation(apiFunction=apiFunction, params=params, timeout=timeout)
+
+        record = self._flightRecorder.start(apiFunction.operation.operation_id, params)
+        record.attempts = 1
+        try:
+            result = self._invokeOperation(apiFunction=apiFunction, params=params, timeout=timeout, record=record)
+        except BaseException as e:
+            self._flightRecorder.finish(record, e)
+            raise
+        self._flightRecorder.finish(record)
+        return result
+
+    def _invokeOperation(
+            self,
+            apiFunction: Callable,
+            params: Dict[str, Any],
+            timeout: Optional[float] = None,
+            record: Optional[CallRecord] = None
+    ) -> Dict[str, str]:
+        '''
+        Performs a single HTTP call of an operation, sampling its response for validation if needed.
 
         :param apiFunction: API function to call.
         :param params: Params to send to the function.
+        :param timeout: HTTP timeout of the call, in seconds.
+        :param record: Flight recorder record of the call.
         :return:
         '''
 
-        return apiFunction(**params).result()
+        requestOptions: Dict[str, Any] = dict(headers={'Authorization': self._getAuthorization()[0]})
+        responseCallbacks = []
+        if self._validationMode == Enumerations.ValidationMode.sampled and \
+                next(self._responseCounter) % self._validationSampleRate == 0:
+            responseCallbacks.append(self._validateSampledResponse)
+        if record is not None:
+            responseCallbacks.append(record.onResponse)
+        if responseCallbacks:
+            requestOptions['response_callbacks'] = responseCallbacks
+        if timeout is not None:
+            requestOptions['timeout'] = requestOptions['connect_timeout'] = timeout
+        params = dict(params, _request_options=requestOptions)
+
+        self._countStat('calls')
+        if record is None:
+            return apiFunction(**params).result()
+        started = time.monotonic()
+        try:
+            return apiFunction(**params).result()
+        finally:
+            record.httpTime += time.monotonic() - started
+
+    def _getAuthorization(self) -> Tuple[str, str]:
+        """
+        Returns the Authorization header of the current API key, and the namespace of its cached responses.
+        """
+
+        apiKey = self._credentials.getApiKey()
+        account = self._credentials.getAccount()
+        authorization = self._authorization
+        if authorization[0] != apiKey or authorization[1] != account:
+            credentials = base64.b64encode(('API:%s' % apiKey).encode('utf-8')).decode('ascii')
+            # Keeps apart the cached responses of accounts sharing a cache, without storing their keys
+            namespace = hashlib.blake2b(
+                ('%s@%s' % ('account:%s' % account if account is not None else apiKey, self._apiHost)).encode(),
+                digest_size=16
+            ).hexdigest()
+            # Replaced as a whole, so other threads see either the previous or the new tuple
+            authorization = self._authorization = (apiKey, account, 'Basic ' + credentials, namespace)
+        return authorization[2], authorization[3]
+
+    def _getTimeout(self, operationId: str) -> Optional[float]:
+        '''
+        Returns the HTTP timeout of a call made now: the configured timeout, limited to the time left until the deadline
+        of the calling context.
+
+        :raise DeadlineExceeded: The deadline has passed.
+        '''
+
+        remaining = getRemainingTime()
+        if remaining is None:
+            return self._timeout
+        if remaining <= 0:
+            raise DeadlineExceeded("Deadline exceeded before calling %s." % operationId)
+        return remaining if self._timeout is None else min(self._timeout, remaining)
+
+    def _countStat(self, name: str) -> None:
+        with self._statsLock:
+            self._stats[name] += 1
+
+    def _validateSampledResponse(self, incomingResponse: Any, operation: Any) -> None:
+        '''
+        Validates a successful response against the OpenAPI spec, logging any schema drift instead of raising.
+
+        :param incomingResponse: bravado incoming response.
+        :param operation: bravado_core operation the response belongs to.
+        '''
+
+        if not 200 <= incomingResponse.status_code < 300:
+            return
+
+        try:
+            responseSpec = get_response_spec(incomingResponse.status_code, operation)
+            schema = operation.swagger_spec.deref(responseSpec.get('schema'))
+            if schema is not None:
+                validate_schema_object(operation.swagger_spec, schema, incomingResponse.json())
+            drifted = False
+        except ValidationError as ve:
+            drifted = True
+            logging.warning('Swydo schema drift in %s: %s', operation.operation_id, ve.message)
+        except Exception:
+            # E.g. a body that is not JSON, or a status missing from the spec - never fail a call that succeeded
+            drifted = True
+            logging.exception('Swydo response of %s could not be validated.', operation.operation_id)
+
+        with self._statsLock:
+            self._stats['validated'] += 1
+            if drifted:
+                self._stats['drifted'] += 1
 
     def _getSwaggerClient(self) -> SwaggerClient:
         if not self._bravadoClient:
@@ -908,13 +1593,11 @@ class SwydoClient(object):
 
         swaggerFileLocation = os.path.dirname(os.path.abspath(__file__)) + '/swydo_api.yml'
 
-        httpClient = RequestsClient()
-        httpClient.set_basic_auth(
-            'api.swydo.com',
-            'API', self._apiKey
-        )
+        # Calls are authenticated with a header per call (see _getAuthorization), so the key can change at runtime
+        httpClient = self._httpClient or _ThreadLocalRequestsClient()
 
-        swaggerValidation = bool(__debug__)
+        fullValidation = self._validationMode == Enumerations.ValidationMode.full
+        specValidation = self._validationMode != Enumerations.ValidationMode.off
 
         if not self._bravadoClient:
 
@@ -935,14 +1618,14 @@ class SwydoClient(object):
 
                             # On the client side, validate incoming responses
                             # On the server side, validate outgoing responses
-                            'validate_responses': swaggerValidation,
+                            'validate_responses': fullValidation,
 
                             # On the client side, validate outgoing requests
                             # On the server side, validate incoming requests
-                            'validate_requests': swaggerValidation,
+                            'validate_requests': fullValidation,
 
                             # Use swagger_spec_validator to validate the swagger spec
-                            'validate_swagger_spec': swaggerValidation,
+                            'validate_swagger_spec': specValidation,
 
                             # Use Python classes (models) instead of dicts for #/definitions/{models}
                             # On the client side, this applies to incoming responses.
@@ -963,8 +1646,10 @@ class SwydoClient(object):
                         }
                     )
                 logging.info('Got OpenAPI spec successfully.')
-                # _client.swagger_spec.api_url = 'http://%s:%s/beep' % config.microservices.beepEndpoint
-                # self._bravadoClient.swagger_spec.api_url = '' % config.microservices.beepURL
+                if self._apiUrl:
+                    self._bravadoClient.swagger_spec.api_url = self._apiUrl
+                _makeResolverThreadSafe(self._bravadoClient.swagger_spec.resolver)
+                _makeMemoizationThreadSafe()
             except Exception:
                 self._bravadoClient = None
                 logging.exception('Cannot find OpenAPI spec.')
@@ -973,3 +1658,129 @@ class SwydoClient(object):
 # ======================================================================================================================
 # Private Members
 # ======================================================================================================================
+
+class _ThreadLocalRequestsClient(RequestsClient):
+    """
+    Bravado RequestsClient that gives every thread its own requests.Session.
+
+    requests.Session is not guaranteed to be thread-safe, so sessions (and their connection pools) are never shared
+    between threads.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self._local = threading.local()
+        super().__init__(*args, **kwargs)
+
+    @property  # type: ignore
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    @session.setter
+    def session(self, value: requests.Session) -> None:
+        self._local.session = value
+
+
+def _makeResolverThreadSafe(resolver: Any) -> None:
+    """
+    Give each thread its own resolution scope stack in the spec's jsonschema RefResolver.
+
+    bravado shares a single RefResolver between all calls for dereferencing and validation, and the resolver pushes
+    and pops scopes on a plain list - concurrent calls corrupt each other's scopes.
+    """
+
+    baseScopes = list(resolver._scopes_stack)
+    local = threading.local()
+
+    class _ThreadSafeRefResolver(resolver.__class__):  # type: ignore
+
+        @property  # type: ignore
+        def _scopes_stack(self) -> list:
+            stack = getattr(local, 'stack', None)
+            if stack is None:
+                stack = local.stack = list(baseScopes)
+            return stack
+
+        @_scopes_stack.setter
+        def _scopes_stack(self, value: list) -> None:
+            local.stack = value
+
+    resolver.__class__ = _ThreadSafeRefResolver
+
+
+class _ThreadLocalKeySet(object):
+    """
+    Set of keys with separate contents per thread.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+
+    def _keys(self) -> set:
+        keys = getattr(self._local, 'keys', None)
+        if keys is None:
+            keys = self._local.keys = set()
+        return keys
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._keys()
+
+    def add(self, key: Any) -> None:
+        self._keys().add(key)
+
+    def remove(self, key: Any) -> None:
+        self._keys().remove(key)
+
+
+_memoizationLock = threading.Lock()
+_memoizationPatched = False
+
+
+def _makeMemoizationThreadSafe() -> None:
+    """
+    Give each thread its own set of in-progress keys in bravado_core's memoized schema helpers.
+
+    bravado_core's memoize_by_id detects recursive schemas by keeping the keys being computed in a set shared by all
+    threads, so two threads computing the same key for the first time make one of them fail with
+    RecursiveCallException. With a set per thread, both threads compute the (identical) value instead.
+
+    This relies on internals of bravado-core, hence its pinned version in requirements.txt.
+
+    :raise RuntimeError: A helper no longer holds its key set where bravado-core 6.4.1 does.
+    """
+
+    global _memoizationPatched
+
+    from bravado_core import _decorators, marshal, swagger20_validator, unmarshal
+
+    memoizedFunctions = (
+        unmarshal._get_unmarshaling_method,
+        marshal._get_marshaling_method,
+        _decorators.handle_null_value,
+        swagger20_validator.get_validator_type,
+    )
+
+    def replaceKeySets(function: Callable) -> int:
+        # The memoizing wrapper may itself be wrapped by other decorators, holding it in their closure
+        replaced = 0
+        for cell in function.__closure__ or ():
+            if type(cell.cell_contents) is set:
+                cell.cell_contents = _ThreadLocalKeySet()
+                replaced += 1
+            elif callable(cell.cell_contents) and hasattr(cell.cell_contents, '__closure__'):
+                replaced += replaceKeySets(cell.cell_contents)
+        return replaced
+
+    with _memoizationLock:
+        if _memoizationPatched:
+            return
+        for function in memoizedFunctions:
+            if not replaceKeySets(function):
+                raise RuntimeError(
+                    "Cannot make bravado-core's %s thread-safe - install the bravado-core version of requirements.txt."
+                    % function.__qualname__
+                )
+        _memoizationPatched = True
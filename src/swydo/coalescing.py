@@ -0,0 +1,217 @@
+"""
+Coalescing of successive partial updates of the same entity into a single call.
+
+Example usage:
+
+    from swydo.coalescing import WriteCoalescer
+
+    swydoClient = SwydoClient(apiKey, writeCoalescer=WriteCoalescer(window=0.5))
+    swydoClient.updateTeamClient(teamId, clientId, name='Acme')
+    swydoClient.updateTeamClient(teamId, clientId, description='Widgets')
+    # A single updateTeamClient call is sent half a second after the first update, or now:
+    swydoClient.flushWrites()
+"""
+
+import atexit
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+# Update operations that may be coalesced, with the parameter holding the id of their entity and their body parameter
+COALESCED_OPERATIONS = dict(
+    updateTeamClient=('clientId', 'clientUpdate'),
+    updateTeamReport=('reportId', 'reportUpdate'),
+)
+
+
+class WriteCoalescer(object):
+    """
+    Holds partial updates of entities for a short window, merging the fields of further updates of the same entity,
+    then sends them as a single call. Later updates of a field win.
+
+    Pending updates are sent `window` seconds after the first one, or on `flush`. While they are pending or being
+    sent, they are applied to the entity's single entity reads through the same client (read-your-writes), and sent
+    before any other write of the entity, to keep writes in order.
+
+    Pass an instance to SwydoClient(writeCoalescer=...). Update methods then return a concurrent.futures.Future of the
+    result of the combined call, instead of the result. Failed combined calls are logged, and raise from their futures.
+
+    Call `close` (or SwydoClient.flushWrites) before the program ends, to send pending updates and see their errors.
+    Updates still pending when the interpreter exits normally are sent then as a last resort, but those pending on
+    os._exit or a fatal signal are lost.
+    """
+
+    def __init__(self, window: float = 0.5, maxConcurrency: int = 4) -> None:
+        """
+        :param window: Seconds pending updates of an entity are held for, from the first one.
+        :param maxConcurrency: Maximum number of combined calls in flight at once, when sent after their window.
+        """
+        if window < 0:
+            raise ValueError("window must not be negative.")
+        if maxConcurrency < 1:
+            raise ValueError("maxConcurrency must be at least 1.")
+
+        self._window = window
+        self._executor = ThreadPoolExecutor(max_workers=maxConcurrency, thread_name_prefix='swydo-coalescer')
+        self._lock = threading.Lock()
+        self._timerScheduled = False
+        self._pending: Dict[Hashable, _PendingWrite] = dict()
+        self._sending: Dict[Hashable, _PendingWrite] = dict()
+        self._stats: Dict[str, int] = dict(updates=0, calls=0)
+        _liveCoalescers.add(self)
+
+    def submit(self, key: Hashable, fields: Dict[str, Any], send: Callable[[Dict[str, Any]], Any]) -> Future:
+        """
+        Adds a partial update of an entity.
+
+        :param key: Identifies the entity, and the kind of update.
+        :param fields: Fields to update.
+        :param send: Makes the combined call, given the merged fields of all pending updates of the entity.
+        :return: Future of the result of the combined call.
+        """
+
+        with self._lock:
+            self._stats['updates'] += 1
+            write = self._pending.get(key)
+            if write is not None:
+                write.fields.update(fields)
+                return write.future
+            write = self._pending[key] = _PendingWrite(dict(fields), send, time.monotonic() + self._window)
+            if not self._timerScheduled:
+                self._scheduleTimer(self._window)
+            return write.future
+
+    def getPendingFields(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """
+        Returns the merged fields of the updates of an entity that were not applied by Swydo yet, or None if there are
+        none.
+        """
+
+        with self._lock:
+            sending = self._sending.get(key)
+            pending = self._pending.get(key)
+            if sending is None and pending is None:
+                return None
+            return dict(sending.fields if sending else (), **(pending.fields if pending else {}))
+
+    def flush(self, key: Optional[Hashable] = None) -> None:
+        """
+        Sends the pending updates of an entity, or of all entities, right away, and waits for them to complete -
+        including those already being sent. Errors are not raised, but set on the futures of the updates.
+        """
+
+        with self._lock:
+            keys = [key] if key is not None else list(dict.fromkeys(list(self._pending) + list(self._sending)))
+            writes = [(key, self._pending.get(key), self._sending.get(key)) for key in keys]
+        for key, pending, sending in writes:
+            if sending is not None:
+                _waitQuietly(sending.future)
+            if pending is not None:
+                self._sendPending(key, pending)
+                _waitQuietly(pending.future)
+
+    def getStats(self) -> Dict[str, int]:
+        """
+        Returns the number of updates submitted, and of combined calls sent for them.
+        """
+
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self) -> None:
+        """
+        Sends all pending updates, and waits for them to complete.
+        """
+
+        self.flush()
+        self._executor.shutdown()
+        _liveCoalescers.discard(self)
+
+    # ==================================================================================================================
+    # Private Members
+    # ==================================================================================================================
+
+    def _scheduleTimer(self, delay: float) -> None:
+        # Called with the lock held
+        self._timerScheduled = True
+        timer = threading.Timer(delay, self._sendDue)
+        timer.daemon = True
+        timer.start()
+
+    def _sendDue(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            due = [(key, write) for key, write in self._pending.items() if write.dueAt <= now]
+            nextDueAt = min((write.dueAt for write in self._pending.values() if write.dueAt > now), default=None)
+            self._timerScheduled = False
+            if nextDueAt is not None:
+                self._scheduleTimer(nextDueAt - now)
+        try:
+            for key, write in due:
+                self._executor.submit(self._sendPending, key, write)
+        except RuntimeError:
+            # The interpreter is exiting: the writes left pending are sent by _flushAtExit
+            pass
+
+    def _sendPending(self, key: Hashable, write: '_PendingWrite') -> None:
+        with self._lock:
+            if self._pending.get(key) is not write:
+                # Already sent, by a flush or after its window
+                return
+            del self._pending[key]
+            # A previous combined call of the entity is still in flight: keep the calls in order
+            previous = self._sending.get(key)
+            self._sending[key] = write
+            self._stats['calls'] += 1
+        if previous is not None:
+            _waitQuietly(previous.future)
+
+        try:
+            write.future.set_result(write.send(write.fields))
+        except BaseException as e:
+            logging.exception('Swydo coalesced update %s failed.', key)
+            write.future.set_exception(e)
+        finally:
+            with self._lock:
+                if self._sending.get(key) is write:
+                    del self._sending[key]
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+class _PendingWrite(object):
+
+    __slots__ = ('fields', 'send', 'dueAt', 'future')
+
+    def __init__(self, fields: Dict[str, Any], send: Callable[[Dict[str, Any]], Any], dueAt: float) -> None:
+        self.fields = fields
+        self.send = send
+        self.dueAt = dueAt
+        self.future: Future = Future()
+
+
+def _waitQuietly(future: Future) -> None:
+    try:
+        future.result()
+    except BaseException:
+        pass
+
+
+def _flushAtExit() -> None:
+    for coalescer in list(_liveCoalescers):
+        coalescer.flush()
+
+
+# Coalescers that were not closed, whose pending updates are sent when the interpreter exits
+_liveCoalescers: 'weakref.WeakSet[WriteCoalescer]' = weakref.WeakSet()
+atexit.register(_flushAtExit)
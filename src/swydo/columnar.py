@@ -0,0 +1,286 @@
+"""
+Columnar export of Swydo entities, for loading large team inventories into analytics tools.
+
+Items of list methods are streamed into column batches of at most `batchSize` rows, so memory use is bounded by the
+batch size rather than the number of entities. The columns of every entity, and their types, come from the definitions
+of the OpenAPI spec (see swydo.models).
+
+Example usage:
+
+    from swydo.columnar import ColumnarExporter
+    exporter = ColumnarExporter(swydoClient)
+    exporter.toParquet('reports', 'reports.parquet', teamId=TEAM_ID)
+    table = pyarrow.Table.from_batches(exporter.recordBatches('clients', teamId=TEAM_ID))
+
+Arrow record batches and Parquet files require the optional `pyarrow` dependency (pip install swydo[arrow]), and
+NumPy structured arrays the `numpy` one (pip install swydo[numpy]). CSV needs neither.
+"""
+
+import csv
+import json
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Type
+
+from .client import SwydoClient
+from . import models
+from .models import TEAM_ENTITIES, Model
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+# List operation of each entity that can be exported
+OPERATIONS = dict(teams='getTeams', **TEAM_ENTITIES)
+
+DEFAULT_BATCH_SIZE = 65536
+
+
+def iterateColumns(
+        items: Iterable[Any],
+        model: Type[Model],
+        batchSize: int = DEFAULT_BATCH_SIZE
+) -> Iterator[Dict[str, List[Any]]]:
+    """
+    Streams entities into batches of columns, each a dict of a list of values by field, in the field order of the spec.
+    Object and array fields are encoded as JSON strings, and missing fields are None.
+
+    :param items: Entities in the wire format, or typed models.
+    :param model: Model of the entities, whose fields are the columns.
+    :param batchSize: Maximum number of rows of a batch.
+    """
+
+    if batchSize < 1:
+        raise ValueError("batchSize must be at least 1.")
+
+    fields = model.FIELDS
+    encoded = frozenset(field for field in fields if model.FIELD_TYPES[field] in ('object', 'array'))
+    columns: Dict[str, List[Any]] = {field: [] for field in fields}
+    # Appending to each column directly, instead of building a row first
+    appenders = [(field, columns[field].append) for field in fields]
+    rows = 0
+
+    for item in items:
+        for field, append in appenders:
+            value = item.get(field)
+            if field in encoded and value is not None:
+                value = json.dumps(value, default=str, sort_keys=True)
+            append(value)
+        rows += 1
+        if rows == batchSize:
+            yield columns
+            columns = {field: [] for field in fields}
+            appenders = [(field, columns[field].append) for field in fields]
+            rows = 0
+
+    if rows:
+        yield columns
+
+
+def arrowSchema(model: Type[Model]) -> Any:
+    """
+    Returns the Arrow schema of a model. Object and array fields are JSON strings.
+    """
+
+    _requirePyarrow()
+    types = dict(
+        string=pyarrow.string(),
+        boolean=pyarrow.bool_(),
+        integer=pyarrow.int64(),
+        number=pyarrow.float64(),
+    )
+    return pyarrow.schema([
+        pyarrow.field(field, types.get(model.FIELD_TYPES[field], pyarrow.string())) for field in model.FIELDS
+    ])
+
+
+def iterateRecordBatches(
+        items: Iterable[Any],
+        model: Type[Model],
+        batchSize: int = DEFAULT_BATCH_SIZE
+) -> Iterator[Any]:
+    """
+    Streams entities into Arrow record batches, with the schema of `arrowSchema`.
+    """
+
+    schema = arrowSchema(model)
+    for columns in iterateColumns(items, model, batchSize=batchSize):
+        yield pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(columns[field.name], type=field.type) for field in schema],
+            schema=schema,
+        )
+
+
+def writeParquet(
+        items: Iterable[Any],
+        model: Type[Model],
+        path: str,
+        batchSize: int = DEFAULT_BATCH_SIZE,
+        compression: str = 'snappy'
+) -> int:
+    """
+    Streams entities into a Parquet file, one row group per batch.
+
+    :return: Number of rows written.
+    """
+
+    _requirePyarrow()
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(path, arrowSchema(model), compression=compression) as writer:
+        for batch in iterateRecordBatches(items, model, batchSize=batchSize):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+def numpyDtype(model: Type[Model]) -> Any:
+    """
+    Returns the NumPy structured dtype of a model. Numbers are floats, with NaN for missing values, and all other
+    fields are objects, with None for missing values.
+    """
+
+    _requireNumpy()
+    return numpy.dtype([
+        (field, 'f8' if model.FIELD_TYPES[field] in ('integer', 'number') else 'O') for field in model.FIELDS
+    ])
+
+
+def toNumpy(items: Iterable[Any], model: Type[Model], batchSize: int = DEFAULT_BATCH_SIZE) -> Any:
+    """
+    Streams entities into a NumPy structured array, with the dtype of `numpyDtype`.
+    """
+
+    dtype = numpyDtype(model)
+    batches = []
+    for columns in iterateColumns(items, model, batchSize=batchSize):
+        batch = numpy.empty(len(columns[model.FIELDS[0]]), dtype=dtype)
+        for field in model.FIELDS:
+            values = columns[field]
+            if dtype[field].kind == 'f':
+                values = [numpy.nan if value is None else value for value in values]
+            batch[field] = values
+        batches.append(batch)
+    return numpy.concatenate(batches) if batches else numpy.empty(0, dtype=dtype)
+
+
+def writeCsv(items: Iterable[Any], model: Type[Model], stream: TextIO, batchSize: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Streams entities into CSV, with a header row of the model's fields. Missing fields are empty.
+
+    :return: Number of rows written.
+    """
+
+    writer = csv.writer(stream)
+    writer.writerow(model.FIELDS)
+    rows = 0
+    for columns in iterateColumns(items, model, batchSize=batchSize):
+        batch = list(zip(*(columns[field] for field in model.FIELDS)))
+        writer.writerows(batch)
+        rows += len(batch)
+    return rows
+
+
+class ColumnarExporter(object):
+    """
+    Exports the entities of list methods of a client in columnar formats.
+
+    Entities are the keys of OPERATIONS. All of them except `teams` are listed per team, and require a `teamId`.
+    """
+
+    def __init__(self, swydoClient: SwydoClient, batchSize: int = DEFAULT_BATCH_SIZE) -> None:
+        """
+        :param swydoClient: Client to list entities with.
+        :param batchSize: Maximum number of rows held in memory at once.
+        """
+        self._swydoClient = swydoClient
+        self._batchSize = batchSize
+
+    def recordBatches(self, entity: str, teamId: Optional[str] = None) -> Iterator[Any]:
+        """
+        Streams the entities into Arrow record batches.
+        """
+
+        model, items = self._list(entity, teamId)
+        return iterateRecordBatches(items, model, batchSize=self._batchSize)
+
+    def toParquet(self, entity: str, path: str, teamId: Optional[str] = None, compression: str = 'snappy') -> int:
+        """
+        Streams the entities into a Parquet file.
+
+        :return: Number of rows written.
+        """
+
+        _requirePyarrow()
+        model, items = self._list(entity, teamId)
+        return writeParquet(items, model, path, batchSize=self._batchSize, compression=compression)
+
+    def toNumpy(self, entity: str, teamId: Optional[str] = None) -> Any:
+        """
+        Returns the entities as a NumPy structured array.
+        """
+
+        _requireNumpy()
+        model, items = self._list(entity, teamId)
+        return toNumpy(items, model, batchSize=self._batchSize)
+
+    def toCsv(self, entity: str, stream: TextIO, teamId: Optional[str] = None) -> int:
+        """
+        Streams the entities into CSV.
+
+        :return: Number of rows written.
+        """
+
+        model, items = self._list(entity, teamId)
+        return writeCsv(items, model, stream, batchSize=self._batchSize)
+
+    def export(self, entity: str, path: str, teamId: Optional[str] = None) -> str:
+        """
+        Exports the entities to a file: Parquet if pyarrow is installed, otherwise CSV.
+
+        :param path: Path of the file, without extension - `.parquet` or `.csv` is appended.
+        :return: Path of the written file.
+        """
+
+        if pyarrow is not None:
+            path += '.parquet'
+            self.toParquet(entity, path, teamId=teamId)
+        else:
+            path += '.csv'
+            with open(path, 'w', encoding='utf-8', newline='') as stream:
+                self.toCsv(entity, stream, teamId=teamId)
+        return path
+
+    def _list(self, entity: str, teamId: Optional[str]) -> Any:
+        operationId = OPERATIONS.get(entity)
+        if operationId is None:
+            raise ValueError("Unknown entity %s, expected one of: %s." % (entity, ', '.join(OPERATIONS)))
+        lister: Callable[..., Iterable[Any]] = getattr(self._swydoClient, operationId)
+        if entity == 'teams':
+            return models.MODELS_BY_OPERATION[operationId], lister()
+        if not teamId:
+            raise ValueError("Exporting %s requires a teamId." % entity)
+        return models.MODELS_BY_OPERATION[operationId], lister(teamId=teamId)
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+def _requirePyarrow() -> None:
+    if pyarrow is None:
+        raise ImportError("Arrow and Parquet export requires pyarrow, install it with: pip install swydo[arrow]")
+
+
+def _requireNumpy() -> None:
+    if numpy is None:
+        raise ImportError("NumPy export requires numpy, install it with: pip install swydo[numpy]")
@@ -0,0 +1,155 @@
+"""
+Credential providers, supplying the API key of every Swydo API call.
+
+Example usage:
+
+    from swydo.credentials import RotatingCredentials
+
+    credentials = RotatingCredentials(OLD_API_KEY)
+    swydoClient = SwydoClient(credentials=credentials)
+    ...
+    # Calls from now on use the new key, in-flight calls complete with the old one
+    credentials.rotate(NEW_API_KEY)
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+class CredentialProvider(object):
+    """
+    Supplies the API key of every call. SwydoClient asks for it before each HTTP call, from any of its threads, so
+    implementations must be thread-safe and fast - keep keys in memory, and refresh them in the background or
+    sparingly.
+    """
+
+    def getApiKey(self) -> str:
+        raise NotImplementedError()
+
+    def getAccount(self) -> Optional[str]:
+        """
+        Returns an identifier of the Swydo account the current key belongs to, or None if each key may belong to a
+        different account. Responses cached for an account (see swydo.cache) are kept across rotations of its key.
+        """
+
+        return None
+
+
+class StaticCredentials(CredentialProvider):
+    """
+    A single API key, as passed to SwydoClient(apiKey=...).
+    """
+
+    def __init__(self, apiKey: str) -> None:
+        if not apiKey:
+            raise ValueError("apiKey must not be empty.")
+        self._apiKey = apiKey
+
+    def getApiKey(self) -> str:
+        return self._apiKey
+
+
+class RotatingCredentials(CredentialProvider):
+    """
+    An API key that can be replaced at runtime, e.g. by a secret rotation job, or to switch the client to another
+    account.
+    """
+
+    def __init__(self, apiKey: str, account: Optional[str] = None) -> None:
+        """
+        :param apiKey: Initial API key.
+        :param account: Identifier of the account of the key, if rotations keep to the same account.
+        """
+        if not apiKey:
+            raise ValueError("apiKey must not be empty.")
+        # A key and its account are swapped together, as a single reference
+        self._current = (apiKey, account)
+
+    def getApiKey(self) -> str:
+        return self._current[0]
+
+    def getAccount(self) -> Optional[str]:
+        return self._current[1]
+
+    def rotate(self, apiKey: str, account: Optional[str] = None) -> None:
+        """
+        Replaces the API key. Calls already sent complete with the previous key.
+
+        :param account: Identifier of the account of the new key. Defaults to the current account - pass a different
+                        one when switching accounts.
+        """
+
+        if not apiKey:
+            raise ValueError("apiKey must not be empty.")
+        self._current = (apiKey, account if account is not None else self._current[1])
+
+
+class FileCredentials(CredentialProvider):
+    """
+    An API key read from a file, e.g. a mounted secret, and re-read when the file changes.
+
+    The file's modification time is checked at most every `checkInterval` seconds, so rotating the key in the file
+    takes effect within that time, without any call waiting for it.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            checkInterval: float = 10.0,
+            account: Optional[str] = None,
+            clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        """
+        :param path: Path of a file holding the API key, surrounding whitespace ignored.
+        :param checkInterval: Least number of seconds between checks of the file for changes.
+        :param account: Identifier of the account of the keys in the file.
+        :param clock: Monotonic clock, in seconds.
+        """
+        self._path = path
+        self._checkInterval = checkInterval
+        self._account = account
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._modifiedAt = os.stat(path).st_mtime_ns
+        self._apiKey = self._read()
+        self._checkedAt = clock()
+
+    def getApiKey(self) -> str:
+        if self._clock() - self._checkedAt >= self._checkInterval and self._lock.acquire(blocking=False):
+            # A single thread checks, the others keep using the current key meanwhile
+            try:
+                self._refresh()
+            finally:
+                self._lock.release()
+        return self._apiKey
+
+    def getAccount(self) -> Optional[str]:
+        return self._account
+
+    # ==================================================================================================================
+    # Private Members
+    # ==================================================================================================================
+
+    def _refresh(self) -> None:
+        self._checkedAt = self._clock()
+        try:
+            modifiedAt = os.stat(self._path).st_mtime_ns
+            if modifiedAt != self._modifiedAt:
+                self._apiKey = self._read()
+                self._modifiedAt = modifiedAt
+        except (OSError, ValueError):
+            # Mid-rotation, the file may be missing or empty for a moment: keep the current key
+            pass
+
+    def _read(self) -> str:
+        with open(self._path, encoding='utf-8') as file:
+            apiKey = file.read().strip()
+        if not apiKey:
+            raise ValueError("API key file %s is empty." % self._path)
+        return apiKey
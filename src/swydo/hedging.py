@@ -0,0 +1,319 @@
+"""
+Hedging of idempotent Swydo API calls, to cut tail latency.
+"""
+
+import contextvars
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, FrozenSet, Iterable, List, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+# Idempotent single entity reads, hedged by default
+HEDGED_OPERATIONS = frozenset((
+    'getTeam', 'getTeamUser', 'getTeamBrandTemplate', 'getTeamReportTemplate', 'getTeamConnection', 'getTeamClient',
+    'getClientDataSources', 'getTeamReport',
+))
+
+
+class LatencyTracker(object):
+    """
+    Thread-safe tracker of the latency quantiles of operations, over their most recent calls.
+    """
+
+    def __init__(self, window: int = 500) -> None:
+        """
+        :param window: Number of most recent calls of each operation to compute quantiles over.
+        """
+        if window < 1:
+            raise ValueError("window must be at least 1.")
+
+        self._window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = dict()
+        # Sorted copy of the samples of each operation, rebuilt lazily after new samples
+        self._sorted: Dict[str, Tuple[float, ...]] = dict()
+
+    def record(self, operationId: str, latency: float) -> None:
+        with self._lock:
+            samples = self._samples.get(operationId)
+            if samples is None:
+                samples = self._samples[operationId] = deque(maxlen=self._window)
+            samples.append(latency)
+            self._sorted.pop(operationId, None)
+
+    def count(self, operationId: str) -> int:
+        """
+        Returns the number of samples of an operation, up to the window size.
+        """
+
+        with self._lock:
+            return len(self._samples.get(operationId, ()))
+
+    def quantile(self, operationId: str, percentile: float) -> Optional[float]:
+        """
+        Returns a latency quantile of an operation, e.g. its median for percentile=50, or None without samples.
+        """
+
+        with self._lock:
+            ordered = self._sorted.get(operationId)
+            if ordered is None:
+                samples = self._samples.get(operationId)
+                if not samples:
+                    return None
+                ordered = self._sorted[operationId] = tuple(sorted(samples))
+        return ordered[min(int(len(ordered) * percentile / 100), len(ordered) - 1)]
+
+    def operationIds(self) -> FrozenSet[str]:
+        with self._lock:
+            return frozenset(self._samples)
+
+
+class RequestHedger(object):
+    """
+    Sends a duplicate of a slow idempotent call, using its result when the call fails, e.g. times out.
+
+    Calls are made on the calling thread, and a call is hedged once it takes longer than the `percentile` latency of
+    its operation, as tracked over its recent calls: the duplicate is sent from a pool of `maxWorkers` threads, in the
+    context of the call (e.g. its deadline). As the call itself can't be abandoned, hedging pays off with a timeout on
+    calls (see SwydoClient(timeout=...)), which a stuck call runs into while its duplicate has long completed.
+
+    The duplicate is only sent when the client's rate limiter has a call to spare right away, and hedges never exceed
+    `maxHedgeRatio` of the calls, so hedging never delays other calls or bursts the rate limit. `getStats` reports how
+    many calls hedging cost, and how many it won.
+
+    Pass an instance to SwydoClient(hedger=...).
+    """
+
+    def __init__(
+            self,
+            operations: Iterable[str] = HEDGED_OPERATIONS,
+            percentile: float = 95,
+            minSamples: int = 20,
+            minDelay: float = 0.02,
+            maxHedgeRatio: float = 0.1,
+            window: int = 500,
+            maxWorkers: int = 16
+    ) -> None:
+        """
+        :param operations: Operation ids to hedge. Only idempotent operations may be hedged.
+        :param percentile: Latency percentile of an operation after which a call of it is hedged.
+        :param minSamples: Operations are only hedged once this many of their calls were timed.
+        :param minDelay: Least number of seconds to wait before hedging.
+        :param maxHedgeRatio: Maximum number of hedges, as a share of the calls of hedged operations.
+        :param window: Number of most recent calls of each operation to compute its percentile over.
+        :param maxWorkers: Maximum number of hedges in flight at once.
+        """
+        if not 0 < percentile < 100:
+            raise ValueError("percentile must be between 0 and 100.")
+        if not 0 <= maxHedgeRatio <= 1:
+            raise ValueError("maxHedgeRatio must be between 0 and 1.")
+
+        self._operations = frozenset(operations)
+        self._percentile = percentile
+        self._minSamples = minSamples
+        self._minDelay = minDelay
+        self._maxHedgeRatio = maxHedgeRatio
+        self._latencies = LatencyTracker(window=window)
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix='swydo-hedger')
+        self._scheduler = _Scheduler()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = dict(calls=0, hedged=0, hedgeWins=0, skippedNoBudget=0, skippedRatio=0)
+
+    @property
+    def latencies(self) -> LatencyTracker:
+        """Latencies of the calls of hedged operations."""
+        return self._latencies
+
+    def isHedged(self, operationId: str) -> bool:
+        return operationId in self._operations
+
+    def getDelay(self, operationId: str) -> Optional[float]:
+        """
+        Returns the number of seconds after which a call of an operation is hedged, or None while it has too few
+        samples.
+        """
+
+        if self._latencies.count(operationId) < self._minSamples:
+            return None
+        return max(self._latencies.quantile(operationId, self._percentile) or 0.0, self._minDelay)
+
+    def getStats(self) -> Dict[str, float]:
+        """
+        Returns the number of calls of hedged operations, of hedges sent (extra calls) and won (the hedge finished
+        first), of hedges skipped for lack of rate budget or over the hedge ratio, the extra calls as a share of all
+        calls, and the p50/p95/p99 latencies of each operation.
+        """
+
+        with self._lock:
+            stats: Dict[str, float] = dict(self._stats)
+        stats['extraCallRatio'] = stats['hedged'] / stats['calls'] if stats['calls'] else 0.0
+        for operationId in sorted(self._latencies.operationIds()):
+            for percentile in (50, 95, 99):
+                stats['%s.p%d' % (operationId, percentile)] = self._latencies.quantile(operationId, percentile) or 0.0
+        return stats
+
+    def call(
+            self,
+            operationId: str,
+            invoke: Callable[[], T],
+            tryAcquire: Callable[[], bool],
+            release: Callable[[float, bool], None],
+            invokeHedge: Optional[Callable[[], T]] = None
+    ) -> T:
+        """
+        Makes a call on the calling thread, hedging it if it is slow.
+
+        :param operationId: Operation of the call.
+        :param invoke: Makes the call.
+        :param tryAcquire: Takes a call from the rate budget if one is available right away, without blocking.
+        :param release: Reports the latency, and whether it was throttled, of a hedge that took a call from the budget.
+        :param invokeHedge: Makes the hedge, on a thread of the pool. Defaults to invoke.
+        :return: Result of the call, or of its hedge if the call fails.
+        :raise: Error of the call, when neither succeeds.
+        """
+
+        with self._lock:
+            self._stats['calls'] += 1
+
+        delay = self.getDelay(operationId)
+        if delay is None:
+            # Not enough samples to know what is slow yet
+            return self._timed(operationId, invoke)
+
+        context = contextvars.copy_context()
+        hedge: List[Future] = []
+        finished = [False]
+
+        def sendHedge() -> None:
+            with self._lock:
+                if finished[0]:
+                    return
+                if self._stats['hedged'] + 1 > self._stats['calls'] * self._maxHedgeRatio:
+                    self._stats['skippedRatio'] += 1
+                    return
+                if not tryAcquire():
+                    self._stats['skippedNoBudget'] += 1
+                    return
+                self._stats['hedged'] += 1
+                hedge.append(self._executor.submit(
+                    context.run, self._timedHedge, operationId, invokeHedge or invoke, release
+                ))
+
+        # Timed from the start of the call, on the calling thread, so no queueing delays the hedge
+        scheduled = self._scheduler.schedule(time.monotonic() + delay, sendHedge)
+        try:
+            return self._timed(operationId, invoke)
+        except Exception:
+            with self._lock:
+                finished[0] = True
+            if not hedge:
+                raise
+            try:
+                result = hedge[0].result()
+            except Exception:
+                # The error of the call, rather than the one of its duplicate
+                pass
+            else:
+                with self._lock:
+                    self._stats['hedgeWins'] += 1
+                return result
+            raise
+        finally:
+            with self._lock:
+                finished[0] = True
+            self._scheduler.cancel(scheduled)
+
+    def close(self) -> None:
+        self._scheduler.close()
+        self._executor.shutdown(wait=False)
+
+    # ==================================================================================================================
+    # Private Members
+    # ==================================================================================================================
+
+    def _timed(self, operationId: str, invoke: Callable[[], T]) -> T:
+        started = time.monotonic()
+        result = invoke()
+        # Only successful calls are timed - failures are often fast, and would lower the percentile
+        self._latencies.record(operationId, time.monotonic() - started)
+        return result
+
+    def _timedHedge(self, operationId: str, invoke: Callable[[], T], release: Callable[[float, bool], None]) -> T:
+        started = time.monotonic()
+        throttled = False
+        try:
+            return self._timed(operationId, invoke)
+        except Exception as e:
+            throttled = getattr(getattr(e, 'response', None), 'status_code', None) == 429
+            raise
+        finally:
+            release(time.monotonic() - started, throttled)
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+class _Scheduler(object):
+    """
+    Runs callbacks at given times, on a single thread started on first use. Callbacks must be quick.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        # Entries of [time, sequence, callback], the callback set to None once cancelled
+        self._heap: List[List[Any]] = []
+        self._sequence = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def schedule(self, at: float, callback: Callable[[], None]) -> List[Any]:
+        """
+        Runs `callback` at monotonic time `at`.
+
+        :return: Entry to pass to cancel.
+        """
+
+        entry = [at, next(self._sequence), callback]
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='swydo-hedger-scheduler', daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._condition.notify()
+        return entry
+
+    def cancel(self, entry: List[Any]) -> None:
+        # Left in the heap, and skipped when due
+        entry[2] = None
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    self._condition.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                if self._closed:
+                    return
+                callback = heapq.heappop(self._heap)[2]
+            if callback is not None:
+                try:
+                    callback()
+                except Exception:
+                    logging.exception('Swydo hedger callback failed.')
@@ -0,0 +1,180 @@
+"""
+Lazy hydration of list items with their details.
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Mapping, Optional
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+class Hydrator(object):
+    """
+    Fetches the details of items, coalescing and batching requests.
+
+    Requests for the same item share a single call. Requests made within `batchWindow` seconds of each other - from
+    any number of threads, or by `prefetch` - are sent together, up to `maxConcurrency` calls at once.
+    """
+
+    def __init__(
+            self,
+            fetchDetails: Callable[[Hashable], Dict[str, Any]],
+            maxConcurrency: int = 4,
+            batchWindow: float = 0.005
+    ) -> None:
+        """
+        :param fetchDetails: Fetches the details of a single item, given its key.
+        :param maxConcurrency: Maximum number of detail calls in flight at once.
+        :param batchWindow: Seconds to wait for more requests before sending a batch.
+        """
+        if maxConcurrency < 1:
+            raise ValueError("maxConcurrency must be at least 1.")
+
+        self._fetchDetails = fetchDetails
+        self._batchWindow = batchWindow
+        self._executor = ThreadPoolExecutor(max_workers=maxConcurrency, thread_name_prefix='swydo-hydrator')
+        self._lock = threading.Lock()
+        self._futures: Dict[Hashable, Future] = dict()
+        self._pending: List[Hashable] = []
+        self._flushScheduled = False
+        self._calls = 0
+
+    @property
+    def calls(self) -> int:
+        """Number of detail calls made so far."""
+        with self._lock:
+            return self._calls
+
+    def request(self, key: Hashable) -> Future:
+        """
+        Asks for the details of an item, returning a future of them. The call is sent with the next batch.
+        """
+
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                return future
+            future = self._futures[key] = Future()
+            self._pending.append(key)
+            if not self._flushScheduled:
+                self._flushScheduled = True
+                # Give other requests a chance to join this batch
+                timer = threading.Timer(self._batchWindow, self._flush)
+                timer.daemon = True
+                timer.start()
+            return future
+
+    def hydrate(self, key: Hashable) -> Dict[str, Any]:
+        """
+        Returns the details of an item, waiting for them to be fetched along with other pending requests.
+        """
+
+        return self.request(key).result()
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    def _flush(self) -> None:
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._flushScheduled = False
+        for key in batch:
+            self._executor.submit(self._fetch, key)
+
+    def _fetch(self, key: Hashable) -> None:
+        with self._lock:
+            future = self._futures[key]
+            self._calls += 1
+        try:
+            future.set_result(self._fetchDetails(key))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            # Only calls in flight are coalesced - a later request fetches fresh details
+            with self._lock:
+                if self._futures.get(key) is future:
+                    del self._futures[key]
+
+
+class LazyItem(Mapping[str, Any]):
+    """
+    A list item that fetches its details on the first access to a field missing from the list payload.
+
+    Fields of the list payload are read directly, without any call. Iterating, `len` and `keys` only cover the fields
+    known so far - call `hydrate` first to include the details.
+    """
+
+    __slots__ = ('_fields', '_key', '_hydrator', '_future', '_hydrated')
+
+    def __init__(self, fields: Dict[str, Any], key: Hashable, hydrator: Hydrator) -> None:
+        """
+        :param fields: The list payload of the item.
+        :param key: Key of the item for the hydrator.
+        :param hydrator: Fetches the details of the item.
+        """
+        self._fields = fields
+        self._key = key
+        self._hydrator = hydrator
+        self._future: Optional[Future] = None
+        self._hydrated = False
+
+    @property
+    def hydrated(self) -> bool:
+        """Whether the details of the item were fetched."""
+        return self._hydrated
+
+    def hydrate(self) -> 'LazyItem':
+        """
+        Fetches the details of the item, if they were not fetched yet.
+        """
+
+        if not self._hydrated:
+            try:
+                details = self.prefetch().result()
+            finally:
+                # A failed fetch is retried on the next access
+                self._future = None
+            self._fields = dict(self._fields, **details)
+            self._hydrated = True
+        return self
+
+    def prefetch(self) -> Future:
+        """
+        Starts fetching the details of the item in the background, returning a future of them.
+        """
+
+        if self._future is None:
+            self._future = self._hydrator.request(self._key)
+        return self._future
+
+    def __getitem__(self, field: str) -> Any:
+        try:
+            return self._fields[field]
+        except KeyError:
+            if self._hydrated:
+                raise
+        return self.hydrate()._fields[field]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self) -> str:
+        return 'LazyItem(%r%s)' % (self._fields, '' if self._hydrated else ', not hydrated')
+
+
+def prefetch(items: Iterable[Any]) -> None:
+    """
+    Starts fetching the details of the given lazy items in the background, in batches.
+
+    :param items: Items returned by list methods with lazyDetails=True. Items that are not LazyItems are ignored.
+    """
+
+    for item in items:
+        if isinstance(item, LazyItem) and not item.hydrated:
+            item.prefetch()
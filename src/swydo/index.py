@@ -0,0 +1,299 @@
+"""
+Local secondary indexes over Swydo entities.
+"""
+
+import bisect
+import threading
+from collections import defaultdict
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from .client import SwydoClient
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+class HashIndex(object):
+    """
+    Maps keys to the set of ids of the entities having them. Not thread-safe on its own.
+    """
+
+    def __init__(self) -> None:
+        self._ids: Dict[Any, Set[str]] = defaultdict(set)
+
+    def add(self, key: Any, entityId: str) -> None:
+        self._ids[key].add(entityId)
+
+    def discard(self, key: Any, entityId: str) -> None:
+        ids = self._ids.get(key)
+        if ids is not None:
+            ids.discard(entityId)
+            if not ids:
+                del self._ids[key]
+
+    def get(self, key: Any) -> FrozenSet[str]:
+        return frozenset(self._ids.get(key, ()))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class PrefixIndex(object):
+    """
+    Case-insensitive prefix search of ids by terms, over a sorted array. Not thread-safe on its own.
+    """
+
+    def __init__(self) -> None:
+        self._entries: List[Tuple[str, str]] = []
+
+    def add(self, term: str, entityId: str) -> None:
+        entry = (term.lower(), entityId)
+        position = bisect.bisect_left(self._entries, entry)
+        if position == len(self._entries) or self._entries[position] != entry:
+            self._entries.insert(position, entry)
+
+    def discard(self, term: str, entityId: str) -> None:
+        entry = (term.lower(), entityId)
+        position = bisect.bisect_left(self._entries, entry)
+        if position < len(self._entries) and self._entries[position] == entry:
+            del self._entries[position]
+
+    def search(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Returns the ids having a term starting with `prefix`, ordered by term, without duplicates.
+        """
+
+        prefix = prefix.lower()
+        ids: List[str] = []
+        position = bisect.bisect_left(self._entries, (prefix, ''))
+        while position < len(self._entries) and self._entries[position][0].startswith(prefix):
+            entityId = self._entries[position][1]
+            if entityId not in ids:
+                ids.append(entityId)
+                if limit is not None and len(ids) >= limit:
+                    break
+            position += 1
+        return ids
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LocalIndex(object):
+    """
+    In-memory indexes over the clients, reports and users of teams, answering lookups without API calls:
+    reports by client, report template or brand template, clients by the connection of their data sources, and
+    clients or users by name or email prefix.
+
+    The index is fed by the calls of the clients it is attached to: every page of getTeamClients, getTeamReports and
+    getTeamUsers, single entity reads, getClientDataSources, and the mutations made through SwydoClient. It only knows
+    about entities those calls returned - list a team (and the data sources of its clients) to index it fully. Changes
+    made outside of the attached clients are picked up by the next read of the changed entities.
+    """
+
+    # Keys of the data sources of a client, by operation id suffix, as listed by getClientDataSources
+    DATA_SOURCE_PROVIDERS = {
+        'FacebookAds': 'facebookAds',
+        'FacebookGraph': 'facebookGraph',
+        'GoogleAdWords': 'adwords',
+        'GoogleAnalytics': 'analytics',
+    }
+
+    # Indexed fields of each kind of entity
+    FOREIGN_KEYS = {
+        'reports': ('clientId', 'reportTemplateId', 'brandTemplateId'),
+    }
+    SEARCHABLE_FIELDS = {
+        'clients': ('name', 'email'),
+        'users': ('name', 'email'),
+        'reports': ('name',),
+    }
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._entities: Dict[Tuple[str, str, str], Dict[str, Any]] = dict()
+        self._hashIndexes: Dict[Tuple[str, str], HashIndex] = defaultdict(HashIndex)
+        self._prefixIndexes: Dict[str, PrefixIndex] = defaultdict(PrefixIndex)
+        # Connection id of each data source of clients, by (teamId, clientId)
+        self._dataSources: Dict[Tuple[str, str], Dict[str, str]] = dict()
+
+        self._handlers = dict(
+            getTeamClients=lambda params, result: self._putAll(params['teamId'], 'clients', result),
+            getTeamClient=lambda params, result: self._put(params['teamId'], 'clients', result),
+            createTeamClient=lambda params, result: self._put(params['teamId'], 'clients', result),
+            updateTeamClient=lambda params, result: self._update(
+                params['teamId'], 'clients', params['clientId'], params['clientUpdate'], result),
+            archiveTeamClient=lambda params, result: self._update(
+                params['teamId'], 'clients', params['clientId'], dict(archived=True), None),
+            unarchiveTeamClient=lambda params, result: self._update(
+                params['teamId'], 'clients', params['clientId'], dict(archived=False), None),
+            getTeamReports=lambda params, result: self._putAll(params['teamId'], 'reports', result),
+            getTeamReport=lambda params, result: self._put(params['teamId'], 'reports', result),
+            createTeamReport=lambda params, result: self._put(params['teamId'], 'reports', result),
+            updateTeamReport=lambda params, result: self._update(
+                params['teamId'], 'reports', params['reportId'], params['reportUpdate'], result),
+            deleteTeamReport=lambda params, result: self._remove(params['teamId'], 'reports', params['reportId']),
+            getTeamUsers=lambda params, result: self._putAll(params['teamId'], 'users', result),
+            getTeamUser=lambda params, result: self._put(params['teamId'], 'users', result),
+            getClientDataSources=lambda params, result: self._setDataSources(
+                params['teamId'], params['clientId'], result),
+        )
+        for suffix, provider in self.DATA_SOURCE_PROVIDERS.items():
+            self._handlers['setClientDataSource' + suffix] = \
+                lambda params, result, provider=provider: self._setDataSource(
+                    params['teamId'], params['clientId'], provider, params['dataSourceCreate']['connectionId'])
+            self._handlers['removeClientDataSource' + suffix] = \
+                lambda params, result, provider=provider: self._setDataSource(
+                    params['teamId'], params['clientId'], provider, None)
+
+    def attach(self, swydoClient: SwydoClient) -> 'LocalIndex':
+        """
+        Keeps the index up to date with the calls made by a client.
+        """
+
+        swydoClient.addCallObserver(self.observe)
+        return self
+
+    def observe(self, operationId: str, params: Dict[str, Any], result: Any) -> None:
+        """
+        Updates the index with the result of a successful API call.
+        """
+
+        handler = self._handlers.get(operationId)
+        if handler is not None:
+            with self._lock:
+                handler(params, result)
+
+    # ==================================================================================================================
+    # Lookups
+    # ==================================================================================================================
+
+    def getClient(self, teamId: str, clientId: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entities.get(('clients', teamId, clientId))
+
+    def getReport(self, teamId: str, reportId: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entities.get(('reports', teamId, reportId))
+
+    def getUser(self, teamId: str, userId: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entities.get(('users', teamId, userId))
+
+    def getReportsByClient(self, teamId: str, clientId: str) -> List[Dict[str, Any]]:
+        return self._lookup('reports', 'clientId', teamId, clientId)
+
+    def getReportsByReportTemplate(self, teamId: str, reportTemplateId: str) -> List[Dict[str, Any]]:
+        return self._lookup('reports', 'reportTemplateId', teamId, reportTemplateId)
+
+    def getReportsByBrandTemplate(self, teamId: str, brandTemplateId: str) -> List[Dict[str, Any]]:
+        return self._lookup('reports', 'brandTemplateId', teamId, brandTemplateId)
+
+    def getClientIdsByConnection(self, teamId: str, connectionId: str) -> FrozenSet[str]:
+        """
+        Returns the ids of the clients having a data source using a connection, including clients that are not
+        indexed themselves.
+        """
+
+        with self._lock:
+            return self._hashIndexes[('clients', 'connectionId')].get((teamId, connectionId))
+
+    def getClientsByConnection(self, teamId: str, connectionId: str) -> List[Dict[str, Any]]:
+        return self._lookup('clients', 'connectionId', teamId, connectionId)
+
+    def findClients(self, teamId: str, prefix: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the clients whose name or email starts with `prefix`, ignoring case.
+        """
+
+        return self._search('clients', teamId, prefix, limit)
+
+    def findUsers(self, teamId: str, prefix: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the users whose name or email starts with `prefix`, ignoring case.
+        """
+
+        return self._search('users', teamId, prefix, limit)
+
+    def findReports(self, teamId: str, prefix: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the reports whose name starts with `prefix`, ignoring case.
+        """
+
+        return self._search('reports', teamId, prefix, limit)
+
+    # ==================================================================================================================
+    # Private Members
+    # ==================================================================================================================
+
+    def _lookup(self, kind: str, field: str, teamId: str, value: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            ids = self._hashIndexes[(kind, field)].get((teamId, value))
+            return [self._entities[(kind, teamId, entityId)] for entityId in sorted(ids)
+                    if (kind, teamId, entityId) in self._entities]
+
+    def _search(self, kind: str, teamId: str, prefix: str, limit: Optional[int]) -> List[Dict[str, Any]]:
+        with self._lock:
+            # Terms are stored with their team, so a search never crosses teams
+            ids = self._prefixIndexes[kind].search('%s\0%s' % (teamId, prefix), limit=limit)
+            return [self._entities[(kind, teamId, entityId)] for entityId in ids]
+
+    def _putAll(self, teamId: str, kind: str, page: Dict[str, Any]) -> None:
+        for item in page.get('items') or []:
+            self._put(teamId, kind, item)
+
+    def _put(self, teamId: str, kind: str, entity: Any) -> None:
+        if not isinstance(entity, dict) or not entity.get('id'):
+            return
+        self._remove(teamId, kind, entity['id'])
+        self._entities[(kind, teamId, entity['id'])] = entity
+        self._indexEntity(teamId, kind, entity, add=True)
+
+    def _update(self, teamId: str, kind: str, entityId: str, changes: Dict[str, Any], result: Any) -> None:
+        if isinstance(result, dict) and result.get('id') == entityId:
+            self._put(teamId, kind, result)
+            return
+        current = self._entities.get((kind, teamId, entityId))
+        if current is not None:
+            self._put(teamId, kind, dict(current, **changes))
+
+    def _remove(self, teamId: str, kind: str, entityId: str) -> None:
+        entity = self._entities.pop((kind, teamId, entityId), None)
+        if entity is not None:
+            self._indexEntity(teamId, kind, entity, add=False)
+
+    def _indexEntity(self, teamId: str, kind: str, entity: Dict[str, Any], add: bool) -> None:
+        entityId = entity['id']
+        for field in self.FOREIGN_KEYS.get(kind, ()):
+            if entity.get(field):
+                index = self._hashIndexes[(kind, field)]
+                (index.add if add else index.discard)((teamId, entity[field]), entityId)
+        for field in self.SEARCHABLE_FIELDS.get(kind, ()):
+            if entity.get(field):
+                prefixIndex = self._prefixIndexes[kind]
+                (prefixIndex.add if add else prefixIndex.discard)('%s\0%s' % (teamId, entity[field]), entityId)
+
+    def _setDataSources(self, teamId: str, clientId: str, result: Dict[str, Any]) -> None:
+        connections = {
+            dataSource.get('providerId'): dataSource.get('connectionId')
+            for dataSource in result.get('dataSources') or [] if dataSource.get('connectionId')
+        }
+        self._replaceDataSources(teamId, clientId, connections)
+
+    def _setDataSource(self, teamId: str, clientId: str, provider: str, connectionId: Optional[str]) -> None:
+        connections = dict(self._dataSources.get((teamId, clientId), {}))
+        if connectionId:
+            connections[provider] = connectionId
+        else:
+            connections.pop(provider, None)
+        self._replaceDataSources(teamId, clientId, connections)
+
+    def _replaceDataSources(self, teamId: str, clientId: str, connections: Dict[str, str]) -> None:
+        index = self._hashIndexes[('clients', 'connectionId')]
+        for connectionId in self._dataSources.pop((teamId, clientId), {}).values():
+            index.discard((teamId, connectionId), clientId)
+        if connections:
+            self._dataSources[(teamId, clientId)] = connections
+            for connectionId in connections.values():
+                index.add((teamId, connectionId), clientId)
@@ -0,0 +1,100 @@
+"""
+Merging of concurrent list streams, e.g. of the same list operation over all teams.
+"""
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Hashable, Iterable, Iterator, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+def mergeStreams(
+        streams: Iterable[Tuple[Hashable, Callable[[], Iterable[T]]]],
+        maxConcurrency: int = 8,
+        bufferSize: int = 100,
+        ordered: bool = False
+) -> Iterator[Tuple[Hashable, T]]:
+    """
+    Iterates several streams at once, on background threads, yielding their items as one stream of (key, item).
+
+    Up to `maxConcurrency` streams are open at once, and the next one is opened as soon as one ends, so short streams
+    never wait behind long ones. Streams read ahead of the consumer by at most `bufferSize` items - in all in unordered
+    mode, and per stream in ordered mode - so a slow consumer holds back the streams instead of filling memory.
+
+    An error of a stream is raised when the consumer reaches it. Closing the iterator early stops all streams.
+
+    :param streams: Keys and openers of the streams, consumed lazily as streams are opened.
+    :param maxConcurrency: Maximum number of streams iterated at once.
+    :param bufferSize: Maximum number of items read ahead.
+    :param ordered: Yield all items of a stream before those of the next one, in the order of `streams`, instead of
+                    as soon as they arrive. Streams are still read ahead concurrently.
+    """
+
+    if maxConcurrency < 1 or bufferSize < 1:
+        raise ValueError("maxConcurrency and bufferSize must be at least 1.")
+
+    pending = iter(streams)
+    stopped = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=maxConcurrency, thread_name_prefix='swydo-merge')
+    shared: Optional[queue.Queue] = None if ordered else queue.Queue(bufferSize)
+    # Buffers of the open streams, in the order they were opened
+    opened: Deque[queue.Queue] = deque()
+
+    def put(buffer: queue.Queue, entry: Tuple[Hashable, Any, Optional[BaseException]]) -> bool:
+        # Gives up once the consumer is gone, instead of blocking forever on a full buffer
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def pump(key: Hashable, openStream: Callable[[], Iterable[T]], buffer: queue.Queue) -> None:
+        try:
+            for item in openStream():
+                if not put(buffer, (key, item, None)):
+                    return
+        except BaseException as e:
+            put(buffer, (key, _END, e))
+        else:
+            put(buffer, (key, _END, None))
+
+    def openNext() -> None:
+        for key, openStream in pending:
+            buffer = shared if shared is not None else queue.Queue(bufferSize)
+            opened.append(buffer)
+            executor.submit(pump, key, openStream, buffer)
+            return
+
+    try:
+        for _ in range(maxConcurrency):
+            openNext()
+        while opened:
+            key, item, error = opened[0].get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                # In unordered mode, all buffers are the shared one, and any of them stands for the stream that ended
+                opened.popleft()
+                openNext()
+                continue
+            yield key, item
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False)
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+# Marks the end of a stream in its buffer
+_END = object()
@@ -0,0 +1,179 @@
+"""
+Compact typed models of Swydo entities, generated from the definitions of the OpenAPI spec (swydo_api.yml).
+
+Every model is a `__slots__` class, so an instance holds its fields without a per-instance dict, and enum-like and
+foreign key fields - values shared by many entities, such as `status`, `comparePeriod` or `clientId` - are interned, so
+all instances share a single copy of each value. Converting from the wire format is a single pass over the fields.
+
+Example usage:
+
+    from swydo.models import Report
+    reports = [Report.fromDict(item) for item in swydoClient.getTeamReports(teamId)]
+
+or, for all list methods: SwydoClient(apiKey, typedModels=True).
+
+The models are generated when first used, so importing swydo doesn't parse the spec.
+"""
+
+import os
+import sys
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple, Type
+
+import yaml
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+# List operation of each kind of entity of a team
+TEAM_ENTITIES = dict(
+    users='getTeamUsers',
+    connections='getTeamConnections',
+    brandTemplates='getTeamBrandTemplates',
+    reportTemplates='getTeamReportTemplates',
+    clients='getTeamClients',
+    reports='getTeamReports',
+)
+
+# Fields whose values are shared by many entities, and are interned
+INTERNED_FIELDS = frozenset((
+    'status', 'role', 'comparePeriod', 'providerId', 'sharePermission', 'timezone', 'owner', 'authorId', 'userId',
+    'clientId', 'connectionId', 'brandTemplateId', 'reportTemplateId', 'defaultBrandTemplateId',
+))
+
+
+class Model(object):
+    """
+    Base class of the generated models.
+
+    Fields missing from the wire format are None. Fields that are not in the spec are kept in `extra`, so converting
+    back with `toDict` is lossless.
+    """
+
+    __slots__ = ('extra',)
+
+    # Field names, in spec order, set on each generated class
+    FIELDS: Tuple[str, ...] = ()
+    # Spec type of each field, e.g. 'string' or 'boolean'
+    FIELD_TYPES: Dict[str, str] = {}
+
+    def __init__(self, **fields: Any) -> None:
+        for field in self.FIELDS:
+            value = fields.pop(field, None)
+            if field in INTERNED_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, field, value)
+        self.extra = fields or None
+
+    @classmethod
+    def fromDict(cls, data: Dict[str, Any]) -> 'Model':
+        """
+        Converts an entity from the wire format, as returned by SwydoClient.
+        """
+
+        return cls(**data)
+
+    def toDict(self) -> Dict[str, Any]:
+        """
+        Converts back to the wire format, leaving out fields that are None.
+        """
+
+        data = {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __getitem__(self, field: str) -> Any:
+        # Dict-style access, so code written against the wire format keeps working
+        if field in self.FIELD_TYPES:
+            value = getattr(self, field)
+            if value is not None:
+                return value
+        elif self.extra and field in self.extra:
+            return self.extra[field]
+        raise KeyError(field)
+
+    def get(self, field: str, default: Any = None) -> Any:
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def __eq__(self, other: Any) -> bool:
+        return type(other) is type(self) and self.toDict() == other.toDict()
+
+    def __repr__(self) -> str:
+        return '%s(%s)' % (
+            type(self).__name__, ', '.join('%s=%r' % (key, value) for key, value in self.toDict().items())
+        )
+
+
+def loadDefinitions(specPath: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the object definitions of the OpenAPI spec, by name.
+    """
+
+    if specPath is None:
+        specPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'swydo_api.yml')
+    with open(specPath, encoding='utf-8') as specFile:
+        spec = yaml.safe_load(specFile)
+    return {
+        name: definition for name, definition in spec.get('definitions', {}).items()
+        if definition.get('type') == 'object' and definition.get('properties')
+    }
+
+
+def makeModel(name: str, definition: Dict[str, Any]) -> Type[Model]:
+    """
+    Generates a model class from an object definition of the OpenAPI spec.
+    """
+
+    fieldTypes = {field: schema.get('type', 'object') for field, schema in definition['properties'].items()}
+    return type(name, (Model,), dict(
+        __slots__=tuple(fieldTypes),
+        __doc__="Swydo %s, generated from the OpenAPI spec." % name,
+        __module__=__name__,
+        FIELDS=tuple(fieldTypes),
+        FIELD_TYPES=fieldTypes,
+    ))
+
+
+def __getattr__(name: str) -> Any:
+    # Generates the models on first access to any of them (PEP 562)
+    if name not in _GENERATED_NAMES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    with _generationLock:
+        if name not in globals():
+            _generateModels()
+    return globals()[name]
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+# Module attributes set by _generateModels: all models by name, the models of each entity, and the model of the
+# items of each list operation
+_GENERATED_NAMES = frozenset((
+    'MODELS', 'MODELS_BY_OPERATION', 'Team', 'User', 'Connection', 'BrandTemplate', 'ReportTemplate', 'Client',
+    'DataSource', 'Report',
+))
+_generationLock = threading.Lock()
+
+
+def _generateModels() -> None:
+    models = {name: makeModel(name, definition) for name, definition in loadDefinitions().items()}
+    generated: Dict[str, Any] = {name: models[name] for name in _GENERATED_NAMES if name in models}
+    generated['MODELS_BY_OPERATION'] = dict(
+        getTeams=models['Team'],
+        getTeamUsers=models['User'],
+        getTeamConnections=models['Connection'],
+        getTeamBrandTemplates=models['BrandTemplate'],
+        getTeamReportTemplates=models['ReportTemplate'],
+        getTeamClients=models['Client'],
+        getTeamReports=models['Report'],
+    )
+    generated['MODELS'] = models
+    globals().update(generated)
@@ -0,0 +1,389 @@
+"""
+Pipelined execution of multi-step workflows, such as onboarding clients.
+
+Example usage:
+
+    from swydo.onboarding import ClientOnboarder, OnboardingSpec
+    results = ClientOnboarder(swydoClient).onboard([
+        OnboardingSpec(
+            teamId=TEAM_ID,
+            name='Client',
+            dataSources=dict(adwords=dict(connectionId=CONNECTION_ID, scope=dict(clientId='123-456-7890', name='Ads'))),
+            report=dict(name='Monthly', brandTemplateId=BRAND_TEMPLATE_ID, reportTemplateId=REPORT_TEMPLATE_ID),
+        ),
+        ...
+    ])
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Type
+
+from .client import Enumerations, SwydoClient
+from .reconcile import PROVIDERS
+from .retry import TRANSIENT_ERRORS
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+# Errors that a step may be retried on - failures that are likely to go away
+RETRIABLE_ERRORS: Tuple[Type[Exception], ...] = TRANSIENT_ERRORS
+
+
+class Step(object):
+    """
+    A step of a workflow.
+    """
+
+    __slots__ = ('name', 'run', 'dependsOn', 'maxAttempts')
+
+    def __init__(
+            self,
+            name: str,
+            run: Callable[[Dict[str, Any]], Any],
+            dependsOn: Iterable[str] = (),
+            maxAttempts: int = 1
+    ) -> None:
+        """
+        :param name: Name of the step, unique within its workflow.
+        :param run: Runs the step, given the results of the steps of the workflow that completed so far, by name.
+        :param dependsOn: Names of the steps that must complete successfully before this one runs.
+        :param maxAttempts: Number of attempts on RETRIABLE_ERRORS. Keep steps that are not idempotent at 1.
+        """
+        if maxAttempts < 1:
+            raise ValueError("maxAttempts must be at least 1.")
+
+        self.name = name
+        self.run = run
+        self.dependsOn = tuple(dependsOn)
+        self.maxAttempts = maxAttempts
+
+    def __repr__(self) -> str:
+        return 'Step(%r, dependsOn=%r)' % (self.name, self.dependsOn)
+
+
+class WorkflowResult(object):
+    """
+    Outcome of a workflow: the result or error of each step, and the steps skipped because a dependency failed.
+    """
+
+    __slots__ = ('key', 'results', 'errors', 'skipped', 'attempts')
+
+    def __init__(self, key: Any) -> None:
+        self.key = key
+        self.results: Dict[str, Any] = dict()
+        self.errors: Dict[str, Exception] = dict()
+        self.skipped: List[str] = []
+        # Number of attempts of each step that ran
+        self.attempts: Dict[str, int] = dict()
+
+    @property
+    def ok(self) -> bool:
+        """Whether all steps completed successfully."""
+        return not self.errors and not self.skipped
+
+    def __repr__(self) -> str:
+        return 'WorkflowResult(key=%r, completed=%d, failed=%r, skipped=%r)' % (
+            self.key, len(self.results), sorted(self.errors), self.skipped
+        )
+
+
+class WorkflowExecutor(object):
+    """
+    Runs many workflows, each a small DAG of steps, on a shared pool of threads.
+
+    Steps of a workflow whose dependencies completed run concurrently, and workflows are pipelined: while a step waits
+    on the API, other steps - of the same workflow or the next ones - run. Ready steps of earlier workflows run before
+    those of later ones, so workflows complete in order, rather than all progressing in lockstep.
+
+    A failed step doesn't stop other workflows, or the steps of its workflow that don't depend on it.
+    """
+
+    def __init__(
+            self,
+            maxConcurrency: int = 8,
+            retryDelay: float = 0.5,
+            sleep: Callable[[float], None] = time.sleep
+    ) -> None:
+        """
+        :param maxConcurrency: Maximum number of steps running at once. Calls are still paced by the rate limit of the
+                               client, so this only needs to be large enough to keep its budget busy.
+        :param retryDelay: Seconds to wait before the first retry of a step, doubled on every further retry.
+        :param sleep: Waits for a number of seconds.
+        """
+        if maxConcurrency < 1:
+            raise ValueError("maxConcurrency must be at least 1.")
+
+        self._maxConcurrency = maxConcurrency
+        self._retryDelay = retryDelay
+        self._sleep = sleep
+
+    def run(self, workflows: Sequence[Sequence[Step]], keys: Optional[Sequence[Any]] = None) -> List[WorkflowResult]:
+        """
+        Runs workflows to completion.
+
+        :param workflows: Steps of each workflow.
+        :param keys: Key of each workflow, set on its result. Defaults to the index of the workflow.
+        :return: Result of each workflow, in the same order.
+        """
+
+        orders = [self._order(steps) for steps in workflows]
+        results = [WorkflowResult(key) for key in (keys if keys is not None else range(len(workflows)))]
+        if len(results) != len(workflows):
+            raise ValueError("There must be a key for each workflow.")
+
+        run = _Run(orders, results)
+        workers = [
+            threading.Thread(target=self._work, args=(run,), name='swydo-workflow-%d' % index, daemon=True)
+            for index in range(min(self._maxConcurrency, max(1, run.remaining)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    # ==================================================================================================================
+    # Private Members
+    # ==================================================================================================================
+
+    @staticmethod
+    def _order(steps: Sequence[Step]) -> List[Step]:
+        # Orders steps so that every step comes after its dependencies, validating the DAG
+        byName = {step.name: step for step in steps}
+        if len(byName) != len(steps):
+            raise ValueError("Step names of a workflow must be unique.")
+        for step in steps:
+            unknown = set(step.dependsOn) - set(byName)
+            if unknown:
+                raise ValueError("Step %s depends on unknown steps: %s." % (step.name, ', '.join(sorted(unknown))))
+
+        ordered: List[Step] = []
+        done: Set[str] = set()
+        while len(ordered) < len(steps):
+            ready = [step for step in steps if step.name not in done and done.issuperset(step.dependsOn)]
+            if not ready:
+                raise ValueError("Steps of a workflow must not depend on each other in a cycle.")
+            ordered.extend(ready)
+            done.update(step.name for step in ready)
+        return ordered
+
+    def _work(self, run: '_Run') -> None:
+        while True:
+            with run.condition:
+                while not run.ready and run.remaining:
+                    run.condition.wait()
+                if not run.remaining:
+                    return
+                workflowIndex, _, step = heapq.heappop(run.ready)
+                result = run.results[workflowIndex]
+                completed = dict(result.results)
+
+            value, error, attempts = self._runStep(step, completed)
+
+            with run.condition:
+                result.attempts[step.name] = attempts
+                if error is None:
+                    result.results[step.name] = value
+                else:
+                    logging.warning('Step %s of workflow %r failed: %s', step.name, result.key, error)
+                    result.errors[step.name] = error
+                run.complete(workflowIndex, step)
+
+    def _runStep(self, step: Step, completed: Dict[str, Any]) -> Tuple[Any, Optional[Exception], int]:
+        for attempt in itertools.count(1):
+            try:
+                return step.run(completed), None, attempt
+            except RETRIABLE_ERRORS as e:
+                if attempt >= step.maxAttempts:
+                    return None, e, attempt
+                self._sleep(self._retryDelay * 2 ** (attempt - 1))
+            except Exception as e:
+                return None, e, attempt
+        raise AssertionError('unreachable')  # pragma: no cover
+
+
+class OnboardingSpec(object):
+    """
+    A client to onboard: the client, its data sources, and optionally a report of it, shared or not.
+    """
+
+    __slots__ = ('teamId', 'name', 'description', 'email', 'dataSources', 'report', 'share')
+
+    def __init__(
+            self,
+            teamId: str,
+            name: str,
+            description: Optional[str] = None,
+            email: Optional[str] = None,
+            dataSources: Optional[Dict[str, Dict[str, Any]]] = None,
+            report: Optional[Dict[str, Any]] = None,
+            share: bool = True
+    ) -> None:
+        """
+        :param teamId: Team to create the client in.
+        :param name: Name of the client.
+        :param description: Description of the client.
+        :param email: Email of the client.
+        :param dataSources: Data sources of the client, by provider (see swydo.reconcile.PROVIDERS), each a dict with
+                            `connectionId` and `scope`.
+        :param report: Report to create for the client: a dict of the arguments of SwydoClient.createTeamReport, except
+                       teamId and clientId. comparePeriod defaults to `previous`.
+        :param share: Share the report.
+        """
+        unknown = set(dataSources or {}) - set(PROVIDERS)
+        if unknown:
+            raise ValueError("Unknown data source providers: %s." % ', '.join(sorted(unknown)))
+
+        self.teamId = teamId
+        self.name = name
+        self.description = description
+        self.email = email
+        self.dataSources = dataSources or {}
+        self.report = report
+        self.share = share
+
+    def __repr__(self) -> str:
+        return 'OnboardingSpec(teamId=%r, name=%r)' % (self.teamId, self.name)
+
+
+class ClientOnboarder(object):
+    """
+    Onboards many clients, each as a workflow of steps:
+
+        client -> dataSource:<provider> (for each data source, concurrently)
+               -> report -> share
+
+    The data sources and the report only need the client, so they run concurrently. Steps that are idempotent - setting
+    data sources and sharing - are retried on server and connection errors. Creating the client or the report is not,
+    as a failed attempt may still have created it.
+    """
+
+    def __init__(self, swydoClient: SwydoClient, maxConcurrency: int = 8, maxAttempts: int = 3,
+                 retryDelay: float = 0.5) -> None:
+        """
+        :param swydoClient: Client to onboard with.
+        :param maxConcurrency: Maximum number of steps running at once.
+        :param maxAttempts: Number of attempts of idempotent steps.
+        :param retryDelay: Seconds to wait before the first retry of a step.
+        """
+        self._swydoClient = swydoClient
+        self._maxAttempts = maxAttempts
+        self._executor = WorkflowExecutor(maxConcurrency=maxConcurrency, retryDelay=retryDelay)
+
+    def onboard(self, specs: Sequence[OnboardingSpec]) -> List[WorkflowResult]:
+        """
+        Onboards clients.
+
+        :return: Result of each client, in the same order, keyed by its spec. Its `results` hold the created client
+                 under `client`, and the created report under `report`.
+        """
+
+        return self._executor.run([self.makeSteps(spec) for spec in specs], keys=specs)
+
+    def makeSteps(self, spec: OnboardingSpec) -> List[Step]:
+        """
+        Returns the steps of onboarding a client.
+        """
+
+        swydoClient = self._swydoClient
+        steps = [Step('client', lambda results: swydoClient.createTeamClient(
+            teamId=spec.teamId, name=spec.name, description=spec.description, email=spec.email))]
+
+        for provider, dataSource in spec.dataSources.items():
+            steps.append(Step(
+                'dataSource:%s' % provider,
+                lambda results, provider=provider, dataSource=dataSource: self._setDataSource(
+                    spec.teamId, results['client']['id'], provider, dataSource),
+                dependsOn=('client',),
+                maxAttempts=self._maxAttempts,
+            ))
+
+        if spec.report is not None:
+            report = dict(spec.report)
+            report.setdefault('comparePeriod', Enumerations.ComparePeriod.previous)
+            steps.append(Step('report', lambda results: swydoClient.createTeamReport(
+                teamId=spec.teamId, clientId=results['client']['id'], **report), dependsOn=('client',)))
+            if spec.share:
+                steps.append(Step('share', lambda results: swydoClient.shareTeamReport(
+                    teamId=spec.teamId, reportId=results['report']['id']), dependsOn=('report',),
+                    maxAttempts=self._maxAttempts))
+        return steps
+
+    def _setDataSource(self, teamId: str, clientId: str, provider: str, dataSource: Dict[str, Any]) -> Any:
+        suffix, arguments = PROVIDERS[provider]
+        return getattr(self._swydoClient, 'setClientDataSource' + suffix)(
+            teamId=teamId,
+            clientId=clientId,
+            connectionId=dataSource['connectionId'],
+            **{arguments[field]: value for field, value in (dataSource.get('scope') or {}).items()}
+        )
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+class _Run(object):
+    """
+    Scheduling state of a WorkflowExecutor.run call.
+    """
+
+    def __init__(self, orders: List[List[Step]], results: List[WorkflowResult]) -> None:
+        self.condition = threading.Condition()
+        self.results = results
+        self.remaining = sum(len(order) for order in orders)
+        # Ready steps, by (workflow index, position in their workflow) - steps of earlier workflows first
+        self.ready: List[Tuple[int, int, Step]] = []
+        self._positions = [{step.name: position for position, step in enumerate(order)} for order in orders]
+        self._dependents: List[Dict[str, List[Step]]] = []
+        self._waitingOn: List[Dict[str, int]] = []
+
+        for workflowIndex, order in enumerate(orders):
+            dependents: Dict[str, List[Step]] = {step.name: [] for step in order}
+            for step in order:
+                for dependency in step.dependsOn:
+                    dependents[dependency].append(step)
+            self._dependents.append(dependents)
+            self._waitingOn.append({step.name: len(step.dependsOn) for step in order})
+            for step in order:
+                if not step.dependsOn:
+                    self._push(workflowIndex, step)
+
+    def complete(self, workflowIndex: int, step: Step) -> None:
+        """
+        Records the completion of a step, scheduling or skipping its dependents. Must be called under the condition.
+        """
+
+        self.remaining -= 1
+        result = self.results[workflowIndex]
+        failed = step.name in result.errors
+        for dependent in self._dependents[workflowIndex][step.name]:
+            if dependent.name in result.skipped:
+                continue
+            if failed:
+                self._skip(workflowIndex, dependent)
+                continue
+            waitingOn = self._waitingOn[workflowIndex]
+            waitingOn[dependent.name] -= 1
+            if waitingOn[dependent.name] == 0:
+                self._push(workflowIndex, dependent)
+        self.condition.notify_all()
+
+    def _push(self, workflowIndex: int, step: Step) -> None:
+        position = self._positions[workflowIndex][step.name]
+        heapq.heappush(self.ready, (workflowIndex, position, step))
+
+    def _skip(self, workflowIndex: int, step: Step) -> None:
+        skipped = self.results[workflowIndex].skipped
+        if step.name in skipped:
+            return
+        skipped.append(step.name)
+        self.remaining -= 1
+        for dependent in self._dependents[workflowIndex][step.name]:
+            self._skip(workflowIndex, dependent)
@@ -0,0 +1,477 @@
+"""
+Pagination over Swydo API list operations.
+"""
+
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+class PaginationCursor(object):
+    """
+    Serializable position of an iteration over a list operation.
+
+    A cursor can be persisted (see `toJson`) and passed to `SwydoClient.resumeItems` to continue the iteration right
+    after the last item that was consumed, e.g. after a crash or a deploy.
+    """
+
+    def __init__(
+            self,
+            operationId: str,
+            params: Dict[str, Any],
+            skip: int = 0,
+            seen: int = 0,
+            total: Optional[int] = None,
+            overlap: int = 0,
+            anchorIds: Optional[List[str]] = None
+    ) -> None:
+        """
+        :param operationId: Swydo API list operation, e.g. 'getTeamReports'.
+        :param params: Operation parameters, excluding paging parameters.
+        :param skip: Offset of the next item to fetch.
+        :param seen: Number of items consumed so far, over all runs.
+        :param total: Total number of items last reported by the server, if known.
+        :param overlap: Page overlap of stable pagination, 0 for plain offset pagination.
+        :param anchorIds: In stable pagination, ids of the last `overlap` items consumed.
+        """
+        self.operationId = operationId
+        self.params = params
+        self.skip = skip
+        self.seen = seen
+        self.total = total
+        self.overlap = overlap
+        self.anchorIds = anchorIds or []
+
+    def __repr__(self) -> str:
+        return 'PaginationCursor(%s)' % self.toJson()
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, PaginationCursor) and self.toDict() == other.toDict()
+
+    def copy(self) -> 'PaginationCursor':
+        return PaginationCursor(**self.toDict())
+
+    def toDict(self) -> Dict[str, Any]:
+        return dict(
+            operationId=self.operationId,
+            params=dict(self.params),
+            skip=self.skip,
+            seen=self.seen,
+            total=self.total,
+            overlap=self.overlap,
+            anchorIds=list(self.anchorIds),
+        )
+
+    @classmethod
+    def fromDict(cls, data: Dict[str, Any]) -> 'PaginationCursor':
+        return cls(**data)
+
+    def toJson(self) -> str:
+        return json.dumps(self.toDict(), sort_keys=True)
+
+    @classmethod
+    def fromJson(cls, data: str) -> 'PaginationCursor':
+        return cls.fromDict(json.loads(data))
+
+
+class PageSizeTuner(object):
+    """
+    Picks the page size of list operations from the latency and size of the pages fetched so far, separately for each
+    operation.
+
+    Starting from the server default, the page size grows - at most doubling per page - while full pages come back
+    faster than `targetLatency` and smaller than `maxPageBytes`, up to the spec's maximum of 100, so long listings take
+    fewer round trips. It shrinks in proportion when pages come back slower or larger than that.
+
+    An instance may be shared by several clients and threads.
+    """
+
+    def __init__(
+            self,
+            initialSize: int = 50,
+            minSize: int = 10,
+            maxSize: int = 100,
+            targetLatency: float = 1.0,
+            maxPageBytes: int = 512 * 1024
+    ) -> None:
+        """
+        :param initialSize: Page size of operations with no pages fetched yet.
+        :param minSize: Smallest page size.
+        :param maxSize: Largest page size, up to 100.
+        :param targetLatency: Seconds a page should take to fetch, at most.
+        :param maxPageBytes: Size a page should have, at most.
+        """
+        if not 1 <= minSize <= initialSize <= maxSize <= 100:
+            raise ValueError("Page sizes must satisfy 1 <= minSize <= initialSize <= maxSize <= 100.")
+        if targetLatency <= 0 or maxPageBytes <= 0:
+            raise ValueError("targetLatency and maxPageBytes must be positive.")
+
+        self._initialSize = initialSize
+        self._minSize = minSize
+        self._maxSize = maxSize
+        self._targetLatency = targetLatency
+        self._maxPageBytes = maxPageBytes
+        self._lock = threading.Lock()
+        self._sizes: Dict[str, int] = dict()
+
+    def getPageSize(self, operationId: str) -> int:
+        """
+        Returns the page size to request next from an operation.
+        """
+
+        with self._lock:
+            return self._sizes.get(operationId, self._initialSize)
+
+    def estimatePages(self, operationId: str, total: int) -> int:
+        """
+        Returns the number of pages listing `total` items of an operation takes, from its current page size, if pages
+        keep coming back fast and small enough for the page size to double up to the maximum. An empty listing still
+        takes a page.
+        """
+
+        pageSize = self.getPageSize(operationId)
+        pages = 1
+        while total > pageSize:
+            total -= pageSize
+            pageSize = min(self._maxSize, pageSize * 2)
+            pages += 1
+        return pages
+
+    def observe(self, operationId: str, pageSize: int, items: int, seconds: float, size: int) -> None:
+        """
+        Adapts the page size of an operation to a page fetched from it.
+
+        :param pageSize: Page size requested.
+        :param items: Number of items returned.
+        :param seconds: Time the page took to fetch, excluding waits for the rate limiter.
+        :param size: Size of the response, in bytes.
+        """
+
+        scale = min(self._targetLatency / max(seconds, 0.001), self._maxPageBytes / max(size, 1))
+        if scale >= 1 and items < pageSize:
+            # A short page, e.g. the last one, tells nothing about larger pages
+            return
+        newSize = min(self._maxSize, max(self._minSize, int(max(items, 1) * min(scale, 2))))
+        with self._lock:
+            self._sizes[operationId] = newSize
+
+
+class PageIterator(Iterator[Dict[str, Any]]):
+    """
+    Iterator over all items of a list operation, fetching one page at a time.
+
+    Pages start where the `nextUrl` of the previous page points to, when the server provides it, and the listing ends
+    at the first page without one - or, with servers that never provide it, once `total` items were listed. Only the
+    offset of `nextUrl` is used: pages are still fetched through `fetchPage`. A page with no items always ends the
+    listing, even if the reported total is larger.
+
+    The `cursor` property is the position right after the last item returned by the iterator. `beforeFetch`, if set,
+    is called right before every page is fetched, e.g. to take a share of a call budget.
+    """
+
+    def __init__(
+            self,
+            fetchPage: Callable[[Dict[str, Any]], Dict[str, Any]],
+            cursor: PaginationCursor,
+            transform: Optional[Callable[[Dict[str, Any]], Any]] = None,
+            beforeFetch: Optional[Callable[[], Any]] = None
+    ) -> None:
+        """
+        :param fetchPage: Fetches a single page, given the operation parameters including 'skip'.
+        :param cursor: Position to start from.
+        :param transform: Applied to every item before it is returned, e.g. to wrap it.
+        :param beforeFetch: Called right before every page is fetched.
+        """
+        self._fetchPage = fetchPage
+        self._transform = transform
+        self.beforeFetch = beforeFetch
+        self._cursor = cursor.copy()
+        self._lock = threading.Lock()
+        # Items of the current page that are yet to be returned, with their offsets
+        self._page: List[Tuple[int, Dict[str, Any]]] = []
+        self._pageIndex = 0
+        self._pageEnd = 0
+        self._pages = 0
+        self._firstRun = True
+        # Whether the server provides nextUrl, and whether a page without one, or with no items, was fetched
+        self._followsNextUrl = False
+        self._lastPage = False
+
+    @property
+    def cursor(self) -> PaginationCursor:
+        """A snapshot of the current position."""
+        with self._lock:
+            return self._cursor.copy()
+
+    @property
+    def pages(self) -> int:
+        """Number of pages fetched so far."""
+        return self._pages
+
+    def __iter__(self) -> 'PageIterator':
+        return self
+
+    def __next__(self) -> Any:
+        while self._pageIndex >= len(self._page):
+            if not self._fetchNextPage():
+                raise StopIteration
+
+        offset, item = self._page[self._pageIndex]
+        self._pageIndex += 1
+        with self._lock:
+            self._advance(offset, item)
+            if self._pageIndex >= len(self._page):
+                # Past the last item of the page, including any items that were filtered out of it
+                self._cursor.skip = max(self._cursor.skip, self._pageEnd)
+        return self._transform(item) if self._transform else item
+
+    def _fetchNextPage(self) -> bool:
+        """
+        Fetches the next page into self._page.
+
+        :return: False if there are no more pages.
+        """
+
+        if not self._firstRun and (self._lastPage or (self._cursor.total or 0) <= self._cursor.skip):
+            return False
+        self._firstRun = False
+
+        pageStart = self._cursor.skip
+        result = self._fetch(pageStart)
+        items = result.get('items') or []
+        nextUrl = result.get('nextUrl')
+        nextSkip = _getNextSkip(nextUrl)
+        self._followsNextUrl = self._followsNextUrl or bool(nextUrl)
+        self._lastPage = not items or (self._followsNextUrl and not nextUrl)
+        pageEnd = nextSkip if nextSkip is not None and nextSkip > pageStart else pageStart + len(items)
+        self._setPage([(pageStart + index, item) for index, item in enumerate(items)], pageEnd)
+        with self._lock:
+            self._cursor.total = result.get('total', 0)
+        return True
+
+    def _fetch(self, skip: int, **extraParams: Any) -> Dict[str, Any]:
+        if self.beforeFetch is not None:
+            self.beforeFetch()
+        # Never mutate the cursor's params - they may be shared with other threads
+        self._pages += 1
+        return self._fetchPage(dict(self._cursor.params, skip=skip, **extraParams))
+
+    def _setPage(self, page: List[Tuple[int, Dict[str, Any]]], pageEnd: int) -> None:
+        self._page = page
+        self._pageIndex = 0
+        self._pageEnd = pageEnd
+
+    def _advance(self, offset: int, item: Dict[str, Any]) -> None:
+        self._cursor.skip = offset + 1
+        self._cursor.seen += 1
+
+
+class StablePageIterator(PageIterator):
+    """
+    Iterator over all items of a list operation, that stays complete while items are created or deleted during the
+    iteration.
+
+    Consecutive pages overlap by `cursor.overlap` items, and items are deduplicated by id, so items shifting by up to
+    `overlap` positions between two pages are neither skipped nor returned twice. Larger shifts, and any change of the
+    reported total, mark the range listed so far as affected. Once the end is reached, the first changed page in that
+    range is found by binary search (probing the first item of pages), and only the range from there on is re-scanned.
+
+    This assumes the server lists items in a stable order, in which creations and deletions shift later items. The
+    overlap must be smaller than the page size - if pages turn out too short, the overlap is reduced to keep moving.
+
+    Only the ids of the items of the last two pages are kept for deduplication, so memory doesn't grow with the listing.
+    Once a change is noticed, the ids from two pages before on are kept until the end, for the re-scan, which reaches
+    back at most to the page before: changes further back are only covered as far as they shift items into that range.
+
+    When resuming from a cursor, only the ids of the last `overlap` items consumed (`cursor.anchorIds`) are restored:
+    items created or deleted before the cursor was taken can still shift already consumed items into the remaining
+    range, and a re-scan after resuming only covers pages listed since. Such items may be returned again.
+    """
+
+    def __init__(
+            self,
+            fetchPage: Callable[[Dict[str, Any]], Dict[str, Any]],
+            cursor: PaginationCursor,
+            transform: Optional[Callable[[Dict[str, Any]], Any]] = None,
+            maxRescans: int = 3,
+            beforeFetch: Optional[Callable[[], Any]] = None
+    ) -> None:
+        """
+        :param fetchPage: Fetches a single page, given the operation parameters including 'skip' and maybe 'limit'.
+        :param cursor: Position to start from, with a positive `overlap`.
+        :param transform: Applied to every item before it is returned, e.g. to wrap it.
+        :param maxRescans: Maximum number of re-scans of affected ranges.
+        :param beforeFetch: Called right before every page is fetched.
+        """
+        if cursor.overlap < 1:
+            raise ValueError("Stable pagination requires a positive overlap.")
+
+        super().__init__(fetchPage=fetchPage, cursor=cursor, transform=transform, beforeFetch=beforeFetch)
+        self._overlap = cursor.overlap
+        self._maxRescans = maxRescans
+        self._rescans = 0
+        self._seenIds: Set[str] = set(cursor.anchorIds)
+        # Start and ids of the items returned of each page whose ids are kept, in the order they were listed - only
+        # the last two pages, or, from `_pinnedFrom` on, all pages listed since the page before a change was noticed
+        self._seenPages: Deque[Tuple[int, List[str]]] = deque([(max(0, cursor.skip - cursor.overlap), [])])
+        self._seenPages[0][1].extend(cursor.anchorIds)
+        self._pageSequence = 0
+        self._pinnedFrom: Optional[int] = None
+        self._anchorIds: Deque[str] = deque(cursor.anchorIds, maxlen=cursor.overlap)
+        # Id of the first item of each page, the last time that page was listed
+        self._idAt: Dict[int, str] = dict()
+        # Offsets below `_affectedBelow` may have changed since they were listed. Pages below `_affectedFrom`, the first
+        # place a change was noticed, were all listed before any of the changes.
+        self._affectedFrom: Optional[int] = None
+        self._affectedBelow = 0
+        self._affectedShift = 0
+        self._rescanEnd: Optional[int] = None
+
+    @property
+    def rescans(self) -> int:
+        """Number of re-scans performed so far."""
+        return self._rescans
+
+    def _fetchNextPage(self) -> bool:
+        cursor = self._cursor
+
+        if not self._firstRun and self._passFinished():
+            if not self._startRescan():
+                return False
+        self._firstRun = False
+
+        pageStart = max(0, cursor.skip - self._overlap)
+        result = self._fetch(pageStart)
+        items = result.get('items', [])
+        total = result.get('total', 0)
+
+        # The overlapping head of the page should contain items we've already seen, unless the items shifted by more
+        # than the overlap
+        overlapping = items[:cursor.skip - pageStart]
+        lostAnchor = overlapping and self._seenIds and not any(item.get('id') in self._seenIds for item in overlapping)
+        if (cursor.total is not None and total != cursor.total) or lostAnchor or not items:
+            self._markAffected(pageStart, abs(total - (cursor.total or 0)) + len(overlapping))
+
+        if items:
+            self._idAt[pageStart] = items[0].get('id')
+
+        page = [(pageStart + index, item) for index, item in enumerate(items) if item.get('id') not in self._seenIds]
+        self._setPage(page, pageStart + len(items))
+        self._keepPage(pageStart)
+
+        if items and pageStart + len(items) <= cursor.skip < total:
+            # Pages are no longer than the overlap - shrink it, so the next page reaches past the items already seen
+            self._overlap = len(items) // 2
+            logging.warning("Swydo pages of %d items are too short for an overlap of %d, reducing it to %d.",
+                            len(items), cursor.overlap, self._overlap)
+
+        with self._lock:
+            cursor.total = total
+            if not page or not items:
+                # Nothing new on this page - move past it, or to the end of the listing if the page came back empty
+                cursor.skip = pageStart + len(items) if items else max(cursor.skip, total)
+        return True
+
+    def _advance(self, offset: int, item: Dict[str, Any]) -> None:
+        super()._advance(offset, item)
+        itemId = item.get('id')
+        if itemId is not None:
+            self._seenIds.add(itemId)
+            self._seenPages[-1][1].append(itemId)
+            self._anchorIds.append(itemId)
+            self._cursor.anchorIds = list(self._anchorIds)
+
+    def _passFinished(self) -> bool:
+        cursor = self._cursor
+        if self._rescanEnd is not None and cursor.skip >= self._rescanEnd:
+            return True
+        return (cursor.total or 0) <= cursor.skip
+
+    def _keepPage(self, pageStart: int) -> None:
+        """
+        Starts keeping the ids of a page just listed, and drops those of pages a re-scan won't revisit.
+        """
+
+        self._pageSequence += 1
+        self._seenPages.append((pageStart, []))
+        while len(self._seenPages) > 2 and \
+                (self._pinnedFrom is None or self._pageSequence - len(self._seenPages) + 1 < self._pinnedFrom):
+            self._seenIds.difference_update(self._seenPages.popleft()[1])
+        # A re-scan may start from any page kept but the first, whose ids only cover the overlap of the next one
+        restartable = {start for start, _ in list(self._seenPages)[1:]}
+        for offset in [offset for offset in self._idAt if offset not in restartable]:
+            del self._idAt[offset]
+
+    def _markAffected(self, below: int, shift: int) -> None:
+        if self._pinnedFrom is None:
+            # Keep the ids from two pages before the one being listed on, so a re-scan may start from the page before
+            self._pinnedFrom = self._pageSequence - 1
+        self._affectedFrom = below if self._affectedFrom is None else min(self._affectedFrom, below)
+        self._affectedBelow = max(self._affectedBelow, below)
+        self._affectedShift += shift
+
+    def _startRescan(self) -> bool:
+        self._rescanEnd = None
+        if not self._affectedBelow or self._rescans >= self._maxRescans:
+            return False
+
+        self._rescans += 1
+        firstChange = self._findFirstChange(self._affectedFrom or 0)
+        rescanEnd = self._affectedBelow + self._affectedShift + self._overlap
+        self._affectedFrom = None
+        self._affectedBelow = 0
+        self._affectedShift = 0
+
+        with self._lock:
+            self._cursor.skip = firstChange
+        self._rescanEnd = rescanEnd
+        return True
+
+    def _findFirstChange(self, end: int) -> int:
+        """
+        Binary search for the start of the last page below `end` that still starts with the same item as before - the
+        first change lies after it.
+
+        Only pages listed before any change was noticed, and whose ids are kept, are probed, since later pages were
+        listed with some of the changes already applied. If none of them changed, the change may still lie within the
+        last of them.
+        """
+
+        offsets = sorted(offset for offset in self._idAt if offset < end)
+        if not offsets:
+            return end
+        low, high = 0, len(offsets)
+        while low < high:
+            middle = (low + high) // 2
+            offset = offsets[middle]
+            probe = self._fetch(offset, limit=1).get('items', [])
+            if probe and probe[0].get('id') == self._idAt[offset]:
+                low = middle + 1
+            else:
+                high = middle
+        # The first page kept changed too: the change lies before it, out of reach
+        return offsets[max(low - 1, 0)]
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+def _getNextSkip(nextUrl: Optional[str]) -> Optional[int]:
+    """
+    Returns the offset a `nextUrl` points to, or None if there is none.
+    """
+
+    if not nextUrl:
+        return None
+    try:
+        return int(parse_qs(urlsplit(nextUrl).query)['skip'][0])
+    except (KeyError, ValueError):
+        return None
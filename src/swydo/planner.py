@@ -0,0 +1,264 @@
+"""
+Planning of the API call budget of jobs, before running them.
+
+Example usage:
+
+    from swydo.planner import CallBudgetPlanner
+    planner = CallBudgetPlanner(swydoClient)
+    estimate = planner.enumerateTeam(TEAM_ID, dataSources=True)
+    print(estimate.calls, estimate.seconds, estimate.forTarget(600))
+"""
+
+import math
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from .client import SwydoClient
+from .models import TEAM_ENTITIES
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+# Page size of list operations when neither the client nor its page size tuner sets one, i.e. with stable pagination
+DEFAULT_PAGE_SIZE = 50
+
+
+class JobEstimate(object):
+    """
+    The number of API calls of a job, and how long they take at a given rate budget.
+    """
+
+    __slots__ = ('name', 'breakdown', 'rate', 'latency', 'probeCalls')
+
+    def __init__(self, name: str, breakdown: Dict[str, int], rate: float, latency: float, probeCalls: int = 0) -> None:
+        """
+        :param name: Description of the job.
+        :param breakdown: Number of calls of each operation.
+        :param rate: Calls per second available to the job.
+        :param latency: Expected seconds per call.
+        :param probeCalls: Number of calls made to estimate the job, not included in its calls.
+        """
+        self.name = name
+        self.breakdown = breakdown
+        self.rate = rate
+        self.latency = latency
+        self.probeCalls = probeCalls
+
+    @property
+    def calls(self) -> int:
+        """Total number of calls of the job."""
+        return sum(self.breakdown.values())
+
+    @property
+    def seconds(self) -> float:
+        """Wall time of the job at the full rate, with enough concurrency to sustain it."""
+        return self.calls / self.rate
+
+    @property
+    def concurrency(self) -> int:
+        """Number of calls in flight needed to sustain the full rate (Little's law)."""
+        return max(1, math.ceil(self.rate * self.latency))
+
+    def secondsAt(self, concurrency: int) -> float:
+        """
+        Returns the wall time of the job with at most `concurrency` calls in flight.
+        """
+
+        return max(self.calls / self.rate, self.calls * self.latency / max(concurrency, 1))
+
+    def forTarget(self, targetSeconds: float) -> Dict[str, Any]:
+        """
+        Returns the rate and concurrency the job needs to complete within `targetSeconds`, and whether the rate budget
+        allows it.
+        """
+
+        rate = self.calls / targetSeconds if targetSeconds > 0 else math.inf
+        return dict(
+            rate=rate,
+            concurrency=max(1, math.ceil(min(rate, self.rate) * self.latency)),
+            feasible=rate <= self.rate,
+        )
+
+    def toDict(self) -> Dict[str, Any]:
+        return dict(
+            name=self.name,
+            calls=self.calls,
+            breakdown=dict(self.breakdown),
+            seconds=self.seconds,
+            concurrency=self.concurrency,
+            rate=self.rate,
+            latency=self.latency,
+            probeCalls=self.probeCalls,
+        )
+
+    def __add__(self, other: 'JobEstimate') -> 'JobEstimate':
+        breakdown = dict(self.breakdown)
+        for operationId, calls in other.breakdown.items():
+            breakdown[operationId] = breakdown.get(operationId, 0) + calls
+        return JobEstimate(
+            name='%s + %s' % (self.name, other.name),
+            breakdown=breakdown,
+            rate=min(self.rate, other.rate),
+            latency=max(self.latency, other.latency),
+            probeCalls=self.probeCalls + other.probeCalls,
+        )
+
+    def __repr__(self) -> str:
+        return 'JobEstimate(%r, calls=%d, seconds=%.1f, concurrency=%d)' % (
+            self.name, self.calls, self.seconds, self.concurrency
+        )
+
+
+class CallBudgetPlanner(object):
+    """
+    Estimates the API calls and wall time of jobs at the rate budget of a client.
+
+    Estimates of jobs over existing entities take the number of entities from the `total` of probe calls of a single
+    item each, so a plan costs one call per listed entity kind. Writes that depend on the current state of entities
+    (e.g. data source syncs) are estimated from the share of them expected to change.
+    """
+
+    def __init__(
+            self,
+            swydoClient: SwydoClient,
+            rate: Optional[float] = None,
+            latency: Optional[float] = None,
+            pageSize: Optional[int] = None
+    ) -> None:
+        """
+        :param swydoClient: Client that will run the jobs, and to probe with.
+        :param rate: Calls per second available to jobs. Defaults to the current rate limit of the client.
+        :param latency: Expected seconds per call. Defaults to the latency of the probe calls, or 0.2 before any.
+        :param pageSize: Page size of list operations. Defaults to the client's, or the growth of the page size picked
+                         by its page size tuner, or the server default with stable pagination.
+        """
+        self._swydoClient = swydoClient
+        self._rate = rate
+        self._latency = latency
+        self._pageSize = pageSize or swydoClient.pageSize
+        self._probeLatencies: List[float] = []
+
+    @property
+    def rate(self) -> float:
+        return self._rate if self._rate is not None else self._swydoClient.getCallStats()['rate']
+
+    @property
+    def latency(self) -> float:
+        if self._latency is not None:
+            return self._latency
+        if self._probeLatencies:
+            return sum(self._probeLatencies) / len(self._probeLatencies)
+        return 0.2
+
+    def count(self, operationId: str, **params: Any) -> int:
+        """
+        Returns the number of items of a list operation, with a single probe call.
+        """
+
+        started = time.monotonic()
+        total = self._swydoClient.countItems(operationId, **params)
+        self._probeLatencies.append(time.monotonic() - started)
+        return total
+
+    def enumerateTeam(
+            self,
+            teamId: str,
+            entities: Iterable[str] = TEAM_ENTITIES,
+            dataSources: bool = False
+    ) -> JobEstimate:
+        """
+        Estimates listing entities of a team, e.g. for a snapshot or an export.
+
+        :param entities: Keys of swydo.models.TEAM_ENTITIES to list.
+        :param dataSources: Also get the data sources of every client.
+        """
+
+        breakdown: Dict[str, int] = dict()
+        probes = 0
+        clients: Optional[int] = None
+        for entity in entities:
+            operationId = TEAM_ENTITIES[entity]
+            total = self.count(operationId, teamId=teamId)
+            probes += 1
+            breakdown[operationId] = self._pages(operationId, total)
+            if entity == 'clients':
+                clients = total
+        if dataSources:
+            if clients is None:
+                clients = self.count('getTeamClients', teamId=teamId)
+                probes += 1
+            breakdown['getClientDataSources'] = clients
+        return self._estimate('enumerate team %s' % teamId, breakdown, probes)
+
+    def onboardClients(
+            self,
+            count: int,
+            dataSourcesPerClient: int = 1,
+            reportsPerClient: int = 1,
+            share: bool = True
+    ) -> JobEstimate:
+        """
+        Estimates onboarding new clients (see swydo.onboarding.ClientOnboarder).
+        """
+
+        breakdown = dict(
+            createTeamClient=count,
+            setClientDataSource=count * dataSourcesPerClient,
+            createTeamReport=count * reportsPerClient,
+        )
+        if share:
+            breakdown['shareTeamReport'] = count * reportsPerClient
+        return self._estimate('onboard %d clients' % count, {key: value for key, value in breakdown.items() if value})
+
+    def syncDataSources(
+            self,
+            teamId: str,
+            clients: Optional[int] = None,
+            providersPerClient: int = 1,
+            changeRate: float = 1.0
+    ) -> JobEstimate:
+        """
+        Estimates syncing the data sources of clients of a team (see swydo.reconcile.DataSourceReconciler).
+
+        :param clients: Number of clients to sync. Defaults to all clients of the team, with a probe call.
+        :param providersPerClient: Number of desired data sources of each client.
+        :param changeRate: Share of the desired data sources expected to differ from the current ones, between 0
+                           (nothing to do) and 1 (an upper bound).
+        """
+
+        probes = 0
+        if clients is None:
+            clients = self.count('getTeamClients', teamId=teamId)
+            probes += 1
+        breakdown = dict(
+            getClientDataSources=clients,
+            setClientDataSource=math.ceil(clients * providersPerClient * changeRate),
+        )
+        return self._estimate('sync data sources of %d clients' % clients,
+                              {key: value for key, value in breakdown.items() if value}, probes)
+
+    def schedule(self, estimates: Sequence[JobEstimate]) -> List[Dict[str, Any]]:
+        """
+        Orders jobs sharing the rate budget shortest first, which minimizes their average completion time.
+
+        :return: For each job, in order: its estimate, and the seconds from now it starts and finishes at.
+        """
+
+        schedule = []
+        now = 0.0
+        for estimate in sorted(estimates, key=lambda estimate: estimate.calls):
+            schedule.append(dict(estimate=estimate, startsAt=now, finishesAt=now + estimate.seconds))
+            now += estimate.seconds
+        return schedule
+
+    def _pages(self, operationId: str, total: int) -> int:
+        pageSizeTuner = None if self._pageSize else self._swydoClient.pageSizeTuner
+        if pageSizeTuner is not None:
+            return pageSizeTuner.estimatePages(operationId, total)
+        # An empty listing still takes a call
+        return max(1, math.ceil(total / (self._pageSize or DEFAULT_PAGE_SIZE)))
+
+    def _estimate(self, name: str, breakdown: Dict[str, int], probeCalls: int = 0) -> JobEstimate:
+        return JobEstimate(name=name, breakdown=breakdown, rate=self.rate, latency=self.latency, probeCalls=probeCalls)
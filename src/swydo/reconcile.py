@@ -0,0 +1,261 @@
+"""
+Declarative reconciliation of the data sources of clients.
+
+Example usage:
+
+    from swydo.reconcile import DataSourceReconciler
+    reconciler = DataSourceReconciler(swydoClient)
+    results = reconciler.reconcile(teamId, {
+        clientId: dict(
+            adwords=dict(connectionId=connectionId, scope=dict(clientId='123-456-7890', name='Account')),
+            facebookAds=None,
+        ),
+    })
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .client import SwydoClient
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+# Data source providers, as listed by getClientDataSources, with the suffix of their set/remove methods and the
+# argument of the set method for each field of their scope
+PROVIDERS: Dict[str, Tuple[str, Dict[str, str]]] = dict(
+    facebookAds=('FacebookAds', dict(
+        id='dataSourceId',
+        name='dataSourceName',
+        currencyCode='dataSourceCurrencyCode',
+    )),
+    facebookGraph=('FacebookGraph', dict(
+        id='dataSourceId',
+        name='dataSourceName',
+        pageId='dataSourcePageId',
+    )),
+    adwords=('GoogleAdWords', dict(
+        clientId='dataSourceClientId',
+        name='dataSourceName',
+        currencyCode='dataSourceCurrencyCode',
+    )),
+    analytics=('GoogleAnalytics', dict(
+        accountId='dataSourceAccountId',
+        name='dataSourceName',
+        accountName='dataSourceAccountName',
+        webPropertyId='dataSourceWebPropertyId',
+        profileId='dataSourceProfileId',
+        currencyCode='dataSourceCurrencyCode',
+    )),
+)
+
+
+class DataSourceChange(object):
+    """
+    A single call needed to bring a data source of a client to its desired state.
+    """
+
+    __slots__ = ('clientId', 'provider', 'action', 'desired', 'current')
+
+    def __init__(self, clientId: str, provider: str, action: str, desired: Optional[Dict[str, Any]],
+                 current: Optional[Dict[str, Any]]) -> None:
+        """
+        :param clientId: Client of the data source.
+        :param provider: One of PROVIDERS.
+        :param action: 'set' or 'remove'.
+        :param desired: Desired data source, with `connectionId` and `scope`, or None to remove it.
+        :param current: Current data source, as listed by getClientDataSources, or None if there is none.
+        """
+        self.clientId = clientId
+        self.provider = provider
+        self.action = action
+        self.desired = desired
+        self.current = current
+
+    def __repr__(self) -> str:
+        return 'DataSourceChange(%s %s of client %s)' % (self.action, self.provider, self.clientId)
+
+
+class ReconciliationResult(object):
+    """
+    Outcome of reconciling the data sources of a client.
+    """
+
+    __slots__ = ('clientId', 'changes', 'applied', 'failed', 'error')
+
+    def __init__(self, clientId: str) -> None:
+        self.clientId = clientId
+        # Changes needed, in the order they are applied
+        self.changes: List[DataSourceChange] = []
+        # Changes that were applied successfully
+        self.applied: List[DataSourceChange] = []
+        # Changes that failed, with their error
+        self.failed: List[Tuple[DataSourceChange, Exception]] = []
+        # Error of getting the current data sources, when no changes could be planned
+        self.error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        """Whether the client is in its desired state, or would be after applying a dry run plan."""
+        return self.error is None and not self.failed
+
+    def __repr__(self) -> str:
+        return 'ReconciliationResult(clientId=%r, changes=%d, applied=%d, failed=%d%s)' % (
+            self.clientId, len(self.changes), len(self.applied), len(self.failed),
+            ', error=%r' % self.error if self.error else ''
+        )
+
+
+class DataSourceReconciler(object):
+    """
+    Brings the data sources of many clients to a desired state, making only the calls that are needed.
+
+    The current data sources of all clients are fetched concurrently, compared with the desired state, and only the
+    providers that differ are set or removed - in parallel, up to `maxConcurrency` calls at once. A data source is
+    considered up to date when its connection is the desired one, and every field of the desired scope has the desired
+    value - fields Swydo adds to the scope are ignored.
+    """
+
+    def __init__(self, swydoClient: SwydoClient, maxConcurrency: int = 8, prune: bool = False) -> None:
+        """
+        :param swydoClient: Client to reconcile data sources with.
+        :param maxConcurrency: Maximum number of calls in flight at once.
+        :param prune: Remove data sources of providers missing from the desired state of a client. By default, they are
+                      left untouched, and only providers mapped to None are removed.
+        """
+        if maxConcurrency < 1:
+            raise ValueError("maxConcurrency must be at least 1.")
+
+        self._swydoClient = swydoClient
+        self._maxConcurrency = maxConcurrency
+        self._prune = prune
+
+    def plan(
+            self,
+            teamId: str,
+            desired: Dict[str, Dict[str, Optional[Dict[str, Any]]]]
+    ) -> Dict[str, ReconciliationResult]:
+        """
+        Returns the changes needed to reach the desired state, without applying them (dry run).
+
+        :param teamId: Team of the clients.
+        :param desired: Desired data sources of clients, by client id. Each maps providers (keys of PROVIDERS) to their
+                        desired data source - a dict with `connectionId` and `scope`, as listed by getClientDataSources
+                        - or None to remove it.
+        :return: Result of each client, by client id, with the planned changes.
+        """
+
+        for clientId, dataSources in desired.items():
+            unknown = set(dataSources) - set(PROVIDERS)
+            if unknown:
+                raise ValueError("Unknown data source providers of client %s: %s." % (
+                    clientId, ', '.join(sorted(unknown))))
+            for provider, dataSource in dataSources.items():
+                if dataSource is None:
+                    continue
+                if not dataSource.get('connectionId'):
+                    raise ValueError("The %s data source of client %s has no connectionId." % (provider, clientId))
+                unknown = set(dataSource.get('scope') or {}) - set(PROVIDERS[provider][1])
+                if unknown:
+                    raise ValueError("Unknown scope fields of the %s data source of client %s: %s." % (
+                        provider, clientId, ', '.join(sorted(unknown))))
+
+        results = {clientId: ReconciliationResult(clientId) for clientId in desired}
+        with ThreadPoolExecutor(max_workers=self._maxConcurrency, thread_name_prefix='swydo-reconcile') as executor:
+            futures = {
+                clientId: executor.submit(self._swydoClient.getClientDataSources, teamId=teamId, clientId=clientId)
+                for clientId in desired
+            }
+            for clientId, future in futures.items():
+                try:
+                    current = {
+                        dataSource.get('providerId'): dataSource
+                        for dataSource in future.result().get('dataSources') or []
+                    }
+                except Exception as e:
+                    results[clientId].error = e
+                    continue
+                results[clientId].changes = self._diff(clientId, desired[clientId], current)
+        return results
+
+    def reconcile(
+            self,
+            teamId: str,
+            desired: Dict[str, Dict[str, Optional[Dict[str, Any]]]],
+            dryRun: bool = False
+    ) -> Dict[str, ReconciliationResult]:
+        """
+        Brings the data sources of clients to the desired state - see `plan`.
+
+        :param dryRun: Only plan the changes, without applying them.
+        :return: Result of each client, by client id. A failed change doesn't stop the others.
+        """
+
+        results = self.plan(teamId=teamId, desired=desired)
+        if dryRun:
+            return results
+
+        changes = [change for result in results.values() for change in result.changes]
+        with ThreadPoolExecutor(max_workers=self._maxConcurrency, thread_name_prefix='swydo-reconcile') as executor:
+            futures = [(change, executor.submit(self._apply, teamId, change)) for change in changes]
+            for change, future in futures:
+                result = results[change.clientId]
+                try:
+                    future.result()
+                    result.applied.append(change)
+                except Exception as e:
+                    logging.warning('Cannot %s %s data source of client %s: %s', change.action, change.provider,
+                                    change.clientId, e)
+                    result.failed.append((change, e))
+        return results
+
+    # ==================================================================================================================
+    # Private Members
+    # ==================================================================================================================
+
+    def _diff(
+            self,
+            clientId: str,
+            desired: Dict[str, Optional[Dict[str, Any]]],
+            current: Dict[str, Dict[str, Any]]
+    ) -> List[DataSourceChange]:
+        changes = []
+        for provider in PROVIDERS:
+            if provider in desired:
+                dataSource = desired[provider]
+            elif self._prune:
+                dataSource = None
+            else:
+                continue
+            currentDataSource = current.get(provider)
+            if dataSource is None:
+                if currentDataSource is not None:
+                    changes.append(DataSourceChange(clientId, provider, 'remove', None, currentDataSource))
+            elif not self._isUpToDate(dataSource, currentDataSource):
+                # Setting replaces the current data source, there's no need to remove it first
+                changes.append(DataSourceChange(clientId, provider, 'set', dataSource, currentDataSource))
+        return changes
+
+    @staticmethod
+    def _isUpToDate(desired: Dict[str, Any], current: Optional[Dict[str, Any]]) -> bool:
+        if current is None or current.get('connectionId') != desired['connectionId']:
+            return False
+        currentScope = current.get('scope') or {}
+        return all(currentScope.get(field) == value for field, value in (desired.get('scope') or {}).items())
+
+    def _apply(self, teamId: str, change: DataSourceChange) -> None:
+        suffix, arguments = PROVIDERS[change.provider]
+        if change.action == 'remove':
+            getattr(self._swydoClient, 'removeClientDataSource' + suffix)(teamId=teamId, clientId=change.clientId)
+            return
+
+        scope = change.desired.get('scope') or {}
+        getattr(self._swydoClient, 'setClientDataSource' + suffix)(
+            teamId=teamId,
+            clientId=change.clientId,
+            connectionId=change.desired['connectionId'],
+            **{arguments[field]: value for field, value in scope.items()}
+        )
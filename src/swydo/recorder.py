@@ -0,0 +1,181 @@
+"""
+Flight recorder of Swydo API calls, cheap enough to leave on under full load.
+
+Example usage:
+
+    from swydo.recorder import FlightRecorder
+
+    recorder = FlightRecorder(capacity=2048)
+    recorder.installSignalHandler()  # kill -USR2 <pid> dumps the recent calls to stderr
+    swydoClient = SwydoClient(apiKey, flightRecorder=recorder)
+    ...
+    for call in recorder.getRecords(slowerThan=2.0):
+        print(call)
+"""
+
+import itertools
+import json
+import signal
+import sys
+import time
+import zlib
+from typing import Any, Dict, List, Optional, TextIO
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+class CallRecord(object):
+    """
+    What happened during a single client call, including all its attempts. Updated in place while the call runs.
+    """
+
+    __slots__ = (
+        'operationId', 'params', 'startedAt', 'duration', 'rateLimitWait', 'httpTime', 'backoffTime', 'attempts',
+        'status', 'bytes', 'error',
+    )
+
+    def __init__(self, operationId: str, params: Dict[str, Any], startedAt: float) -> None:
+        self.operationId = operationId
+        # Only digested when the record is read, to keep recording cheap
+        self.params = params
+        self.startedAt = startedAt
+        self.duration: Optional[float] = None
+        self.rateLimitWait = 0.0
+        self.httpTime = 0.0
+        self.backoffTime = 0.0
+        self.attempts = 0
+        self.status: Optional[int] = None
+        self.bytes = 0
+        self.error: Optional[str] = None
+
+    def onResponse(self, incomingResponse: Any, operation: Any) -> None:
+        """
+        bravado response callback, recording the status and size of every response of the call.
+        """
+
+        self.status = incomingResponse.status_code
+        self.bytes += len(incomingResponse.raw_bytes or b'')
+
+
+class FlightRecorder(object):
+    """
+    Keeps the last `capacity` calls of a client in a fixed-size ring buffer: their operation, a digest of their
+    parameters, when they started, how long they waited for the rate limiter, spent in HTTP calls and backing off
+    between retries, their number of retries, and the HTTP status and size of their last response.
+
+    Recording a call costs an object and a few field updates, without locks or I/O, so the recorder can stay on in
+    production and be read - or dumped, e.g. on a signal - when a job slows down. Calls in flight are included, with no
+    duration yet.
+
+    Pass an instance to SwydoClient(flightRecorder=...). An instance may be shared by several clients.
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        """
+        :param capacity: Number of most recent calls to keep.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+
+        self._capacity = capacity
+        self._ring: List[Optional[CallRecord]] = [None] * capacity
+        # next() of itertools.count is atomic, so threads never share a slot of the ring
+        self._sequence = itertools.count()
+        # Converts monotonic times to wall times, when reading records
+        self._wallOffset = time.time() - time.monotonic()
+
+    def start(self, operationId: str, params: Dict[str, Any], record: Optional[CallRecord] = None) -> CallRecord:
+        """
+        Records the start of a call.
+
+        :param record: Record of the call to keep, if the caller made one, e.g. to time the call itself.
+        """
+
+        record = record or CallRecord(operationId, params, time.monotonic())
+        self._ring[next(self._sequence) % self._capacity] = record
+        return record
+
+    def finish(self, record: CallRecord, error: Optional[BaseException] = None) -> None:
+        """
+        Records the end of a call.
+
+        :param error: Error the call failed with, if any.
+        """
+
+        record.duration = time.monotonic() - record.startedAt
+        if error is not None:
+            record.error = type(error).__name__
+            record.status = getattr(error, 'status_code', record.status)
+
+    def getRecords(self, slowerThan: Optional[float] = None, failedOnly: bool = False) -> List[Dict[str, Any]]:
+        """
+        Returns the recorded calls, oldest first.
+
+        :param slowerThan: Only calls that took, or have been running for, at least this many seconds.
+        :param failedOnly: Only calls that failed.
+        """
+
+        now = time.monotonic()
+        records = []
+        # Copies the ring first, as it keeps changing - a slot overwritten meanwhile is left out
+        for record in sorted((record for record in list(self._ring) if record is not None),
+                             key=lambda record: record.startedAt):
+            duration = record.duration
+            if slowerThan is not None and (duration if duration is not None else now - record.startedAt) < slowerThan:
+                continue
+            if failedOnly and record.error is None:
+                continue
+            records.append(dict(
+                operationId=record.operationId,
+                paramsDigest='%08x' % zlib.crc32(
+                    json.dumps(record.params, sort_keys=True, default=str).encode('utf-8')
+                ),
+                startedAt=record.startedAt + self._wallOffset,
+                duration=duration,
+                rateLimitWait=record.rateLimitWait,
+                httpTime=record.httpTime,
+                backoffTime=record.backoffTime,
+                retries=max(record.attempts - 1, 0),
+                status=record.status,
+                bytes=record.bytes,
+                error=record.error,
+            ))
+        return records
+
+    def dump(self, stream: Optional[TextIO] = None, **filters: Any) -> int:
+        """
+        Writes the recorded calls as JSON lines, oldest first.
+
+        :param stream: Defaults to stderr.
+        :param filters: Arguments of getRecords.
+        :return: Number of calls written.
+        """
+
+        stream = stream or sys.stderr
+        records = self.getRecords(**filters)
+        for record in records:
+            stream.write(json.dumps(record) + '\n')
+        stream.flush()
+        return len(records)
+
+    def installSignalHandler(self, signalNumber: Optional[int] = None, path: Optional[str] = None) -> None:
+        """
+        Dumps the recorded calls when the process receives a signal. Must be called from the main thread.
+
+        :param signalNumber: Defaults to SIGUSR2, where the platform has it.
+        :param path: Append the calls to this file, instead of writing them to stderr.
+        """
+
+        if signalNumber is None:
+            signalNumber = signal.SIGUSR2
+
+        def handleSignal(signalNumber: int, frame: Any) -> None:
+            if path is None:
+                self.dump()
+            else:
+                with open(path, 'a', encoding='utf-8') as stream:
+                    self.dump(stream)
+
+        signal.signal(signalNumber, handleSignal)
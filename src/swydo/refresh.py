@@ -0,0 +1,285 @@
+"""
+Background refreshing of slow-changing Swydo catalogs.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .client import SwydoClient
+from .throttling import RateLimiter
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+CATALOGS = ('brandTemplates', 'reportTemplates', 'connections', 'users')
+
+
+class CatalogSnapshot(object):
+    """
+    An immutable copy of a catalog of a team, as of its last refresh.
+    """
+
+    __slots__ = ('teamId', 'catalog', 'items', 'version', 'fetchedAt')
+
+    def __init__(self, teamId: str, catalog: str, items: Tuple[Dict[str, Any], ...], version: int,
+                 fetchedAt: float) -> None:
+        """
+        :param teamId: Team the catalog belongs to.
+        :param catalog: One of CATALOGS.
+        :param items: Items of the catalog.
+        :param version: Starts at 1, and increases every time a refresh finds different items.
+        :param fetchedAt: time.monotonic() of the last refresh, whether it found changes or not.
+        """
+        self.teamId = teamId
+        self.catalog = catalog
+        self.items = items
+        self.version = version
+        self.fetchedAt = fetchedAt
+
+    def __repr__(self) -> str:
+        return 'CatalogSnapshot(teamId=%r, catalog=%r, items=%d, version=%d)' % (
+            self.teamId, self.catalog, len(self.items), self.version
+        )
+
+
+class CatalogRefresher(object):
+    """
+    Keeps catalogs that rarely change - brand templates, report templates, connections and users - of teams in memory,
+    refreshing them in the background (stale-while-revalidate).
+
+    Reads return the current copy immediately, and ask for a refresh when it is older than `maxAge`. Every catalog is
+    also refreshed every `interval` seconds. Refreshes run one at a time on a background thread, which takes at most
+    `budgetShare` of the client's current call rate, so they never crowd out the calls of request paths.
+
+    Only the first read of a catalog, before it was ever loaded, waits for the API - use `start(teamIds)` to load
+    catalogs ahead of time.
+    """
+
+    def __init__(
+            self,
+            swydoClient: SwydoClient,
+            catalogs: Iterable[str] = CATALOGS,
+            interval: float = 300,
+            maxAge: Optional[float] = None,
+            budgetShare: float = 0.2
+    ) -> None:
+        """
+        :param swydoClient: Client to refresh catalogs with.
+        :param catalogs: Catalogs to keep, out of CATALOGS.
+        :param interval: Seconds between scheduled refreshes of every catalog.
+        :param maxAge: Reads of a catalog older than this many seconds ask for a refresh. Defaults to `interval`.
+        :param budgetShare: Share of the client's calls per second that refreshes may use, between 0 and 1.
+        """
+        catalogs = tuple(catalogs)
+        unknown = set(catalogs) - set(CATALOGS)
+        if unknown:
+            raise ValueError("Unknown catalogs: %s." % ', '.join(sorted(unknown)))
+        if not 0 < budgetShare <= 1:
+            raise ValueError("budgetShare must be between 0 and 1.")
+
+        self._swydoClient = swydoClient
+        self._catalogs = catalogs
+        self._interval = interval
+        self._maxAge = interval if maxAge is None else maxAge
+        self._budgetShare = budgetShare
+        self._budget = RateLimiter(calls=self._getBudgetCalls(), period=1)
+        self._condition = threading.Condition()
+        self._snapshots: Dict[Tuple[str, str], CatalogSnapshot] = dict()
+        self._digests: Dict[Tuple[str, str], str] = dict()
+        # Error of the last refresh of catalogs that failed
+        self._errors: Dict[Tuple[str, str], Exception] = dict()
+        self._teamIds: List[str] = []
+        # Pending refreshes, in the order they were asked for
+        self._pending: 'OrderedDict[Tuple[str, str], None]' = OrderedDict()
+        self._listeners: List[Callable[[CatalogSnapshot], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def start(self, teamIds: Iterable[str] = (), wait: bool = True) -> 'CatalogRefresher':
+        """
+        Starts refreshing in the background.
+
+        :param teamIds: Teams to keep the catalogs of. Teams read later are added on their first read.
+        :param wait: Wait until the catalogs of these teams are loaded.
+        """
+
+        with self._condition:
+            for teamId in teamIds:
+                self._addTeam(teamId)
+            self._ensureStarted()
+            if wait:
+                while any(key in self._pending for key in self._keys(self._teamIds)) and not self._stopped:
+                    self._condition.wait()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops refreshing. Reads still return the catalogs loaded so far.
+        """
+
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def addListener(self, listener: Callable[[CatalogSnapshot], None]) -> None:
+        """
+        Calls `listener` with the new snapshot whenever a refresh finds a catalog changed, including its first load.
+        Listeners run on the refresher's thread.
+        """
+
+        with self._condition:
+            self._listeners.append(listener)
+
+    def get(self, teamId: str, catalog: str, timeout: Optional[float] = None) -> CatalogSnapshot:
+        """
+        Returns the current copy of a catalog of a team, asking for a refresh in the background if it is stale.
+
+        :param teamId: Team to get the catalog of.
+        :param catalog: One of the refresher's catalogs.
+        :param timeout: Maximum number of seconds to wait if the catalog was never loaded.
+        :raise TimeoutError: The catalog was not loaded within `timeout`.
+        :raise: The error of loading the catalog, if it was never loaded and its last refresh failed.
+        """
+
+        if catalog not in self._catalogs:
+            raise ValueError("Catalog %s is not refreshed." % catalog)
+
+        key = (teamId, catalog)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            if teamId not in self._teamIds:
+                self._addTeam(teamId)
+
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None:
+                if time.monotonic() - snapshot.fetchedAt > self._maxAge:
+                    self._request(key)
+                return snapshot
+
+            if key not in self._pending:
+                self._request(key)
+            self._ensureStarted()
+            while key not in self._snapshots:
+                if key in self._errors and key not in self._pending:
+                    raise self._errors[key]
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if self._stopped or (remaining is not None and remaining <= 0):
+                    raise TimeoutError("Catalog %s of team %s was not loaded." % (catalog, teamId))
+                self._condition.wait(remaining)
+            return self._snapshots[key]
+
+    def getItems(self, teamId: str, catalog: str) -> Tuple[Dict[str, Any], ...]:
+        """
+        Returns the items of the current copy of a catalog of a team - see `get`.
+        """
+
+        return self.get(teamId=teamId, catalog=catalog).items
+
+    def refresh(self, teamId: Optional[str] = None) -> None:
+        """
+        Asks for a refresh of all catalogs, or those of a single team, in the background.
+        """
+
+        with self._condition:
+            for key in self._keys([teamId] if teamId else self._teamIds):
+                self._request(key)
+
+    def _ensureStarted(self) -> None:
+        if self._thread is None and not self._stopped:
+            self._thread = threading.Thread(target=self._run, name='swydo-refresher', daemon=True)
+            self._thread.start()
+
+    def _keys(self, teamIds: Iterable[str]) -> List[Tuple[str, str]]:
+        return [(teamId, catalog) for teamId in teamIds for catalog in self._catalogs]
+
+    def _addTeam(self, teamId: str) -> None:
+        self._teamIds.append(teamId)
+        for key in self._keys([teamId]):
+            self._request(key)
+
+    def _request(self, key: Tuple[str, str]) -> None:
+        self._pending[key] = None
+        self._condition.notify_all()
+
+    def _getBudgetCalls(self) -> int:
+        return max(1, int(self._swydoClient.getCallStats()['rate'] * self._budgetShare))
+
+    def _run(self) -> None:
+        nextSchedule = time.monotonic() + self._interval
+
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    remaining = nextSchedule - time.monotonic()
+                    if remaining <= 0:
+                        for key in self._keys(self._teamIds):
+                            self._pending[key] = None
+                        nextSchedule = time.monotonic() + self._interval
+                    else:
+                        self._condition.wait(remaining)
+                if self._stopped:
+                    return
+                key = next(iter(self._pending))
+
+            error = None
+            try:
+                self._refresh(*key)
+            except Exception as e:
+                error = e
+                logging.exception('Cannot refresh Swydo catalog %s of team %s.', key[1], key[0])
+
+            with self._condition:
+                if error is None:
+                    self._errors.pop(key, None)
+                else:
+                    self._errors[key] = error
+                self._pending.pop(key, None)
+                self._condition.notify_all()
+
+    def _refresh(self, teamId: str, catalog: str) -> None:
+        listers: Dict[str, Callable[..., Any]] = dict(
+            brandTemplates=self._swydoClient.getTeamBrandTemplates,
+            reportTemplates=self._swydoClient.getTeamReportTemplates,
+            connections=self._swydoClient.getTeamConnections,
+            users=self._swydoClient.getTeamUsers,
+        )
+
+        # Follow the client's current rate, which an adaptive rate controller keeps changing
+        self._budget.setCalls(self._getBudgetCalls())
+        iterator = listers[catalog](teamId=teamId)
+        # Every page takes its own share of the budget, before it is fetched
+        iterator.beforeFetch = self._budget.acquire
+        items = list(iterator)
+
+        digest = hashlib.sha1(json.dumps(items, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        key = (teamId, catalog)
+
+        with self._condition:
+            previous = self._snapshots.get(key)
+            changed = previous is None or self._digests.get(key) != digest
+            snapshot = CatalogSnapshot(
+                teamId=teamId,
+                catalog=catalog,
+                items=tuple(items) if changed or previous is None else previous.items,
+                version=(previous.version if previous else 0) + (1 if changed else 0),
+                fetchedAt=time.monotonic(),
+            )
+            self._snapshots[key] = snapshot
+            self._digests[key] = digest
+            listeners = list(self._listeners) if changed else []
+
+        for listener in listeners:
+            try:
+                listener(snapshot)
+            except Exception:
+                logging.exception('Swydo catalog listener failed.')
@@ -0,0 +1,158 @@
+"""
+Retry policies and deadlines of Swydo API calls.
+
+Example usage:
+
+    from swydo import RetryPolicy, deadline
+
+    # Batch jobs retry patiently
+    batchClient = SwydoClient(apiKey, retryPolicy=RetryPolicy(maxTime=120, maxDelay=30))
+
+    # Latency sensitive paths fail fast: calls, and their retries, give up after 2 seconds
+    with deadline(2.0):
+        report = swydoClient.getTeamReport(teamId, reportId)
+"""
+
+import contextlib
+import random
+import time
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional, Tuple, Type
+
+from bravado.exception import BravadoConnectionError, BravadoTimeoutError, HTTPServerError, HTTPTooManyRequests
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+# Errors that are likely to go away, but may happen after the server acted on the call
+TRANSIENT_ERRORS: Tuple[Type[Exception], ...] = (HTTPServerError, BravadoConnectionError, BravadoTimeoutError)
+
+# HTTP methods whose calls may safely be repeated
+IDEMPOTENT_METHODS = frozenset(('get', 'head', 'options', 'put', 'delete'))
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a call cannot complete before the deadline of its context.
+    """
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed calls are retried, and how long to wait before each retry: exponential backoff, with jitter,
+    capped per retry and in total.
+
+    Calls throttled by Swydo (HTTP 429) are always safe to retry. Server errors, connection errors and timeouts are only
+    retried for idempotent calls (see IDEMPOTENT_METHODS), since a failed POST may still have been carried out.
+
+    The defaults match the previous fixed behavior for throttled calls: delays of 1, 2, 4... seconds with full jitter,
+    for at most 10 seconds.
+    """
+
+    def __init__(
+            self,
+            retryOn: Tuple[Type[Exception], ...] = (HTTPTooManyRequests,),
+            retryIdempotentOn: Tuple[Type[Exception], ...] = TRANSIENT_ERRORS,
+            maxAttempts: Optional[int] = None,
+            maxTime: Optional[float] = 10.0,
+            initialDelay: float = 1.0,
+            multiplier: float = 2.0,
+            maxDelay: Optional[float] = None,
+            jitter: Optional[str] = 'full',
+            rng: Callable[[], float] = random.random
+    ) -> None:
+        """
+        :param retryOn: Errors retried for all calls.
+        :param retryIdempotentOn: Errors retried for idempotent calls only.
+        :param maxAttempts: Maximum number of attempts of a call, including the first one, or None for no limit.
+        :param maxTime: Maximum number of seconds from the first attempt to the start of the last retry, or None for
+                        no limit.
+        :param initialDelay: Seconds to wait before the first retry.
+        :param multiplier: Factor the delay grows by on every further retry.
+        :param maxDelay: Maximum number of seconds to wait before a retry, or None for no limit.
+        :param jitter: 'full' waits a random time between 0 and the delay, 'equal' between half the delay and the delay,
+                       and None exactly the delay.
+        :param rng: Returns a random number between 0 and 1.
+        """
+        if maxAttempts is not None and maxAttempts < 1:
+            raise ValueError("maxAttempts must be at least 1.")
+        if jitter not in ('full', 'equal', None):
+            raise ValueError("jitter must be 'full', 'equal' or None.")
+
+        self.retryOn = retryOn
+        self.retryIdempotentOn = retryIdempotentOn
+        self.maxAttempts = maxAttempts
+        self.maxTime = maxTime
+        self.initialDelay = initialDelay
+        self.multiplier = multiplier
+        self.maxDelay = maxDelay
+        self.jitter = jitter
+        self._rng = rng
+
+    def isRetriable(self, error: Exception, idempotent: bool) -> bool:
+        return isinstance(error, self.retryOn) or (idempotent and isinstance(error, self.retryIdempotentOn))
+
+    def getRetryDelay(self, error: Exception, idempotent: bool, attempt: int, elapsed: float) -> Optional[float]:
+        """
+        Returns the number of seconds to wait before retrying a failed call, or None if it must not be retried.
+
+        :param error: Error of the failed attempt.
+        :param idempotent: Whether the call may safely be repeated.
+        :param attempt: Number of the failed attempt, starting at 1.
+        :param elapsed: Seconds since the first attempt started.
+        """
+
+        if not self.isRetriable(error, idempotent):
+            return None
+        if self.maxAttempts is not None and attempt >= self.maxAttempts:
+            return None
+
+        delay = self.initialDelay * self.multiplier ** (attempt - 1)
+        if self.maxDelay is not None:
+            delay = min(delay, self.maxDelay)
+        if self.jitter == 'full':
+            delay *= self._rng()
+        elif self.jitter == 'equal':
+            delay *= 0.5 + 0.5 * self._rng()
+
+        if self.maxTime is not None:
+            if elapsed >= self.maxTime:
+                return None
+            delay = min(delay, self.maxTime - elapsed)
+        return delay
+
+
+@contextlib.contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """
+    Limits the API calls made within the context - their HTTP timeouts, retries and waits between retries - to
+    complete in `seconds` from now, raising DeadlineExceeded otherwise. Nested deadlines can only shorten it.
+
+    Deadlines apply to the current thread (or asyncio task), not to threads it starts.
+    """
+
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def getRemainingTime() -> Optional[float]:
+    """
+    Returns the number of seconds left until the deadline of the current context, or None if there is none.
+    """
+
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+_deadline: ContextVar[Optional[float]] = ContextVar('swydoDeadline', default=None)
@@ -0,0 +1,401 @@
+"""
+Compact binary snapshots of Swydo teams, read lazily from memory-mapped files.
+
+Example usage:
+
+    from swydo.snapshot import SnapshotReader, SnapshotWriter
+
+    with SnapshotWriter('teams.swydo') as writer:
+        for teamId in teamIds:
+            writer.addTeam(swydoClient, teamId, dataSources=True)
+
+    with SnapshotReader('teams.swydo') as snapshot:
+        client = snapshot.get('clients', TEAM_ID, CLIENT_ID)
+        reports = list(snapshot.iterate('reports', teamId=TEAM_ID))
+"""
+
+import bisect
+import datetime
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .client import SwydoClient
+from .models import TEAM_ENTITIES, Model
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+class SnapshotWriter(object):
+    """
+    Writes entities to a snapshot file, as they are added.
+
+    The file holds length-prefixed records, each tagged with its kind, team and id, followed by a table of the strings
+    shared by records - field names, and values of up to 64 bytes, each stored once - and an index of records by kind,
+    team and id. Only the string table and the index are held in memory while writing.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: Path of the snapshot file, replaced if it exists. Written to a temporary file until `close`.
+        """
+        self._path = path
+        # Unique, so concurrent writers of the same snapshot don't clash - the last one to close wins
+        fd, self._temporaryPath = tempfile.mkstemp(
+            prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(path))
+        )
+        self._file: BinaryIO = os.fdopen(fd, 'wb')
+        self._file.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION))
+        self._offset = _HEADER.size
+        self._strings: Dict[str, int] = dict()
+        self._index: List[Tuple[int, int]] = []
+
+    def add(self, kind: str, teamId: str, entity: Dict[str, Any]) -> None:
+        """
+        Adds an entity, e.g. add('clients', teamId, client). Entities are keyed by their kind, team and 'id' field.
+        """
+
+        if isinstance(entity, Model):
+            entity = entity.toDict()
+        body = bytearray()
+        for string in (kind, teamId, entity['id']):
+            _writeVarint(body, self._intern(string))
+        self._encode(body, entity)
+
+        self._index.append((_hashKey(kind, teamId, entity['id']), self._offset))
+        self._file.write(_LENGTH.pack(len(body)))
+        self._file.write(body)
+        self._offset += _LENGTH.size + len(body)
+
+    def addTeam(
+            self,
+            swydoClient: SwydoClient,
+            teamId: str,
+            entities: Iterable[str] = TEAM_ENTITIES,
+            dataSources: bool = False
+    ) -> int:
+        """
+        Adds the entities of a team, streaming them from the API.
+
+        :param entities: Kinds of entities to add, out of swydo.models.TEAM_ENTITIES.
+        :param dataSources: Also add the data sources of every client, as 'dataSources' keyed by client id.
+        :return: Number of entities added.
+        """
+
+        entities = tuple(entities)
+        added = 0
+        clientIds: List[str] = []
+        for kind in entities:
+            for item in getattr(swydoClient, TEAM_ENTITIES[kind])(teamId=teamId):
+                self.add(kind, teamId, item)
+                added += 1
+                if kind == 'clients':
+                    clientIds.append(item['id'])
+        if dataSources:
+            if 'clients' not in entities:
+                clientIds = [client['id'] for client in swydoClient.getTeamClients(teamId=teamId)]
+            for clientId in clientIds:
+                self.add('dataSources', teamId, swydoClient.getClientDataSources(teamId=teamId, clientId=clientId))
+                added += 1
+        return added
+
+    def close(self) -> None:
+        """
+        Writes the string table and the index, and moves the snapshot in place.
+        """
+
+        if self._file.closed:
+            return
+
+        stringsOffset = self._offset
+        offsets = [stringsOffset]
+        for string in self._strings:
+            encoded = string.encode('utf-8')
+            self._file.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+        # Aligns the tables that follow
+        padding = -offsets[-1] % 8
+        self._file.write(bytes(padding))
+        stringOffsetsOffset = offsets[-1] + padding
+        self._file.write(struct.pack('<%dQ' % len(offsets), *offsets))
+
+        indexOffset = stringOffsetsOffset + 8 * len(offsets)
+        self._index.sort()
+        for entry in self._index:
+            self._file.write(_INDEX_ENTRY.pack(*entry))
+        self._file.write(_TRAILER.pack(
+            stringOffsetsOffset, len(self._strings), indexOffset, len(self._index), _MAGIC
+        ))
+        self._file.close()
+        os.replace(self._temporaryPath, self._path)
+
+    def __enter__(self) -> 'SnapshotWriter':
+        return self
+
+    def __exit__(self, excType: Any, *args: Any) -> None:
+        if excType is None:
+            self.close()
+        else:
+            # Leave any previous snapshot in place
+            self._file.close()
+            os.remove(self._temporaryPath)
+
+    # ==================================================================================================================
+    # Private Members
+    # ==================================================================================================================
+
+    def _intern(self, string: str) -> int:
+        stringId = self._strings.get(string)
+        if stringId is None:
+            stringId = self._strings[string] = len(self._strings)
+        return stringId
+
+    def _encode(self, buffer: bytearray, value: Any) -> None:
+        if value is None:
+            buffer.append(_NONE)
+        elif value is True or value is False:
+            buffer.append(_TRUE if value else _FALSE)
+        elif isinstance(value, str):
+            encoded = value.encode('utf-8')
+            if len(encoded) <= _INTERNED_STRING_SIZE:
+                buffer.append(_STRING)
+                _writeVarint(buffer, self._intern(value))
+            else:
+                buffer.append(_INLINE_STRING)
+                _writeVarint(buffer, len(encoded))
+                buffer += encoded
+        elif isinstance(value, int):
+            buffer.append(_INT)
+            _writeVarint(buffer, value << 1 if value >= 0 else (-value << 1) - 1)
+        elif isinstance(value, float):
+            buffer.append(_FLOAT)
+            buffer += _DOUBLE.pack(value)
+        elif isinstance(value, dict):
+            buffer.append(_DICT)
+            _writeVarint(buffer, len(value))
+            for key, item in value.items():
+                _writeVarint(buffer, self._intern(key))
+                self._encode(buffer, item)
+        elif isinstance(value, (list, tuple)):
+            buffer.append(_LIST)
+            _writeVarint(buffer, len(value))
+            for item in value:
+                self._encode(buffer, item)
+        elif isinstance(value, datetime.datetime):
+            buffer.append(_DATETIME)
+            encoded = value.isoformat().encode('ascii')
+            _writeVarint(buffer, len(encoded))
+            buffer += encoded
+        elif isinstance(value, Model):
+            self._encode(buffer, value.toDict())
+        else:
+            raise TypeError("Cannot write %s values to a snapshot." % type(value).__name__)
+
+
+class SnapshotReader(object):
+    """
+    Reads a snapshot file written by SnapshotWriter, through a memory map.
+
+    Opening a snapshot only reads its trailer. Records are decoded when they are read, and strings of the string table
+    the first time a record uses them, so `get` of a single entity - a binary search of the index - touches a few
+    pages of the file, however large it is.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._mmap) < _HEADER.size + _TRAILER.size or \
+                    _HEADER.unpack_from(self._mmap, 0) != (_MAGIC, _FORMAT_VERSION):
+                raise ValueError("%s is not a Swydo snapshot of version %d." % (path, _FORMAT_VERSION))
+            self._stringOffsetsOffset, stringCount, self._indexOffset, self._count, magic = \
+                _TRAILER.unpack_from(self._mmap, len(self._mmap) - _TRAILER.size)
+            if magic != _MAGIC:
+                raise ValueError("%s is an incomplete Swydo snapshot." % path)
+        except BaseException:
+            self._mmap.close()
+            raise
+        self._recordsEnd = struct.unpack_from('<Q', self._mmap, self._stringOffsetsOffset)[0]
+        self._strings: List[Optional[str]] = [None] * stringCount
+        # Hashes of the index, read on demand by the binary search
+        self._hashes = _IndexHashes(self._mmap, self._indexOffset, self._count)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, kind: str, teamId: str, entityId: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns an entity, or None if the snapshot doesn't have it.
+        """
+
+        keyHash = _hashKey(kind, teamId, entityId)
+        position = bisect.bisect_left(self._hashes, keyHash)
+        while position < self._count:
+            entryHash, offset = _INDEX_ENTRY.unpack_from(self._mmap, self._indexOffset + position * _INDEX_ENTRY.size)
+            if entryHash != keyHash:
+                break
+            recordKey, bodyPosition = self._readRecordKey(offset)
+            if recordKey == (kind, teamId, entityId):
+                return self._decode(bodyPosition)[0]
+            position += 1
+        return None
+
+    def iterate(self, kind: Optional[str] = None, teamId: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the entities of a kind and/or team, or all of them, in the order they were written. Records of other
+        kinds and teams are skipped without being decoded.
+        """
+
+        for recordKind, recordTeamId, _, bodyPosition in self._iterateRecords():
+            if (kind is None or recordKind == kind) and (teamId is None or recordTeamId == teamId):
+                yield self._decode(bodyPosition)[0]
+
+    def keys(self) -> Iterator[Tuple[str, str, str]]:
+        """
+        Yields the kind, team and id of every entity, in the order they were written.
+        """
+
+        for kind, teamId, entityId, _ in self._iterateRecords():
+            yield kind, teamId, entityId
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def __enter__(self) -> 'SnapshotReader':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    # ==================================================================================================================
+    # Private Members
+    # ==================================================================================================================
+
+    def _iterateRecords(self) -> Iterator[Tuple[str, str, str, int]]:
+        offset = _HEADER.size
+        while offset < self._recordsEnd:
+            (length,) = _LENGTH.unpack_from(self._mmap, offset)
+            (kind, teamId, entityId), bodyPosition = self._readRecordKey(offset)
+            yield kind, teamId, entityId, bodyPosition
+            offset += _LENGTH.size + length
+
+    def _readRecordKey(self, offset: int) -> Tuple[Tuple[str, str, str], int]:
+        position = offset + _LENGTH.size
+        kindId, position = _readVarint(self._mmap, position)
+        teamId, position = _readVarint(self._mmap, position)
+        entityId, position = _readVarint(self._mmap, position)
+        return (self._getString(kindId), self._getString(teamId), self._getString(entityId)), position
+
+    def _getString(self, stringId: int) -> str:
+        string = self._strings[stringId]
+        if string is None:
+            start, end = struct.unpack_from('<2Q', self._mmap, self._stringOffsetsOffset + 8 * stringId)
+            string = self._strings[stringId] = self._mmap[start:end].decode('utf-8')
+        return string
+
+    def _decode(self, position: int) -> Tuple[Any, int]:
+        data = self._mmap
+        tag = data[position]
+        position += 1
+        if tag == _STRING:
+            stringId, position = _readVarint(data, position)
+            return self._getString(stringId), position
+        if tag == _DICT:
+            count, position = _readVarint(data, position)
+            result = dict()
+            for _ in range(count):
+                keyId, position = _readVarint(data, position)
+                result[self._getString(keyId)], position = self._decode(position)
+            return result, position
+        if tag == _NONE:
+            return None, position
+        if tag == _TRUE or tag == _FALSE:
+            return tag == _TRUE, position
+        if tag == _INT:
+            value, position = _readVarint(data, position)
+            return (value >> 1) if not value & 1 else -((value + 1) >> 1), position
+        if tag == _FLOAT:
+            return _DOUBLE.unpack_from(data, position)[0], position + _DOUBLE.size
+        if tag == _LIST:
+            count, position = _readVarint(data, position)
+            items = []
+            for _ in range(count):
+                item, position = self._decode(position)
+                items.append(item)
+            return items, position
+        if tag == _INLINE_STRING or tag == _DATETIME:
+            length, position = _readVarint(data, position)
+            string = data[position:position + length].decode('utf-8')
+            value = datetime.datetime.fromisoformat(string) if tag == _DATETIME else string
+            return value, position + length
+        raise ValueError("Corrupt Swydo snapshot: unknown value tag %d." % tag)
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+_MAGIC = b'SWYDOSNP'
+_FORMAT_VERSION = 1
+# Magic and format version
+_HEADER = struct.Struct('<8sI')
+# Offsets of the string offsets and of the index, the number of strings and of records, and the magic again, which is
+# only written once the snapshot is complete
+_TRAILER = struct.Struct('<QQQQ8s')
+# Key hash and offset of a record
+_INDEX_ENTRY = struct.Struct('<QQ')
+# Length of a record, after itself
+_LENGTH = struct.Struct('<I')
+_DOUBLE = struct.Struct('<d')
+# Longer strings are stored inline, as they are rarely repeated
+_INTERNED_STRING_SIZE = 64
+
+# Value tags
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STRING, _INLINE_STRING, _LIST, _DICT, _DATETIME = range(10)
+
+
+def _hashKey(kind: str, teamId: str, entityId: str) -> int:
+    digest = hashlib.blake2b(('%s\0%s\0%s' % (kind, teamId, entityId)).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _writeVarint(buffer: bytearray, value: int) -> None:
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _readVarint(data: Any, position: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+class _IndexHashes(object):
+    """
+    Sequence view of the key hashes of a snapshot index, for bisect.
+    """
+
+    __slots__ = ('_mmap', '_offset', '_count')
+
+    def __init__(self, data: mmap.mmap, offset: int, count: int) -> None:
+        self._mmap = data
+        self._offset = offset
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, position: int) -> int:
+        return struct.unpack_from('<Q', self._mmap, self._offset + position * _INDEX_ENTRY.size)[0]
@@ -0,0 +1,306 @@
+"""
+Client-side throttling of Swydo API calls.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+class RateLimiter(object):
+    """
+    Thread-safe, blocking rate limiter.
+
+    Allows at most `calls` acquisitions within any sliding window of `period` seconds. Threads that exceed the limit
+    sleep until a slot frees up, instead of failing and relying on retries.
+    """
+
+    def __init__(
+            self,
+            calls: int = 10,
+            period: float = 1.0,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep
+    ) -> None:
+        if calls < 1:
+            raise ValueError("calls must be at least 1.")
+        if period <= 0:
+            raise ValueError("period must be positive.")
+
+        self._calls = calls
+        self._period = period
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._timestamps: Deque[float] = deque()
+
+    @property
+    def calls(self) -> int:
+        """Maximum number of calls allowed per period."""
+        return self._calls
+
+    @property
+    def period(self) -> float:
+        """Length of the sliding window, in seconds."""
+        return self._period
+
+    @property
+    def rate(self) -> float:
+        """Maximum number of calls allowed per second."""
+        return self._calls / self._period
+
+    def setCalls(self, calls: int) -> None:
+        """
+        Changes the maximum number of calls per period. Calls already taken within the window still count.
+        """
+
+        if calls < 1:
+            raise ValueError("calls must be at least 1.")
+        with self._lock:
+            self._calls = calls
+
+    def acquire(self) -> float:
+        """
+        Block until a call is allowed.
+
+        :return: Number of seconds spent waiting.
+        """
+
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                now = self._clock()
+                while self._timestamps and self._timestamps[0] <= now - self._period:
+                    self._timestamps.popleft()
+
+                if len(self._timestamps) < self._calls:
+                    self._timestamps.append(now)
+                    return waited
+
+                delay = self._timestamps[0] + self._period - now
+
+            # Sleep outside the lock, so other threads can still inspect the window
+            self._sleep(delay)
+            waited += delay
+
+    def tryAcquire(self) -> bool:
+        """
+        Take a call if one is allowed right away, without blocking.
+
+        :return: Whether the call is allowed.
+        """
+
+        with self._lock:
+            now = self._clock()
+            while self._timestamps and self._timestamps[0] <= now - self._period:
+                self._timestamps.popleft()
+            if len(self._timestamps) < self._calls:
+                self._timestamps.append(now)
+                return True
+            return False
+
+    def release(self, latency: float, throttled: bool = False) -> None:
+        """
+        Reports the outcome of an acquired call. The fixed limiter does not adapt, so this does nothing.
+
+        :param latency: Seconds the call took.
+        :param throttled: Whether the server throttled the call (HTTP 429).
+        """
+
+
+class AdaptiveRateController(object):
+    """
+    Thread-safe, blocking rate and concurrency limiter that adapts to the server, using additive increase and
+    multiplicative decrease (AIMD).
+
+    While calls succeed with steady latency, the rate grows by `increase` calls per second (and the concurrency limit by
+    one call) every `period`. When a call is throttled (HTTP 429), or the recent latency rises above `latencyTolerance`
+    times its baseline, both are multiplied by `decrease`. Calls already in flight when congestion starts report it too,
+    so there is at most one decrease per `period`. Limits always stay within the configured bounds.
+    """
+
+    def __init__(
+            self,
+            minRate: float = 1.0,
+            maxRate: float = 10.0,
+            initialRate: Optional[float] = None,
+            increase: float = 1.0,
+            decrease: float = 0.5,
+            maxConcurrency: Optional[int] = None,
+            latencyTolerance: float = 2.0,
+            period: float = 1.0,
+            clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        """
+        :param minRate: Lowest rate, in calls per second.
+        :param maxRate: Highest rate, in calls per second.
+        :param initialRate: Rate to start with. Defaults to maxRate.
+        :param increase: Calls per second added to the rate every healthy period.
+        :param decrease: Factor applied to the rate and concurrency limit on congestion, between 0 and 1.
+        :param maxConcurrency: Highest number of calls in flight at once, or None to only limit the rate.
+        :param latencyTolerance: Congestion is assumed when recent latency exceeds its baseline by this factor.
+        :param period: Seconds between two adjustments.
+        :param clock: Monotonic clock, in seconds.
+        """
+        if not 0 < minRate <= maxRate:
+            raise ValueError("minRate must be positive, and at most maxRate.")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1.")
+        if maxConcurrency is not None and maxConcurrency < 1:
+            raise ValueError("maxConcurrency must be at least 1.")
+
+        self._minRate = minRate
+        self._maxRate = maxRate
+        self._increaseStep = increase
+        self._decreaseFactor = decrease
+        self._maxConcurrency = maxConcurrency
+        self._latencyTolerance = latencyTolerance
+        self._period = period
+        self._clock = clock
+        self._condition = threading.Condition()
+
+        self._rate = min(max(initialRate if initialRate is not None else maxRate, minRate), maxRate)
+        self._concurrency = float(maxConcurrency) if maxConcurrency is not None else None
+        self._inFlight = 0
+        # Token bucket holding up to a period's worth of calls
+        self._tokens = 1.0
+        self._refilledAt = clock()
+        self._adjustedAt = self._refilledAt
+        self._decreasedAt: Optional[float] = None
+        # Slow moving average of the latency of healthy calls, and fast moving average of the latency of all calls
+        self._baselineLatency: Optional[float] = None
+        self._recentLatency: Optional[float] = None
+        self._decreases = 0
+
+    @property
+    def rate(self) -> float:
+        """Current number of calls allowed per second."""
+        with self._condition:
+            return self._rate
+
+    @property
+    def concurrency(self) -> Optional[int]:
+        """Current maximum number of calls in flight, or None when only the rate is limited."""
+        with self._condition:
+            return int(self._concurrency) if self._concurrency is not None else None
+
+    @property
+    def inFlight(self) -> int:
+        """Number of calls acquired and not released yet."""
+        with self._condition:
+            return self._inFlight
+
+    @property
+    def decreases(self) -> int:
+        """Number of multiplicative decreases so far."""
+        with self._condition:
+            return self._decreases
+
+    def acquire(self) -> float:
+        """
+        Block until a call is allowed. Every call must be followed by `release`.
+
+        :return: Number of seconds spent waiting.
+        """
+
+        started = self._clock()
+
+        with self._condition:
+            while True:
+                self._refill()
+                slotFree = self._concurrency is None or self._inFlight < int(self._concurrency)
+                if slotFree and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._inFlight += 1
+                    return self._clock() - started
+
+                # Woken up early by `release` when a slot frees up, or the rate changes
+                self._condition.wait((1 - self._tokens) / self._rate if slotFree else None)
+
+    def tryAcquire(self) -> bool:
+        """
+        Take a call if one is allowed right away, without blocking. A successful call must be followed by `release`.
+
+        :return: Whether the call is allowed.
+        """
+
+        with self._condition:
+            self._refill()
+            if (self._concurrency is None or self._inFlight < int(self._concurrency)) and self._tokens >= 1:
+                self._tokens -= 1
+                self._inFlight += 1
+                return True
+            return False
+
+    def release(self, latency: float, throttled: bool = False) -> None:
+        """
+        Reports the outcome of an acquired call, adapting the limits.
+
+        :param latency: Seconds the call took.
+        :param throttled: Whether the server throttled the call (HTTP 429).
+        """
+
+        with self._condition:
+            self._inFlight -= 1
+            now = self._clock()
+
+            congested = self._observeLatency(latency) or throttled
+            if congested:
+                if self._decreasedAt is None or now - self._decreasedAt >= self._period:
+                    self._multiplicativeDecrease(now)
+            elif now - self._adjustedAt >= self._period:
+                self._additiveIncrease(now)
+
+            self._condition.notify_all()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        elapsed = max(now - self._refilledAt, 0.0)
+        self._tokens = min(self._bucketSize(), self._tokens + elapsed * self._rate)
+        self._refilledAt = max(now, self._refilledAt)
+
+    def _bucketSize(self) -> float:
+        return max(self._rate * self._period, 1.0)
+
+    def _additiveIncrease(self, now: float) -> None:
+        self._refill()
+        self._rate = min(self._rate + self._increaseStep, self._maxRate)
+        if self._concurrency is not None:
+            self._concurrency = min(self._concurrency + 1, float(self._maxConcurrency))
+        self._adjustedAt = now
+
+    def _multiplicativeDecrease(self, now: float) -> None:
+        self._refill()
+        self._rate = max(self._rate * self._decreaseFactor, self._minRate)
+        self._tokens = min(self._tokens, self._bucketSize())
+        if self._concurrency is not None:
+            self._concurrency = max(self._concurrency * self._decreaseFactor, 1.0)
+        self._adjustedAt = self._decreasedAt = now
+        self._decreases += 1
+        # Start over measuring recent latency, so a single slow episode causes a single decrease
+        self._recentLatency = self._baselineLatency
+
+    def _observeLatency(self, latency: float) -> bool:
+        """
+        Records the latency of a call.
+
+        :return: Whether the recent latency is above the tolerated multiple of the baseline.
+        """
+
+        if self._baselineLatency is None:
+            self._baselineLatency = self._recentLatency = latency
+            return False
+
+        self._recentLatency = 0.7 * (self._recentLatency or latency) + 0.3 * latency
+        if self._recentLatency > self._baselineLatency * self._latencyTolerance:
+            return True
+
+        # Only healthy calls move the baseline, so it doesn't creep up along with congestion
+        self._baselineLatency = 0.95 * self._baselineLatency + 0.05 * latency
+        return False
@@ -0,0 +1,182 @@
+"""
+Alternative HTTP transports for the Swydo client.
+
+By default, SwydoClient talks to the API using bravado's requests-based client, over HTTP/1.1. The transports here can
+be passed to SwydoClient instead, using its `httpClient` argument.
+"""
+
+import asyncio
+import base64
+import concurrent.futures
+import threading
+from typing import Any, Dict, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+
+from bravado.http_client import HttpClient
+from bravado.http_future import FutureAdapter, HttpFuture
+from bravado_core.response import IncomingResponse
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+
+# ======================================================================================================================
+# Public Members
+# ======================================================================================================================
+
+class HttpxClient(HttpClient):
+    """
+    bravado HTTP client backed by httpx, with HTTP/2 support.
+
+    All calls, from any number of threads, are driven by a single background event loop that owns the connection pool.
+    Over HTTP/2, concurrent calls are multiplexed as streams of a single connection instead of each needing its own
+    TCP+TLS connection. Responses are compressed with gzip, or brotli when the `brotli` package is installed.
+
+    Requires the optional `httpx[http2]` dependency: pip install swydo[http2]
+    """
+
+    def __init__(self, http2: bool = True, **clientOptions: Any) -> None:
+        """
+        :param http2: Negotiate HTTP/2 with the server.
+        :param clientOptions: Extra arguments for httpx.AsyncClient, e.g. `http1=False` to use HTTP/2 over cleartext.
+        """
+
+        if httpx is None:
+            raise ImportError("HttpxClient requires httpx, install it with: pip install swydo[http2]")
+
+        self._authHost: Optional[str] = None
+        self._authHeader: Optional[str] = None
+        self._statsLock = threading.Lock()
+        self._stats = dict(calls=0, bytesReceived=0)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='swydo-httpx', daemon=True)
+        self._thread.start()
+        self._client = self._submit(self._createClient(http2=http2, clientOptions=clientOptions)).result()
+
+    def set_basic_auth(self, host: str, username: str, password: str) -> None:
+        self._authHost = host
+        credentials = ('%s:%s' % (username, password)).encode('utf-8')
+        self._authHeader = 'Basic ' + base64.b64encode(credentials).decode('ascii')
+
+    def request(self, request_params: Any, operation: Any = None, request_config: Any = None) -> HttpFuture:
+        headers = {key: str(value) for key, value in (request_params.get('headers') or {}).items()}
+        if self._authHeader and urlsplit(request_params['url']).hostname == self._authHost:
+            headers['Authorization'] = self._authHeader
+
+        request = dict(
+            method=request_params.get('method', 'GET'),
+            url=request_params['url'],
+            params=request_params.get('params'),
+            headers=headers,
+            content=request_params.get('data'),
+        )
+        timeout = (request_params.get('connect_timeout'), request_params.get('timeout'))
+
+        return HttpFuture(
+            _HttpxFutureAdapter(self._submit(self._send(request, timeout)), timeout[1]),
+            _HttpxResponseAdapter,
+            operation,
+            request_config,
+        )
+
+    def getStats(self) -> Mapping[str, int]:
+        """
+        Returns the number of calls made, and the number of (compressed) bytes received over the wire.
+        """
+
+        with self._statsLock:
+            return dict(self._stats)
+
+    def close(self) -> None:
+        """
+        Closes all connections, and stops the event loop.
+        """
+
+        self._submit(self._client.aclose()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def _submit(self, coroutine: Any) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    async def _createClient(self, http2: bool, clientOptions: Dict[str, Any]) -> Any:
+        return httpx.AsyncClient(http2=http2, **clientOptions)
+
+    async def _send(self, request: Dict[str, Any], timeout: Tuple[Optional[float], Optional[float]]) -> Any:
+        connectTimeout, readTimeout = timeout
+        response = await self._client.request(
+            timeout=httpx.Timeout(readTimeout, connect=connectTimeout) if any(timeout) else httpx.USE_CLIENT_DEFAULT,
+            **request
+        )
+        with self._statsLock:
+            self._stats['calls'] += 1
+            self._stats['bytesReceived'] += response.num_bytes_downloaded
+        return response
+
+
+# ======================================================================================================================
+# Private Members
+# ======================================================================================================================
+
+class _HttpxFutureAdapter(FutureAdapter):
+    """
+    bravado future over a call running on the HttpxClient event loop.
+    """
+
+    timeout_errors = (httpx.TimeoutException, concurrent.futures.TimeoutError) if httpx else ()
+    connection_errors = (httpx.TransportError,) if httpx else ()
+
+    def __init__(self, future: concurrent.futures.Future, requestTimeout: Optional[float]) -> None:
+        self._future = future
+        self._requestTimeout = requestTimeout
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        if self._requestTimeout is not None:
+            timeout = self._requestTimeout if timeout is None else max(timeout, self._requestTimeout)
+
+        try:
+            return self._future.result(timeout=timeout)
+        except self.timeout_errors as te:
+            self._future.cancel()
+            self._raise_timeout_error(te)
+        except self.connection_errors as ce:
+            self._raise_connection_error(ce)
+
+    def cancel(self) -> None:
+        self._future.cancel()
+
+
+class _HttpxResponseAdapter(IncomingResponse):
+    """
+    Wraps an httpx.Response for bravado.
+    """
+
+    def __init__(self, response: Any) -> None:
+        self._delegate = response
+
+    @property
+    def status_code(self) -> int:
+        return self._delegate.status_code
+
+    @property
+    def text(self) -> str:
+        return self._delegate.text
+
+    @property
+    def raw_bytes(self) -> bytes:
+        return self._delegate.content
+
+    @property
+    def reason(self) -> str:
+        return self._delegate.reason_phrase
+
+    @property
+    def headers(self) -> Mapping[str, str]:
+        return self._delegate.headers
+
+    def json(self, **kwargs: Any) -> Any:
+        return self._delegate.json(**kwargs)
@@ -0,0 +1,20 @@
+""" Shared fixtures for the swydo test suite.
+
+"""
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) + '/../src')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from standin import SwydoStandIn
+
+
+@pytest.fixture
+def standIn():
+    """ A running Swydo API stand-in server.
+
+    """
+    server = SwydoStandIn().start()
+    yield server
+    server.stop()
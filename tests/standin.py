@@ -0,0 +1,328 @@
+""" In-memory stand-in for the Swydo API, used by the test suite.
+
+The stand-in implements the subset of the Swydo API described by swydo_api.yml,
+served over plain HTTP on localhost by a threaded server.
+
+"""
+import base64
+import json
+import re
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class SwydoStandIn(object):
+    """ A local, thread-safe Swydo API stand-in server.
+
+    """
+
+    DATA_SOURCE_PROVIDERS = {
+        'facebookAds': 'facebookAds',
+        'facebookGraph': 'facebookGraph',
+        'googleAdwords': 'adwords',
+        'googleAnalytics': 'analytics',
+    }
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        # Number of calls authenticated with each API key
+        self.apiKeys = Counter()
+        self.teams = OrderedDict()
+        self.collections = {}
+        self.dataSources = {}
+        self.latency = 0.0
+        self.failures = Counter()
+        self.throttles = Counter()
+        # Number of upcoming calls of operations that take slowLatency seconds instead of latency
+        self.slowCalls = Counter()
+        self.slowLatency = 1.0
+        # Fields left out of list items, only returned by single entity reads
+        self.detailOnlyFields = set()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _makeHandler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def apiUrl(self):
+        return 'http://127.0.0.1:%d/v1' % self._server.server_address[1]
+
+    @property
+    def totalCalls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def addTeam(self, teamId, clients=0, reports=0, users=0, connections=0, brandTemplates=0, reportTemplates=0):
+        """ Create a team, populated with the given number of entities.
+
+        """
+        with self.lock:
+            self.teams[teamId] = dict(id=teamId, name='Team %s' % teamId, cancelled=False)
+            for kind, count in (('clients', clients), ('reports', reports), ('users', users),
+                                ('connections', connections), ('brandtemplates', brandTemplates),
+                                ('reporttemplates', reportTemplates)):
+                collection = self.collections.setdefault((teamId, kind), OrderedDict())
+                for index in range(count):
+                    entityId = '%s-%s-%05d' % (teamId, kind, index)
+                    collection[entityId] = self._makeEntity(teamId, kind, entityId, index)
+
+    def add(self, teamId, kind, **fields):
+        with self.lock:
+            entityId = fields.pop('id', None) or uuid.uuid4().hex
+            entity = dict(id=entityId, **fields)
+            self.collections.setdefault((teamId, kind), OrderedDict())[entityId] = entity
+            return entity
+
+    def remove(self, teamId, kind, entityId):
+        with self.lock:
+            del self.collections[(teamId, kind)][entityId]
+
+    def _makeEntity(self, teamId, kind, entityId, index):
+        if kind == 'clients':
+            return dict(id=entityId, name='Client %05d' % index, email='client%05d@example.com' % index,
+                        description='', archived=False)
+        if kind == 'reports':
+            return dict(id=entityId, name='Report %05d' % index, clientId='%s-clients-%05d' % (teamId, index % 7),
+                        brandTemplateId='brand-%d' % (index % 3), reportTemplateId='template-%d' % (index % 5),
+                        comparePeriod='previous', authorId='author')
+        if kind == 'users':
+            return dict(id=entityId, name='User %05d' % index, email='user%05d@example.com' % index,
+                        role='member', status='active')
+        if kind == 'connections':
+            return dict(id=entityId, name='Connection %05d' % index, providerId='adwords', userId='author')
+        if kind == 'reporttemplates':
+            return dict(id=entityId, name='Report Template %05d' % index, comparePeriod='previous')
+        return dict(id=entityId, name='Entity %05d' % index)
+
+    # ==================================================================================================================
+    # Request handling
+    # ==================================================================================================================
+
+    def getLatency(self, method, path):
+        """ Return the latency of a request, using up slow calls.
+
+        """
+        with self.lock:
+            operation = '%s %s' % (method, re.sub(r'/teams/[^/]+', '/teams/*', path))
+            if self.slowCalls[operation] > 0:
+                self.slowCalls[operation] -= 1
+                return self.slowLatency
+            return self.latency
+
+    def handle(self, method, path, query, body):
+        """ Dispatch a request, returning a tuple of (status, payload).
+
+        """
+        with self.lock:
+            # Calls are counted per method and path shape, e.g. 'GET /v1/teams/*/clients'
+            operation = '%s %s' % (method, re.sub(r'/teams/[^/]+', '/teams/*', path))
+            self.calls[operation] += 1
+            if self.failures[operation] > 0:
+                self.failures[operation] -= 1
+                return 500, dict(code=500, error='INTERNAL_ERROR', reason='Injected failure')
+            if self.throttles[operation] > 0:
+                self.throttles[operation] -= 1
+                return 429, dict(code=429, error='TOO_MANY_REQUESTS', reason='Injected throttling')
+
+        parts = [part for part in path.split('/') if part][1:]
+        if not parts or parts[0] != 'teams':
+            return 404, dict(code=404, error='NOT_FOUND', reason='Unknown path')
+
+        with self.lock:
+            if len(parts) == 1:
+                return self._list(list(self.teams.values()), query, path)
+
+            teamId = parts[1]
+            if teamId not in self.teams:
+                return 404, dict(code=404, error='TEAM_NOT_FOUND', reason='No such team')
+            if len(parts) == 2:
+                return 200, self.teams[teamId]
+
+            kind = parts[2]
+            collection = self.collections.setdefault((teamId, kind), OrderedDict())
+            if len(parts) == 3:
+                if method == 'GET':
+                    return self._list(list(collection.values()), query, path)
+                entity = dict(body or {}, id=uuid.uuid4().hex)
+                collection[entity['id']] = entity
+                return 200, entity
+
+            entityId = parts[3]
+            if entityId not in collection:
+                return 404, dict(code=404, error='NOT_FOUND', reason='No such entity')
+            entity = collection[entityId]
+
+            if len(parts) == 4:
+                if method == 'GET':
+                    return 200, entity
+                if method == 'PUT':
+                    entity.update(body or {})
+                    return 200, entity
+                del collection[entityId]
+                return 200, None
+
+            action = parts[4]
+            if action in ('archive', 'unarchive'):
+                entity['archived'] = action == 'archive'
+                return 200, None
+            if action == 'share':
+                entity['sharedLink'] = 'https://example.com/%s' % entityId
+                return 200, None
+            if action == 'unshare':
+                entity.pop('sharedLink', None)
+                return 200, None
+            if action == 'datasources':
+                dataSources = self.dataSources.setdefault((teamId, entityId), OrderedDict())
+                if len(parts) == 5:
+                    if not dataSources:
+                        return 404, dict(code=404, error='DATASOURCE_NOT_FOUND', reason='No data sources')
+                    return 200, dict(id=entityId, dataSources=list(dataSources.values()))
+                provider = self.DATA_SOURCE_PROVIDERS[parts[5]]
+                if method == 'POST':
+                    dataSources[provider] = dict(body, providerId=provider)
+                    return 200, dataSources[provider]
+                if provider not in dataSources:
+                    return 404, dict(code=404, error='DATASOURCE_NOT_FOUND', reason='No data source')
+                del dataSources[provider]
+                return 200, None
+
+        return 404, dict(code=404, error='NOT_FOUND', reason='Unknown path')
+
+    def _list(self, items, query, path):
+        skip = int(query.get('skip', ['0'])[0])
+        limit = min(int(query.get('limit', ['50'])[0]), 100)
+        page = [{key: value for key, value in item.items() if key not in self.detailOnlyFields}
+                for item in items[skip:skip + limit]]
+        payload = dict(items=page, total=len(items))
+        if skip + len(page) < len(items):
+            payload['nextUrl'] = '%s?skip=%d&limit=%d' % (path, skip + len(page), limit)
+        return 200, payload
+
+
+def _makeHandler(standIn):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _dispatch(self):
+            split = urlsplit(self.path)
+            authorization = self.headers.get('Authorization') or ''
+            if authorization.startswith('Basic '):
+                with standIn.lock:
+                    standIn.apiKeys[base64.b64decode(authorization[6:]).decode('utf-8').partition(':')[2]] += 1
+            latency = standIn.getLatency(self.command, split.path)
+            if latency:
+                threading.Event().wait(latency)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            status, payload = standIn.handle(self.command, split.path, parse_qs(split.query), body)
+            data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    return Handler
+
+
+class SwydoHTTP2StandIn(object):
+    """ Serves a SwydoStandIn over cleartext HTTP/2 (prior knowledge), gzip-compressing responses.
+
+    Requires the h2 package.
+
+    """
+
+    def __init__(self, standIn):
+        import socket
+        self.standIn = standIn
+        self.connections = 0
+        self.bytesSent = 0
+        self.uncompressedBytes = 0
+        self._socket = socket.create_server(('127.0.0.1', 0))
+        self._thread = None
+        self._closed = False
+
+    @property
+    def apiUrl(self):
+        return 'http://127.0.0.1:%d/v1' % self._socket.getsockname()[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed = True
+        self._socket.close()
+
+    def _serve(self):
+        while not self._closed:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            with self.standIn.lock:
+                self.connections += 1
+            threading.Thread(target=self._serveConnection, args=(connection,), daemon=True).start()
+
+    def _serveConnection(self, sock):
+        import gzip
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        connection = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        connection.initiate_connection()
+        sock.sendall(connection.data_to_send())
+        requests = {}
+
+        while True:
+            data = sock.recv(65535)
+            if not data:
+                break
+            for event in connection.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    requests[event.stream_id] = (dict(event.headers), bytearray())
+                elif isinstance(event, h2.events.DataReceived):
+                    requests[event.stream_id][1].extend(event.data)
+                    connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    headers, body = requests.pop(event.stream_id)
+                    split = urlsplit(headers[b':path'].decode('utf-8'))
+                    status, payload = self.standIn.handle(
+                        headers[b':method'].decode('utf-8'), split.path, parse_qs(split.query),
+                        json.loads(bytes(body)) if body else None)
+                    content = json.dumps(payload).encode('utf-8') if payload is not None else b''
+                    responseHeaders = [(':status', str(status)), ('content-type', 'application/json')]
+                    self.uncompressedBytes += len(content)
+                    if b'gzip' in headers.get(b'accept-encoding', b''):
+                        content = gzip.compress(content)
+                        responseHeaders.append(('content-encoding', 'gzip'))
+                    self.bytesSent += len(content)
+                    responseHeaders.append(('content-length', str(len(content))))
+                    connection.send_headers(event.stream_id, responseHeaders, end_stream=not content)
+                    while content:
+                        chunk = content[:connection.local_settings.max_frame_size]
+                        content = content[len(chunk):]
+                        connection.send_data(event.stream_id, chunk, end_stream=not content)
+            sock.sendall(connection.data_to_send())
+        sock.close()
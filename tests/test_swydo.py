@@ -23,6 +23,1229 @@ def test_version():
     return
 
 
+def test_shared_client_concurrency(standIn):
+    """ Test one client instance shared by 64 threads.
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from swydo import SwydoClient
+
+    for index in range(8):
+        standIn.addTeam('team%d' % index, clients=120 + index, reports=30)
+
+    swydoClient = SwydoClient(apiKey='key', maxCallsPerSecond=1000, apiUrl=standIn.apiUrl)
+
+    def work(index):
+        teamId = 'team%d' % (index % 8)
+        clients = list(swydoClient.getTeamClients(teamId=teamId))
+        report = swydoClient.getTeamReport(teamId=teamId, reportId='%s-reports-%05d' % (teamId, index % 30))
+        return teamId, clients, report
+
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        results = list(executor.map(work, range(256)))
+
+    for teamId, clients, report in results:
+        assert len(clients) == 120 + int(teamId[4:])
+        assert len({client['id'] for client in clients}) == len(clients)
+        assert report['id'].startswith(teamId)
+    return
+
+
+def test_sampled_validation(standIn):
+    """ Test that sampled validation counts schema drift instead of raising.
+
+    """
+    import types
+    from swydo import SwydoClient, Enumerations
+
+    standIn.addTeam('team', clients=3)
+    standIn.add('team', 'clients', id='drifted', name='Drifted', archived='not-a-boolean')
+
+    swydoClient = SwydoClient(
+        apiKey='key',
+        apiUrl=standIn.apiUrl,
+        validationMode=Enumerations.ValidationMode.sampled,
+        validationSampleRate=2,
+    )
+    for _ in range(4):
+        assert swydoClient.getTeamClient(teamId='team', clientId='drifted')['archived'] == 'not-a-boolean'
+    assert swydoClient.getValidationStats() == dict(validated=2, drifted=2)
+
+    # Responses that can't be validated at all count as drift too, without failing the call
+    def raiseDecodeError():
+        raise ValueError('Not JSON')
+
+    operation = swydoClient._getSwaggerClient().teams.getTeamClient.operation
+    swydoClient._validateSampledResponse(types.SimpleNamespace(status_code=200, json=raiseDecodeError), operation)
+    assert swydoClient.getValidationStats() == dict(validated=3, drifted=3)
+    return
+
+
+def test_http2_transport(standIn):
+    """ Test that concurrent calls over HTTP/2 share one compressed connection.
+
+    """
+    pytest.importorskip('h2')
+    pytest.importorskip('httpx')
+    from concurrent.futures import ThreadPoolExecutor
+    from standin import SwydoHTTP2StandIn
+    from swydo import SwydoClient
+    from swydo.transport import HttpxClient
+
+    standIn.addTeam('team', reports=250)
+    http2StandIn = SwydoHTTP2StandIn(standIn).start()
+    httpClient = HttpxClient(http1=False)
+    try:
+        swydoClient = SwydoClient(
+            apiKey='key', maxCallsPerSecond=1000, apiUrl=http2StandIn.apiUrl, httpClient=httpClient, pageSize=50
+        )
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            results = list(executor.map(lambda _: len(list(swydoClient.getTeamReports(teamId='team'))), range(32)))
+    finally:
+        httpClient.close()
+        http2StandIn.stop()
+
+    assert results == [250] * 32
+    assert http2StandIn.connections == 1
+    assert httpClient.getStats()['calls'] == 32 * 5
+    assert http2StandIn.bytesSent * 4 < http2StandIn.uncompressedBytes
+    return
+
+
+def test_cli_export(standIn, tmpdir):
+    """ Test the bulk export command line, including resuming an export.
+
+    """
+    import json
+    from swydo.cli import main, STATE_FILE_NAME
+
+    standIn.addTeam('team1', clients=150, reports=40, brandTemplates=2, reportTemplates=3)
+    standIn.addTeam('team2', clients=5, reports=260)
+    standIn.dataSources[('team1', 'team1-clients-00003')] = {
+        'adwords': dict(providerId='adwords', connectionId='c1', scope=dict(clientId='123', name='Ads')),
+    }
+
+    outputDir = str(tmpdir)
+    arguments = ['--api-key', 'key', '--api-url', standIn.apiUrl, '--output-dir', outputDir, '--quiet',
+                 '--rate', '1000', '--concurrency', '4']
+    assert main(arguments + ['--entities', 'teams,clients,dataSources,templates']) == 0
+    assert len(tmpdir.join('clients.ndjson').readlines()) == 155
+    assert json.loads(tmpdir.join('dataSources.ndjson').read())['scope']['clientId'] == '123'
+
+    # Pretend a reports export died after writing 100 reports of team2
+    cursor = dict(operationId='getTeamReports', params=dict(teamId='team2'), skip=100, seen=100, total=260)
+    with open(os.path.join(outputDir, 'reports.csv'), 'w') as reportsFile:
+        reportsFile.write('teamId,id\n' + ''.join('team2,x\n' for _ in range(100)))
+    with open(os.path.join(outputDir, STATE_FILE_NAME), 'w') as stateFile:
+        json.dump(dict(completed=['reports/team1'], cursors={'reports/team2': cursor}), stateFile)
+
+    calls = standIn.totalCalls
+    assert main(arguments + ['--entities', 'reports', '--format', 'csv', '--team', 'team1', '--team', 'team2',
+                             '--resume']) == 0
+    assert len(tmpdir.join('reports.csv').readlines()) == 1 + 260
+    assert standIn.totalCalls - calls == 2
+    return
+
+
+def test_resume_pagination(standIn):
+    """ Test resuming an interrupted iteration from a persisted cursor.
+
+    """
+    from swydo import SwydoClient, PaginationCursor
+
+    standIn.addTeam('team', reports=230)
+    swydoClient = SwydoClient(apiKey='key', maxCallsPerSecond=1000, apiUrl=standIn.apiUrl)
+
+    reports = swydoClient.getTeamReports(teamId='team')
+    consumed = [next(reports)['id'] for _ in range(120)]
+    persisted = reports.cursor.toJson()
+
+    cursor = PaginationCursor.fromJson(persisted)
+    assert (cursor.operationId, cursor.params) == ('getTeamReports', dict(teamId='team'))
+    assert (cursor.skip, cursor.seen, cursor.total) == (120, 120, 230)
+
+    calls = standIn.totalCalls
+    rest = [report['id'] for report in swydoClient.resumeItems(cursor)]
+    assert consumed + rest == ['team-reports-%05d' % index for index in range(230)]
+    # Pages of 100 items, the page size tuned while listing the first 120
+    assert standIn.totalCalls - calls == 2
+    return
+
+
+def test_stable_pagination(standIn):
+    """ Test that stable pagination stays complete while items are created and deleted.
+
+    """
+    from swydo import SwydoClient
+
+    standIn.addTeam('team', reports=300)
+    reports = standIn.collections[('team', 'reports')]
+    swydoClient = SwydoClient(apiKey='key', maxCallsPerSecond=1000, apiUrl=standIn.apiUrl, paginationOverlap=5)
+
+    def insertAt(position, entityId):
+        entities = list(reports.items())
+        reports.clear()
+        reports.update(entities[:position] + [(entityId, dict(id=entityId, name=entityId))] + entities[position:])
+
+    listed = []
+    for report in swydoClient.getTeamReports(teamId='team'):
+        listed.append(report['id'])
+        if len(listed) == 120:
+            # Shift everything within the overlap: 3 deletions and 2 insertions in the listed range
+            for index in (100, 101, 102):
+                standIn.remove('team', 'reports', 'team-reports-%05d' % index)
+            insertAt(95, 'new1')
+            insertAt(105, 'new2')
+        if len(listed) == 200:
+            # Shift beyond the overlap, and delete an item that was not listed yet
+            for index in list(range(150, 158)) + [250]:
+                standIn.remove('team', 'reports', 'team-reports-%05d' % index)
+
+    assert len(listed) == len(set(listed))
+    assert set(reports) <= set(listed)
+    assert 'team-reports-00250' not in listed
+    # A single pass takes 7 calls - the re-scan only covers the affected range, not the whole listing
+    assert standIn.totalCalls < 2 * 7
+
+    # Pages no longer than the overlap still move forward
+    with pytest.raises(ValueError):
+        SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, pageSize=5, paginationOverlap=5)
+    from swydo import PaginationCursor, StablePageIterator
+    items = [dict(id=str(index)) for index in range(30)]
+    fetches = []
+
+    def fetchPage(params):
+        fetches.append(params['skip'])
+        return dict(items=items[params['skip']:params['skip'] + 5], total=len(items))
+
+    iterator = StablePageIterator(fetchPage, PaginationCursor('getTeamReports', dict(teamId='team'), overlap=5))
+    assert [item['id'] for item in iterator] == [item['id'] for item in items]
+    # The first page is listed again with a reduced overlap, then every page moves forward
+    assert fetches[:2] == [0, 0] and fetches[1:] == sorted(set(fetches[1:]))
+    assert len(fetches) <= 12
+
+    # Only the ids of the last pages are kept while nothing changes
+    items = [dict(id=str(index)) for index in range(1000)]
+    iterator = StablePageIterator(
+        lambda params: dict(items=items[params['skip']:params['skip'] + 50], total=len(items)),
+        PaginationCursor('getTeamReports', dict(teamId='team'), overlap=5)
+    )
+    assert sum(1 for _ in iterator) == 1000 and len(iterator._seenIds) <= 100
+    return
+
+
+def test_rate_limiter_blocks():
+    """ Test that the rate limiter blocks instead of failing.
+
+    """
+    from swydo.throttling import RateLimiter
+
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    limiter = RateLimiter(calls=2, period=1, clock=lambda: now[0], sleep=sleep)
+    assert limiter.acquire() == 0
+    now[0] = 0.25
+    assert limiter.acquire() == 0
+    now[0] = 0.5
+    # Over the limit - wait for the first call to leave the window
+    assert limiter.acquire() == 0.5
+    assert sleeps == [0.5]
+    now[0] = 1.5
+    assert limiter.acquire() == 0
+    assert sleeps == [0.5]
+    return
+
+
+def test_adaptive_rate(standIn):
+    """ Test that the adaptive rate controller increases additively and decreases multiplicatively, within bounds.
+
+    """
+    from swydo import SwydoClient
+    from swydo.throttling import AdaptiveRateController
+
+    # The clock moves forward a second before every call, so acquiring never has to wait
+    now = [0.0]
+    controller = AdaptiveRateController(minRate=2, maxRate=12, initialRate=10, maxConcurrency=4, clock=lambda: now[0])
+
+    def call(latency, throttled=False):
+        now[0] += 1
+        controller.acquire()
+        controller.release(latency=latency, throttled=throttled)
+
+    for _ in range(5):
+        call(0.1)
+    assert controller.rate == 12 and controller.concurrency == 4
+    # Calls in flight during the same congestion episode cut only once
+    now[0] += 1
+    controller.acquire()
+    controller.acquire()
+    assert controller.inFlight == 2
+    controller.release(latency=0.1, throttled=True)
+    controller.release(latency=0.1, throttled=True)
+    assert controller.rate == 6 and controller.concurrency == 2
+    # Rising latency is congestion too
+    call(1.0)
+    assert controller.rate == 3 and controller.concurrency == 1 and controller.decreases == 2
+    for _ in range(10):
+        call(1.0, throttled=True)
+    assert controller.rate == 2 and controller.concurrency == 1
+    assert controller.inFlight == 0
+
+    standIn.addTeam('team', reports=10)
+    standIn.throttles['GET /v1/teams/*'] = 1
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, adaptiveRate=True, maxCallsPerSecond=50,
+                              maxConcurrentCalls=8)
+    assert swydoClient.getCallStats()['rate'] == 10
+    swydoClient.getTeam(teamId='team')
+    stats = swydoClient.getCallStats()
+    assert stats['throttled'] == 1 and stats['rate'] == 5
+    return
+
+
+def test_catalog_refresher(standIn):
+    """ Test that catalogs are served from memory, and refreshed in the background.
+
+    """
+    import time
+    from swydo import SwydoClient, CatalogRefresher
+
+    standIn.addTeam('team', users=3, connections=2, brandTemplates=3, reportTemplates=120)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, maxCallsPerSecond=10)
+    refresher = CatalogRefresher(swydoClient, interval=60, maxAge=0.5, budgetShare=0.2)
+    changes = []
+    refresher.addListener(changes.append)
+    refresher.start(teamIds=['team'])
+    try:
+        # 3 pages of report templates, within 2 calls per second
+        assert time.monotonic() - min(snapshot.fetchedAt for snapshot in changes) >= 1
+        assert len(refresher.getItems('team', 'reportTemplates')) == 120
+        assert sorted(snapshot.catalog for snapshot in changes) == sorted(
+            ['brandTemplates', 'reportTemplates', 'connections', 'users'])
+
+        calls = standIn.totalCalls
+        snapshot = refresher.get('team', 'brandTemplates')
+        assert snapshot.version == 1 and len(snapshot.items) == 3
+        assert standIn.totalCalls == calls
+
+        # A stale read returns the current copy at once, and refreshes it in the background
+        standIn.add('team', 'brandtemplates', id='brand-new', name='New')
+        time.sleep(0.6)
+        assert len(refresher.get('team', 'brandTemplates').items) == 3
+        deadline = time.monotonic() + 5
+        while refresher.get('team', 'brandTemplates').version < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        snapshot = refresher.get('team', 'brandTemplates')
+        assert snapshot.version == 2 and len(snapshot.items) == 4
+        assert changes[-1] is snapshot
+
+        # Refreshes without changes keep the version
+        refresher.refresh('team')
+        refresher.start(wait=True)
+        assert refresher.get('team', 'users').version == 1
+    finally:
+        refresher.stop()
+    return
+
+
+def test_catalog_refresher_budget():
+    """ Test that refreshes take their share of the budget before every page, at the client's current rate.
+
+    """
+    import time
+    from swydo import CatalogRefresher, PageIterator, PaginationCursor
+
+    class Client(object):
+        def __init__(self):
+            self.rate = 10
+            self.fetchedAt = []
+
+        def getCallStats(self):
+            return dict(rate=self.rate)
+
+        def fetchPage(self, params):
+            self.fetchedAt.append(time.monotonic())
+            return dict(items=[dict(id=str(params['skip']))] * 10, total=40)
+
+        def getTeamReportTemplates(self, teamId):
+            cursor = PaginationCursor(operationId='getTeamReportTemplates', params=dict(teamId=teamId))
+            return PageIterator(fetchPage=self.fetchPage, cursor=cursor)
+
+        getTeamBrandTemplates = getTeamConnections = getTeamUsers = getTeamReportTemplates
+
+    client = Client()
+    refresher = CatalogRefresher(client, catalogs=['reportTemplates'], interval=60, budgetShare=0.2)
+    try:
+        # 4 pages at 2 calls per second, the first two of them right away
+        refresher.start(teamIds=['team'])
+        assert len(refresher.getItems('team', 'reportTemplates')) == 40
+        fetchedAt = client.fetchedAt
+        assert len(fetchedAt) == 4
+        assert fetchedAt[2] - fetchedAt[0] >= 0.95 and fetchedAt[3] - fetchedAt[1] >= 0.95
+
+        # A lower rate of the client takes effect on the next refresh
+        client.rate = 5
+        time.sleep(1)
+        client.fetchedAt = []
+        refresher.refresh()
+        refresher.start(wait=True)
+        fetchedAt = client.fetchedAt
+        assert len(fetchedAt) == 4
+        assert all(later - earlier >= 0.95 for earlier, later in zip(fetchedAt, fetchedAt[1:]))
+    finally:
+        refresher.stop()
+    return
+
+
+def test_local_index(standIn):
+    """ Test that the local index answers lookups without API calls, and follows mutations.
+
+    """
+    from swydo import SwydoClient, LocalIndex, Enumerations
+
+    standIn.addTeam('team', clients=10, reports=40)
+    standIn.addTeam('other', clients=3)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl)
+    index = LocalIndex().attach(swydoClient)
+
+    list(swydoClient.getTeamClients(teamId='team'))
+    list(swydoClient.getTeamClients(teamId='other'))
+    list(swydoClient.getTeamReports(teamId='team'))
+    swydoClient.setClientDataSourceGoogleAdWords(
+        teamId='team', clientId='team-clients-00001', connectionId='conn-1', dataSourceClientId='a',
+        dataSourceName='A')
+    swydoClient.setClientDataSourceFacebookAds(
+        teamId='team', clientId='team-clients-00002', connectionId='conn-1', dataSourceId='b', dataSourceName='B')
+    swydoClient.getClientDataSources(teamId='team', clientId='team-clients-00003')
+    calls = standIn.totalCalls
+
+    assert [report['id'] for report in index.getReportsByClient('team', 'team-clients-00000')] == \
+        ['team-reports-%05d' % i for i in range(0, 40, 7)]
+    assert len(index.getReportsByReportTemplate('team', 'template-1')) == 8
+    assert len(index.getReportsByBrandTemplate('team', 'brand-2')) == 13
+    assert index.getClientIdsByConnection('team', 'conn-1') == {'team-clients-00001', 'team-clients-00002'}
+    assert [client['id'] for client in index.findClients('team', 'CLIENT 0000')] == \
+        ['team-clients-%05d' % i for i in range(10)]
+    assert [client['id'] for client in index.findClients('team', 'client00003@')] == ['team-clients-00003']
+    assert index.findClients('other', 'Client 0000', limit=2)[1]['id'] == 'other-clients-00001'
+    assert standIn.totalCalls == calls
+
+    # Mutations keep the indexes current
+    swydoClient.removeClientDataSourceGoogleAdWords(teamId='team', clientId='team-clients-00001')
+    assert index.getClientIdsByConnection('team', 'conn-1') == {'team-clients-00002'}
+    report = swydoClient.createTeamReport(
+        teamId='team', name='Fresh', clientId='team-clients-00000', brandTemplateId='brand-0',
+        reportTemplateId='template-0', comparePeriod=Enumerations.ComparePeriod.previous)
+    assert report['id'] in [r['id'] for r in index.getReportsByClient('team', 'team-clients-00000')]
+    swydoClient.updateTeamReport(teamId='team', reportId=report['id'], clientId='team-clients-00001')
+    assert report['id'] in [r['id'] for r in index.getReportsByClient('team', 'team-clients-00001')]
+    assert report['id'] not in [r['id'] for r in index.getReportsByClient('team', 'team-clients-00000')]
+    swydoClient.deleteTeamReport(teamId='team', reportId=report['id'])
+    assert index.getReport('team', report['id']) is None
+    swydoClient.updateTeamClient(teamId='team', clientId='team-clients-00004', name='Acme')
+    assert [client['id'] for client in index.findClients('team', 'acm')] == ['team-clients-00004']
+    assert index.findClients('team', 'Client 00004') == []
+    return
+
+
+def test_lazy_details(standIn):
+    """ Test that lazy list items fetch details only when needed, batched and coalesced.
+
+    """
+    import threading
+    import time
+    from swydo import SwydoClient, LazyItem, prefetch
+
+    standIn.addTeam('team', clients=30)
+    standIn.detailOnlyFields = {'description', 'archived'}
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, maxCallsPerSecond=1000)
+
+    clients = list(swydoClient.getTeamClients(teamId='team', lazyDetails=True))
+    assert all(isinstance(client, LazyItem) for client in clients)
+    assert [client['name'] for client in clients] == ['Client %05d' % i for i in range(30)]
+    assert standIn.calls['GET /v1/teams/*/clients/team-clients-00000'] == 0
+    assert standIn.totalCalls == 1
+
+    # Concurrent accesses to the same item share one call
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(clients[0]['archived'])) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [False] * 8
+    assert standIn.calls['GET /v1/teams/*/clients/team-clients-00000'] == 1
+    assert clients[0].hydrated and not clients[1].hydrated
+    with pytest.raises(KeyError):
+        clients[0]['missing']
+
+    # Prefetched items are fetched concurrently, and accessing them doesn't call again
+    standIn.latency = 0.2
+    started = time.monotonic()
+    prefetch(clients[1:9])
+    assert [client['description'] for client in clients[1:9]] == [''] * 8
+    assert time.monotonic() - started < 4 * 0.2
+    assert standIn.totalCalls == 1 + 1 + 8
+    return
+
+
+def test_typed_models(standIn):
+    """ Test the typed models, and benchmark their memory use against the dict output.
+
+    """
+    import gc
+    import json
+    import subprocess
+    import tracemalloc
+    from swydo import SwydoClient
+    from swydo.models import Report, MODELS
+
+    # Importing swydo leaves the spec alone, until a model is used
+    subprocess.run([sys.executable, '-c', (
+        'import swydo, swydo.models; assert "MODELS" not in vars(swydo.models); swydo.models.Report'
+    )], check=True, env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)) + '/../src'))
+    assert set(MODELS) >= {'Team', 'User', 'Client', 'DataSource', 'Report', 'ReportTemplate', 'BrandTemplate'}
+    assert 'comparePeriod' in Report.FIELDS and not hasattr(Report(id='x'), '__dict__')
+
+    standIn.addTeam('team', reports=30)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, typedModels=True)
+    reports = list(swydoClient.getTeamReports(teamId='team'))
+    assert all(isinstance(report, Report) for report in reports)
+    assert reports[1].clientId == 'team-clients-00001' and reports[1]['name'] == 'Report 00001'
+    assert reports[0].comparePeriod is reports[29].comparePeriod
+    assert reports[0].toDict() == standIn.collections[('team', 'reports')]['team-reports-00000']
+    extra = Report.fromDict(dict(id='r', unknown=1))
+    assert extra.toDict() == dict(id='r', unknown=1) and extra.get('subtitle') is None
+
+    # Memory benchmark: 20k reports, decoded from JSON like the API responses
+    wire = json.dumps([dict(id='report-%06d' % i, name='Report %d' % i, clientId='client-%03d' % (i % 500),
+                            brandTemplateId='brand-%d' % (i % 3), reportTemplateId='template-%d' % (i % 20),
+                            comparePeriod='previous', authorId='author-%d' % (i % 10), subtitle='')
+                       for i in range(20000)])
+
+    def measure(convert):
+        gc.collect()
+        tracemalloc.start()
+        items = convert(json.loads(wire))
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(items) == 20000
+        return size
+
+    dictSize = measure(lambda items: items)
+    modelSize = measure(lambda items: [Report.fromDict(item) for item in items])
+    assert modelSize < dictSize * 0.6
+    return
+
+
+def test_columnar_export(standIn, tmp_path):
+    """ Test streaming list methods into columnar batches, and the CSV, NumPy and Arrow/Parquet exports.
+
+    """
+    import csv
+    from swydo import SwydoClient
+    from swydo.columnar import ColumnarExporter, iterateColumns, numpy, pyarrow
+    from swydo.models import DataSource, Report
+
+    standIn.addTeam('team', reports=25, clients=3)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, pageSize=10, maxCallsPerSecond=1000)
+    exporter = ColumnarExporter(swydoClient, batchSize=10)
+
+    batches = list(iterateColumns(swydoClient.getTeamReports(teamId='team'), Report, batchSize=10))
+    assert [len(batch['id']) for batch in batches] == [10, 10, 5]
+    assert list(batches[0]) == list(Report.FIELDS) and batches[2]['name'][-1] == 'Report 00024'
+    assert batches[0]['sharedLink'] == [None] * 10
+    dataSources = [dict(providerId='adwords', scope=dict(b=1, a=[2]))]
+    assert next(iterateColumns(dataSources, DataSource))['scope'] == ['{"a": [2], "b": 1}']
+
+    path = exporter.export('reports', str(tmp_path / 'reports'), teamId='team')
+    if pyarrow is None:
+        with open(path, encoding='utf-8', newline='') as stream:
+            rows = list(csv.DictReader(stream))
+        assert path.endswith('.csv') and len(rows) == 25
+        assert rows[3]['clientId'] == 'team-clients-00003' and rows[3]['sharedLink'] == ''
+    else:
+        table = pyarrow.parquet.read_table(path)
+        assert table.num_rows == 25 and table.schema.names == list(Report.FIELDS)
+        batches = list(exporter.recordBatches('clients', teamId='team'))
+        assert batches[0].schema.field('archived').type == pyarrow.bool_()
+
+    if numpy is not None:
+        clients = exporter.toNumpy('clients', teamId='team')
+        assert clients.dtype.names == ('id', 'archived', 'description', 'email', 'name') and len(clients) == 3
+        assert clients['name'][2] == 'Client 00002'
+
+    with pytest.raises(ValueError):
+        exporter.toCsv('reports', stream=None)
+    return
+
+
+def test_reconcile_data_sources(standIn):
+    """ Test that reconciling data sources only makes the calls needed, and that dry runs make none.
+
+    """
+    from swydo import SwydoClient
+    from swydo.reconcile import DataSourceReconciler
+
+    standIn.addTeam('team', clients=4)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, maxCallsPerSecond=1000)
+    adwords = dict(connectionId='conn-1', scope=dict(clientId='123-456-7890', name='Account'))
+    swydoClient.setClientDataSourceGoogleAdWords(
+        teamId='team', clientId='team-clients-00000', connectionId='conn-1', dataSourceClientId='123-456-7890',
+        dataSourceName='Account')
+    swydoClient.setClientDataSourceGoogleAdWords(
+        teamId='team', clientId='team-clients-00001', connectionId='conn-old', dataSourceClientId='123-456-7890',
+        dataSourceName='Account')
+    swydoClient.setClientDataSourceFacebookAds(
+        teamId='team', clientId='team-clients-00002', connectionId='conn-2', dataSourceId='act_1',
+        dataSourceName='Ads')
+    desired = {
+        'team-clients-00000': dict(adwords=adwords),
+        'team-clients-00001': dict(adwords=adwords),
+        'team-clients-00002': dict(facebookAds=None, adwords=adwords),
+        'team-clients-00003': dict(facebookAds=None),
+    }
+    standIn.calls.clear()
+
+    reconciler = DataSourceReconciler(swydoClient, maxConcurrency=4)
+    plan = reconciler.reconcile(teamId='team', desired=desired, dryRun=True)
+    assert [(change.provider, change.action) for change in plan['team-clients-00002'].changes] == \
+        [('facebookAds', 'remove'), ('adwords', 'set')]
+    assert [len(result.changes) for result in plan.values()] == [0, 1, 2, 0]
+    assert sum(standIn.calls.values()) == 4 and not any(key.startswith('POST') for key in standIn.calls)
+
+    results = reconciler.reconcile(teamId='team', desired=desired)
+    assert all(result.ok and result.applied == result.changes for result in results.values())
+    assert standIn.calls['POST /v1/teams/*/clients/team-clients-00001/datasources/googleAdwords'] == 1
+    assert standIn.calls['DELETE /v1/teams/*/clients/team-clients-00002/datasources/facebookAds'] == 1
+    assert sum(standIn.calls.values()) == 4 + 4 + 3
+    assert standIn.dataSources[('team', 'team-clients-00001')]['adwords']['connectionId'] == 'conn-1'
+
+    # Reconciled clients need no further calls
+    assert all(not result.changes for result in reconciler.plan(teamId='team', desired=desired).values())
+
+    with pytest.raises(ValueError):
+        reconciler.plan(teamId='team', desired={'team-clients-00000': dict(adwords=dict(connectionId='c', scope=dict(
+            accountId='1')))})
+    return
+
+
+def test_onboarding_workflows(standIn):
+    """ Test that onboarding runs the steps of clients concurrently, retries idempotent steps, and skips dependents of
+    failed steps.
+
+    """
+    import time
+    import types
+    from bravado.exception import HTTPInternalServerError
+    from swydo import SwydoClient
+    from swydo.onboarding import ClientOnboarder, OnboardingSpec, Step, WorkflowExecutor
+
+    standIn.addTeam('team')
+    standIn.latency = 0.05
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, maxCallsPerSecond=1000)
+    report = dict(name='Monthly', brandTemplateId='brand', reportTemplateId='template')
+    specs = [
+        OnboardingSpec(teamId='team', name='Client %d' % index, report=report, dataSources=dict(
+            adwords=dict(connectionId='conn-1', scope=dict(clientId='123-456-789%d' % index, name='Ads')),
+            facebookAds=dict(connectionId='conn-2', scope=dict(id='act_%d' % index, name='Facebook')),
+        ))
+        for index in range(6)
+    ]
+    # The first report creation fails, and is not retried
+    standIn.failures['POST /v1/teams/*/reports'] = 1
+
+    started = time.monotonic()
+    results = ClientOnboarder(swydoClient, maxConcurrency=8).onboard(specs)
+    elapsed = time.monotonic() - started
+    # 6 clients of 5 steps, 4 deep, done in far less than their 30 sequential calls
+    assert elapsed < 30 * 0.05 * 0.6
+    assert [result.key for result in results] == specs
+    assert sum(result.ok for result in results) == 5
+    failed = next(result for result in results if not result.ok)
+    assert list(failed.errors) == ['report'] and failed.skipped == ['share']
+    assert set(failed.results) == {'client', 'dataSource:adwords', 'dataSource:facebookAds'}
+
+    clients = standIn.collections[('team', 'clients')]
+    assert sorted(client['name'] for client in clients.values()) == ['Client %d' % index for index in range(6)]
+    for result in results:
+        clientId = result.results['client']['id']
+        assert standIn.dataSources[('team', clientId)]['adwords']['connectionId'] == 'conn-1'
+        if result.ok:
+            assert standIn.collections[('team', 'reports')][result.results['report']['id']]['sharedLink']
+
+    # Retries of steps on server errors, and validation of the DAG
+    attempts = []
+
+    def flaky(results):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise HTTPInternalServerError(response=types.SimpleNamespace(status_code=500, reason='Error', text=''))
+        return results['first'] + 1
+
+    sleeps = []
+    executor = WorkflowExecutor(maxConcurrency=2, retryDelay=0.1, sleep=sleeps.append)
+    result, = executor.run([[Step('second', flaky, dependsOn=['first'], maxAttempts=3), Step('first', lambda _: 1)]])
+    assert result.ok and result.results['second'] == 2 and result.attempts == dict(first=1, second=3)
+    assert sleeps == [0.1, 0.2]
+    with pytest.raises(ValueError):
+        executor.run([[Step('a', lambda _: 1, dependsOn=['b']), Step('b', lambda _: 1, dependsOn=['a'])]])
+    return
+
+
+def test_hedged_requests(standIn):
+    """ Test that slow idempotent calls are hedged when the rate budget allows, and that hedging reports its cost.
+
+    """
+    import contextvars
+    import time
+    from swydo import SwydoClient
+    from swydo.hedging import RequestHedger
+
+    standIn.addTeam('team', clients=1)
+    standIn.latency = 0.01
+    hedger = RequestHedger(percentile=99, minSamples=10, maxHedgeRatio=0.5)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, maxCallsPerSecond=1000, hedger=hedger)
+    for _ in range(20):
+        swydoClient.getTeamClient(teamId='team', clientId='team-clients-00000')
+    assert hedger.getDelay('getTeamClient') < 0.5
+    before = hedger.getStats()
+
+    # A call stuck on the server is overtaken by its hedge, once it times out
+    standIn.slowCalls['GET /v1/teams/*/clients/team-clients-00000'] = 1
+    standIn.slowLatency = 0.6
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, maxCallsPerSecond=1000, hedger=hedger, timeout=0.3)
+    started = time.monotonic()
+    client = swydoClient.getTeamClient(teamId='team', clientId='team-clients-00000')
+    assert client['id'] == 'team-clients-00000' and time.monotonic() - started < 0.5
+    stats = hedger.getStats()
+    assert stats['hedged'] == before['hedged'] + 1 and stats['hedgeWins'] == before['hedgeWins'] + 1
+    assert stats['calls'] == 21 and stats['extraCallRatio'] == stats['hedged'] / 21
+    assert stats['getTeamClient.p50'] < stats['getTeamClient.p99']
+    # The overtaken call still completes, in the background
+    time.sleep(0.7)
+    assert standIn.calls['GET /v1/teams/*/clients/team-clients-00000'] == 21 + stats['hedged']
+    # Lists are not hedged
+    assert not hedger.isHedged('getTeamClients')
+
+    # Without budget to spare, the slow call is waited for
+    slow = RequestHedger(minSamples=1, minDelay=0.01, maxHedgeRatio=1)
+    slow.latencies.record('op', 0.01)
+    assert slow.call('op', invoke=lambda: time.sleep(0.1) or 'done', tryAcquire=lambda: False,
+                     release=lambda latency, throttled: None) == 'done'
+    assert slow.getStats()['skippedNoBudget'] == 1 and slow.getStats()['hedged'] == 0
+
+    # Hedges run in the context of the call, e.g. its deadline
+    variable = contextvars.ContextVar('variable')
+    variable.set('caller')
+    assert slow.call('op', invoke=lambda: time.sleep(0.4) or 1 / 0, tryAcquire=lambda: True,
+                     release=lambda latency, throttled: None, invokeHedge=variable.get) == 'caller'
+    assert slow.getStats()['hedgeWins'] == 1
+    return
+
+
+def test_retry_policy_and_deadlines(standIn):
+    """ Test retries of idempotent calls on server errors, and that deadlines cap timeouts and retries.
+
+    """
+    import time
+    import types
+    from bravado.exception import HTTPInternalServerError, HTTPNotFound, HTTPTooManyRequests
+    from swydo import SwydoClient, RetryPolicy, DeadlineExceeded, deadline
+
+    policy = RetryPolicy(initialDelay=0.5, maxDelay=2, maxAttempts=5, maxTime=None, jitter=None)
+    serverError = HTTPInternalServerError(response=types.SimpleNamespace(status_code=500, reason='Error', text=''))
+    assert [policy.getRetryDelay(serverError, idempotent=True, attempt=attempt, elapsed=0) for attempt in range(1, 6)] \
+        == [0.5, 1, 2, 2, None]
+    assert policy.getRetryDelay(serverError, idempotent=False, attempt=1, elapsed=0) is None
+    throttled = HTTPTooManyRequests(response=types.SimpleNamespace(status_code=429, reason='Error', text=''))
+    assert RetryPolicy(jitter='full', rng=lambda: 0.25).getRetryDelay(throttled, False, attempt=3, elapsed=9.5) == 0.5
+
+    standIn.addTeam('team', clients=1)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, maxCallsPerSecond=1000,
+                              retryPolicy=RetryPolicy(initialDelay=0.01))
+    path = '/v1/teams/*/clients/team-clients-00000'
+
+    # Reads are retried on server errors, creations are not
+    standIn.failures['GET ' + path] = 2
+    assert swydoClient.getTeamClient(teamId='team', clientId='team-clients-00000')['id'] == 'team-clients-00000'
+    assert standIn.calls['GET ' + path] == 3 and swydoClient.getCallStats()['retried'] == 2
+    standIn.failures['POST /v1/teams/*/clients'] = 1
+    with pytest.raises(HTTPInternalServerError):
+        swydoClient.createTeamClient(teamId='team', name='New')
+    assert standIn.calls['POST /v1/teams/*/clients'] == 1
+
+    # A deadline caps the HTTP timeout, instead of waiting for a stuck call
+    standIn.slowCalls['GET ' + path] = 1
+    standIn.slowLatency = 2.0
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded), deadline(0.3):
+        swydoClient.getTeamClient(teamId='team', clientId='team-clients-00000')
+    assert time.monotonic() - started < 1.0
+
+    # A deadline caps the retries, and an expired one fails without calling
+    standIn.failures['GET ' + path] = 100
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded), deadline(0.2):
+        swydoClient.getTeamClient(teamId='team', clientId='team-clients-00000')
+    assert time.monotonic() - started < 0.5
+    standIn.failures.clear()
+    calls = standIn.totalCalls
+    with pytest.raises(DeadlineExceeded), deadline(0):
+        swydoClient.getTeam(teamId='team')
+    assert standIn.totalCalls == calls
+
+    # Errors that are not retried are raised as they are, even past the deadline
+    def respondLate():
+        time.sleep(0.1)
+        raise HTTPNotFound(response=types.SimpleNamespace(status_code=404, reason='Not Found', text=''))
+
+    class LateOperation(object):
+        operation = types.SimpleNamespace(operation_id='getTeam', http_method='get')
+
+        def __call__(self, **params):
+            return types.SimpleNamespace(result=respondLate)
+
+    with pytest.raises(HTTPNotFound), deadline(0.05):
+        swydoClient._makeSwydoAPICall(apiFunction=LateOperation(), params=dict(teamId='missing'))
+    return
+
+
+def test_circuit_breaker(standIn):
+    """ Test that calls fail fast while Swydo keeps failing, and that trial calls close the circuit again.
+
+    """
+    import time
+    from bravado.exception import HTTPInternalServerError, HTTPNotFound
+    from swydo import SwydoClient, RetryPolicy, DeadlineExceeded, deadline
+    from swydo.circuit import CircuitBreaker, CircuitOpenError
+
+    standIn.addTeam('team')
+    breaker = CircuitBreaker(failureRate=0.5, minimumCalls=4, windowSize=10, openDuration=0.3)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, maxCallsPerSecond=1000,
+                              retryPolicy=RetryPolicy(maxAttempts=1), circuitBreaker=breaker)
+
+    # Client errors mean the server is up
+    for _ in range(4):
+        with pytest.raises(HTTPNotFound):
+            swydoClient.getTeam(teamId='missing')
+    assert breaker.getState('127.0.0.1') == CircuitBreaker.CLOSED
+
+    standIn.failures['GET /v1/teams/*'] = 100
+    for _ in range(4):
+        with pytest.raises(HTTPInternalServerError):
+            swydoClient.getTeam(teamId='team')
+    assert breaker.getState('127.0.0.1') == CircuitBreaker.OPEN
+
+    calls = standIn.totalCalls
+    started = time.monotonic()
+    for _ in range(100):
+        with pytest.raises(CircuitOpenError):
+            swydoClient.getTeam(teamId='team')
+    assert time.monotonic() - started < 0.1 and standIn.totalCalls == calls
+    assert breaker.getStats()['127.0.0.1']['rejected'] == 100
+
+    # A failed trial opens the circuit again, a successful one closes it
+    time.sleep(0.3)
+    assert breaker.getState('127.0.0.1') == CircuitBreaker.HALF_OPEN
+    with pytest.raises(HTTPInternalServerError):
+        swydoClient.getTeam(teamId='team')
+    assert breaker.getState('127.0.0.1') == CircuitBreaker.OPEN
+    standIn.failures.clear()
+    time.sleep(0.3)
+    # A trial that runs out of its deadline before being sent neither closes nor opens the circuit
+    with pytest.raises(DeadlineExceeded), deadline(0):
+        swydoClient.getTeam(teamId='team')
+    assert breaker.getState('127.0.0.1') == CircuitBreaker.HALF_OPEN
+    assert swydoClient.getTeam(teamId='team')['id'] == 'team'
+    assert breaker.getState('127.0.0.1') == CircuitBreaker.CLOSED
+    assert breaker.getStats()['127.0.0.1']['opened'] == 2
+    return
+
+
+def test_call_budget_planner(standIn):
+    """ Test estimating the calls and wall time of jobs from probe calls.
+
+    """
+    from swydo import SwydoClient
+    from swydo.planner import CallBudgetPlanner
+
+    standIn.addTeam('team', clients=30, reports=120, users=3)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, pageSize=50)
+    assert swydoClient.countItems('getTeamReports', teamId='team') == 120
+    standIn.calls.clear()
+
+    planner = CallBudgetPlanner(swydoClient, latency=0.25)
+    listing = planner.enumerateTeam('team', entities=('clients', 'reports', 'users'), dataSources=True)
+    assert standIn.totalCalls == listing.probeCalls == 3
+    assert listing.breakdown == dict(getTeamClients=1, getTeamReports=3, getTeamUsers=1, getClientDataSources=30)
+    assert listing.calls == 35 and listing.seconds == 3.5 and listing.concurrency == 3
+    assert listing.secondsAt(1) == 35 * 0.25
+    assert listing.forTarget(7) == dict(rate=5, concurrency=2, feasible=True)
+    assert not listing.forTarget(1)['feasible']
+
+    onboard = planner.onboardClients(10, dataSourcesPerClient=2)
+    assert onboard.calls == 10 + 20 + 10 + 10
+    sync = planner.syncDataSources('team', providersPerClient=2, changeRate=0.5)
+    assert sync.breakdown == dict(getClientDataSources=30, setClientDataSource=30) and standIn.totalCalls == 4
+    schedule = planner.schedule([onboard, listing, sync])
+    assert [entry['estimate'] for entry in schedule] == [listing, onboard, sync]
+    assert schedule[2]['finishesAt'] == (35 + 50 + 60) / 10
+    assert (listing + sync).calls == 95
+
+    # Without a page size, listings follow the page size tuner: pages of 50 and 100, or of 20, 40 and 80 once slow
+    tunedClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl)
+    tunedPlanner = CallBudgetPlanner(tunedClient)
+    assert tunedPlanner.enumerateTeam('team', entities=('reports',)).breakdown == dict(getTeamReports=2)
+    tunedClient.pageSizeTuner.observe('getTeamReports', pageSize=100, items=100, seconds=5, size=1000)
+    assert tunedPlanner.enumerateTeam('team', entities=('reports',)).breakdown == dict(getTeamReports=3)
+    # Stable pagination keeps the server default
+    stableClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, paginationOverlap=5)
+    assert stableClient.pageSizeTuner is None
+    assert CallBudgetPlanner(stableClient).enumerateTeam('team', entities=('reports',)).breakdown == dict(
+        getTeamReports=3)
+    return
+
+
+def test_shared_response_cache(standIn, tmp_path):
+    """ Test sharing cached responses between clients and processes.
+
+    """
+    import subprocess
+    import threading
+    from swydo import SwydoClient
+    from swydo.cache import SharedResponseCache
+
+    standIn.addTeam('team', clients=3)
+    path = str(tmp_path / 'responses')
+    # Two workers, each with its own mapping of the cache file
+    first = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, responseCache=SharedResponseCache(path))
+    second = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, responseCache=SharedResponseCache(path))
+    client = first.getTeamClient(teamId='team', clientId='team-clients-00001')
+    assert second.getTeamClient(teamId='team', clientId='team-clients-00001') == client
+    assert standIn.calls['GET /v1/teams/*/clients/team-clients-00001'] == 1
+
+    # Writes drop the responses they make stale, for all workers
+    second.updateTeamClient(teamId='team', clientId='team-clients-00001', name='Acme')
+    assert first.getTeamClient(teamId='team', clientId='team-clients-00001')['name'] == 'Acme'
+    assert standIn.calls['GET /v1/teams/*/clients/team-clients-00001'] == 2
+
+    # Other API keys don't see the entries
+    other = SwydoClient(apiKey='other', apiUrl=standIn.apiUrl, responseCache=SharedResponseCache(path))
+    other.getTeamClient(teamId='team', clientId='team-clients-00001')
+    assert standIn.calls['GET /v1/teams/*/clients/team-clients-00001'] == 3
+
+    cache = SharedResponseCache(path)
+    subprocess.run([sys.executable, '-c', (
+        'from swydo.cache import SharedResponseCache; cache = SharedResponseCache(%r); '
+        'cache.set(cache.makeKey("ns", "getTeam", dict(teamId="t")), dict(id="t"))' % path
+    )], check=True, env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)) + '/../src'))
+    assert cache.get(cache.makeKey('ns', 'getTeam', dict(teamId='t'))) == dict(id='t')
+    with pytest.raises(ValueError):
+        SharedResponseCache(path, slotSize=1024)
+
+    # Instances of the same path in a process exclude each other, and closing one keeps the locks of the others
+    SharedResponseCache(path).close()
+    key = cache.makeKey('ns', 'getTeam', dict(teamId='u'))
+    writer = threading.Thread(target=SharedResponseCache(path).set, args=(key, dict(id='u')))
+    with cache._lockSet(cache._getSetIndex(key)):
+        writer.start()
+        writer.join(0.2)
+        assert writer.is_alive()
+    writer.join()
+    assert cache.get(key) == dict(id='u')
+
+    # Expiry, least recently used eviction, and values too large for a slot
+    now = [0.0]
+    small = SharedResponseCache(str(tmp_path / 'small'), maxEntries=2, ways=2, slotSize=512, ttl=10,
+                                clock=lambda: now[0])
+    keys = [small.makeKey('ns', 'getTeam', dict(teamId=str(index))) for index in range(3)]
+    for key in keys[:2]:
+        now[0] += 1
+        assert small.set(key, dict(id=key.hex()))
+    now[0] += 1
+    assert small.get(keys[0])
+    assert small.set(keys[2], 'third') and small.get(keys[1]) is None and small.get(keys[0])
+    assert not small.set(keys[1], os.urandom(1000).hex()) and small.set(keys[1], 'x' * 10000)
+    now[0] += 10
+    assert small.get(keys[1]) is None
+    assert small.getStats()['evictions'] == 2 and small.getStats()['tooLarge'] == 1
+    return
+
+
+def test_credential_rotation(standIn, tmp_path):
+    """ Test rotating the API key of a client at runtime.
+
+    """
+    from swydo import SwydoClient
+    from swydo.cache import SharedResponseCache
+    from swydo.credentials import FileCredentials, RotatingCredentials, StaticCredentials
+
+    standIn.addTeam('team', clients=2)
+    with pytest.raises(ValueError):
+        SwydoClient(apiUrl=standIn.apiUrl)
+
+    credentials = RotatingCredentials('old', account='acme')
+    swydoClient = SwydoClient(credentials=credentials, apiUrl=standIn.apiUrl,
+                              responseCache=SharedResponseCache(str(tmp_path / 'responses')))
+    swydoClient.getTeamClient(teamId='team', clientId='team-clients-00000')
+    credentials.rotate('new')
+    list(swydoClient.getTeamClients(teamId='team'))
+    assert standIn.apiKeys == dict(old=1, new=1)
+    # Responses cached for the account survive the rotation, not a switch to another account
+    swydoClient.getTeamClient(teamId='team', clientId='team-clients-00000')
+    assert standIn.apiKeys == dict(old=1, new=1)
+    credentials.rotate('other', account='other')
+    swydoClient.getTeamClient(teamId='team', clientId='team-clients-00000')
+    assert standIn.apiKeys['other'] == 1
+
+    swydoClient.setCredentials(StaticCredentials('static'))
+    swydoClient.getTeam(teamId='team')
+    assert standIn.apiKeys['static'] == 1
+
+    now = [0.0]
+    keyFile = tmp_path / 'key'
+    keyFile.write_text('first\n')
+    fileCredentials = FileCredentials(str(keyFile), checkInterval=10, clock=lambda: now[0])
+    keyFile.write_text('second')
+    os.utime(str(keyFile), ns=(0, 1))
+    assert fileCredentials.getApiKey() == 'first'
+    now[0] += 10
+    assert fileCredentials.getApiKey() == 'second'
+    keyFile.unlink()
+    now[0] += 10
+    assert fileCredentials.getApiKey() == 'second'
+    return
+
+
+def test_write_coalescing(standIn):
+    """ Test merging successive updates of an entity into a single call.
+
+    """
+    import subprocess
+    from swydo import SwydoClient
+    from swydo.coalescing import WriteCoalescer
+
+    standIn.addTeam('team', clients=2, reports=1)
+    coalescer = WriteCoalescer(window=0.3)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, writeCoalescer=coalescer)
+    clientId, reportId = 'team-clients-00000', 'team-reports-00000'
+    first = swydoClient.updateTeamClient(teamId='team', clientId=clientId, name='Acme')
+    second = swydoClient.updateTeamClient(teamId='team', clientId=clientId, description='Widgets')
+    swydoClient.updateTeamClient(teamId='team', clientId=clientId, name='Acme Inc')
+    assert first is second and standIn.calls['PUT /v1/teams/*/clients/%s' % clientId] == 0
+
+    # Read-your-writes, before the update is sent
+    client = swydoClient.getTeamClient(teamId='team', clientId=clientId)
+    assert client['name'] == 'Acme Inc' and client['description'] == 'Widgets'
+    assert first.result(timeout=5)['name'] == 'Acme Inc'
+    assert standIn.calls['PUT /v1/teams/*/clients/%s' % clientId] == 1
+    assert standIn.collections[('team', 'clients')][clientId]['description'] == 'Widgets'
+
+    # Other writes of the entity are sent after its pending updates
+    swydoClient.updateTeamClient(teamId='team', clientId=clientId, email='acme@example.com')
+    swydoClient.archiveTeamClient(teamId='team', clientId=clientId)
+    assert standIn.calls['PUT /v1/teams/*/clients/%s' % clientId] == 2
+
+    update = swydoClient.updateTeamReport(teamId='team', reportId=reportId, name='Weekly')
+    swydoClient.flushWrites()
+    assert update.done() and swydoClient.getTeamReport(teamId='team', reportId=reportId)['name'] == 'Weekly'
+    assert coalescer.getStats() == dict(updates=5, calls=3)
+    coalescer.close()
+
+    # Updates still pending when the program exits are sent then
+    subprocess.run([sys.executable, '-c', (
+        'from swydo import SwydoClient, WriteCoalescer; '
+        'SwydoClient(apiKey="key", apiUrl=%r, writeCoalescer=WriteCoalescer(window=60))'
+        '.updateTeamClient(teamId="team", clientId=%r, name="Exiting")' % (standIn.apiUrl, clientId)
+    )], check=True, timeout=60, env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)) + '/../src'))
+    assert standIn.collections[('team', 'clients')][clientId]['name'] == 'Exiting'
+    return
+
+
+def test_binary_snapshot(standIn, tmp_path):
+    """ Test writing a binary snapshot of teams, and reading it lazily.
+
+    """
+    import datetime
+    from swydo import SwydoClient
+    from swydo.snapshot import SnapshotReader, SnapshotWriter
+
+    standIn.addTeam('first', clients=30, reports=20, users=2)
+    standIn.addTeam('second', clients=5)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, pageSize=100)
+    path = str(tmp_path / 'teams.swydo')
+    odd = dict(id='odd', count=-3, big=2 ** 70, ratio=0.5, flag=True, none=None, text='x' * 100,
+               at=datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc), tags=['a', ['b']])
+    with SnapshotWriter(path) as writer:
+        assert writer.addTeam(swydoClient, 'first', entities=('clients', 'reports', 'users'), dataSources=True) == 82
+        writer.addTeam(swydoClient, 'second', entities=('clients',))
+        writer.add('custom', 'second', odd)
+
+    with SnapshotReader(path) as snapshot:
+        assert len(snapshot) == 88
+        clients = list(swydoClient.getTeamClients(teamId='first'))
+        assert snapshot.get('clients', 'first', clients[7]['id']) == clients[7]
+        assert snapshot.get('clients', 'second', clients[7]['id']) is None
+        assert snapshot.get('dataSources', 'first', clients[3]['id'])['id'] == clients[3]['id']
+        assert snapshot.get('custom', 'second', 'odd') == odd
+        assert list(snapshot.iterate('clients', teamId='first')) == clients
+        assert len(list(snapshot.iterate(teamId='second'))) == 6
+        assert sum(1 for kind, _, _ in snapshot.keys() if kind == 'reports') == 20
+
+    # An interrupted write leaves the previous snapshot in place
+    with pytest.raises(TypeError):
+        with SnapshotWriter(path) as writer:
+            writer.add('custom', 'team', dict(id='bad', value=object()))
+    assert len(SnapshotReader(path)) == 88
+
+    # Concurrent writers of a snapshot don't clash, the last one to close wins
+    first, second = SnapshotWriter(path), SnapshotWriter(path)
+    first.add('custom', 'team', dict(id='first'))
+    second.add('custom', 'team', dict(id='second'))
+    first.close()
+    second.close()
+    assert [item['id'] for item in SnapshotReader(path).iterate()] == ['second']
+    assert os.listdir(str(tmp_path)) == ['teams.swydo']
+    return
+
+
+def test_flight_recorder(standIn, tmp_path):
+    """ Test recording the timings and outcomes of calls.
+
+    """
+    import io
+    import json
+    import signal
+    from swydo import RetryPolicy, SwydoClient
+    from swydo.recorder import FlightRecorder
+
+    standIn.addTeam('team', clients=2)
+    recorder = FlightRecorder(capacity=3)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, flightRecorder=recorder,
+                              retryPolicy=RetryPolicy(initialDelay=0.01, jitter=None, maxAttempts=3))
+    path = 'GET /v1/teams/*/clients/team-clients-00000'
+    standIn.failures[path] = 1
+    standIn.throttles[path] = 1
+    swydoClient.getTeamClient(teamId='team', clientId='team-clients-00000')
+    standIn.failures[path] = 3
+    with pytest.raises(Exception):
+        swydoClient.getTeamClient(teamId='team', clientId='team-clients-00000')
+
+    retried, failed = recorder.getRecords()
+    assert retried['operationId'] == 'getTeamClient' and retried['retries'] == 2 and retried['error'] is None
+    assert retried['status'] == 200 and retried['bytes'] > 0 and retried['backoffTime'] == 0.01 + 0.02
+    assert retried['httpTime'] <= retried['duration'] and retried['paramsDigest'] == failed['paramsDigest']
+    assert failed['status'] == 500 and failed['retries'] == 2 and failed['error'] == 'HTTPInternalServerError'
+    assert recorder.getRecords(failedOnly=True) == [failed]
+
+    # Only the last calls are kept
+    for _ in range(3):
+        swydoClient.getTeam(teamId='team')
+    assert [record['operationId'] for record in recorder.getRecords()] == ['getTeam'] * 3
+    stream = io.StringIO()
+    assert recorder.dump(stream, slowerThan=60) == 0 and recorder.dump(stream) == 3
+    assert json.loads(stream.getvalue().splitlines()[0])['operationId'] == 'getTeam'
+
+    previous = signal.getsignal(signal.SIGUSR2)
+    recorder.installSignalHandler(path=str(tmp_path / 'calls.ndjson'))
+    try:
+        os.kill(os.getpid(), signal.SIGUSR2)
+    finally:
+        signal.signal(signal.SIGUSR2, previous)
+    assert len((tmp_path / 'calls.ndjson').read_text().splitlines()) == 3
+    return
+
+
+def test_all_team_items(standIn):
+    """ Test listing items of many teams concurrently, as a single stream.
+
+    """
+    import time
+    from bravado.exception import HTTPInternalServerError
+    from swydo import SwydoClient
+
+    standIn.addTeam('big', reports=200)
+    for index in range(3):
+        standIn.addTeam('small%d' % index, reports=3)
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, pageSize=20, maxCallsPerSecond=100)
+    standIn.latency = 0.02
+
+    reports = list(swydoClient.getAllReports(maxConcurrency=4, bufferSize=10))
+    assert len(reports) == 209 and len({(report['teamId'], report['id']) for report in reports}) == 209
+    # Small teams don't wait behind the big one
+    teamIds = [report['teamId'] for report in reports]
+    assert max(index for index, teamId in enumerate(teamIds) if teamId != 'big') < 50
+
+    ordered = list(swydoClient.getAllTeamItems('getTeamReports', teamIds=['small2', 'big', 'small0'], ordered=True))
+    expected = [dict(report, teamId=teamId) for teamId in ('small2', 'big', 'small0')
+                for report in swydoClient.getTeamReports(teamId=teamId)]
+    assert ordered == expected
+
+    # Closing early stops the other streams
+    clients = swydoClient.getAllClients(teamIds=['big'] * 8, maxConcurrency=8, bufferSize=1)
+    standIn.addTeam('big', clients=100)
+    next(clients)
+    clients.close()
+    calls = standIn.totalCalls
+    time.sleep(0.3)
+    assert standIn.totalCalls - calls <= 8
+
+    standIn.failures['GET /v1/teams/*/reports'] = 1
+    with pytest.raises(HTTPInternalServerError):
+        list(SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, autoRetry=False).getAllReports(teamIds=['small0']))
+    return
+
+
+def test_pagination_strategy(standIn):
+    """ Test following nextUrl, ending listings on empty pages, and tuning the page size.
+
+    """
+    from swydo import PageIterator, PageSizeTuner, PaginationCursor, SwydoClient
+
+    standIn.addTeam('team', reports=450)
+    tuner = PageSizeTuner()
+    swydoClient = SwydoClient(apiKey='key', apiUrl=standIn.apiUrl, maxCallsPerSecond=1000, pageSizeTuner=tuner)
+
+    # Pages grow from the server default of 50 to the maximum of 100: 5 pages instead of 9
+    assert len(list(swydoClient.getTeamReports(teamId='team'))) == 450
+    assert standIn.calls['GET /v1/teams/*/reports'] == 5
+    assert tuner.getPageSize('getTeamReports') == 100 and swydoClient.pageSize is None
+
+    # Slow or large pages shrink it
+    tuner.observe('getTeamReports', 100, 100, 4.0, 1000)
+    assert tuner.getPageSize('getTeamReports') == 25
+    tuner.observe('getTeamReports', 25, 25, 0.1, 2 * 1024 * 1024)
+    assert tuner.getPageSize('getTeamReports') == 10
+
+    pages = {
+        0: dict(items=[dict(id='a'), dict(id='b')], total=10, nextUrl='/v1/teams/team/reports?skip=5&limit=2'),
+        5: dict(items=[dict(id='c')], total=10, nextUrl='/v1/teams/team/reports?skip=6&limit=2'),
+        6: dict(items=[], total=10, nextUrl='/v1/teams/team/reports?skip=6&limit=2'),
+    }
+    requested = []
+
+    def fetchPage(params):
+        requested.append(params['skip'])
+        return pages[params['skip']]
+
+    # Pages start where nextUrl points to, and the empty page ends the listing although the total says otherwise
+    iterator = PageIterator(fetchPage, PaginationCursor('getTeamReports', dict(teamId='team')))
+    assert [item['id'] for item in iterator] == ['a', 'b', 'c']
+    assert requested == [0, 5, 6] and iterator.cursor.skip == 6
+
+    # A page without nextUrl is the last one, once the server provides it
+    pages[5] = dict(items=[dict(id='c')], total=10)
+    requested.clear()
+    assert [item['id'] for item in PageIterator(fetchPage, PaginationCursor('getTeamReports', {}))] == ['a', 'b', 'c']
+    assert requested == [0, 5]
+    return
+
+
 # Make the module executable.
 
 if __name__ == "__main__":